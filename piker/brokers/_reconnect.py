@@ -0,0 +1,82 @@
+# piker: trading gear for hackers
+# Copyright (C) 2018-present  Tyler Goodlet (in stewardship of piker0)
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Feed reconnection helpers.
+
+Bar buffers keep being incremented (with flat bars) by the wall clock
+while a broker feed is disconnected; on reconnect a writer re-fetches
+just the bars since the last one it wrote live and fills them in
+(see ``piker.data.fill_gap()``) before resuming live updates.
+"""
+from typing import Awaitable, Callable, Dict
+
+import numpy as np
+import trio
+
+from ._util import BrokerError
+from ..log import get_logger
+from ..data import ShmArray, fill_gap
+
+log = get_logger(__name__)
+
+
+class Backoff:
+    """Exponentially increasing retry delays.
+    """
+    def __init__(
+        self,
+        start: float = 0.5,
+        maximum: float = 30,
+    ) -> None:
+        self.start = self.delay = start
+        self.maximum = maximum
+
+    def reset(self) -> None:
+        self.delay = self.start
+
+    async def sleep(self) -> None:
+        await trio.sleep(self.delay)
+        self.delay = min(2 * self.delay, self.maximum)
+
+
+async def backfill_gaps(
+    gaps: Dict[str, float],
+    writers: Dict[str, ShmArray],
+    fetch: Callable[[str, float], Awaitable[np.ndarray]],
+) -> None:
+    """Fill the bars of each symbol's writer buffer since the time
+    ``gaps[sym]`` with those from ``fetch(sym, since)``, for all symbols
+    concurrently, retrying failed fetches until the broker is back.
+    """
+    async def fill(sym: str, since: float) -> None:
+        backoff = Backoff()
+        while True:
+            try:
+                bars = await fetch(sym, since)
+                break
+            except (OSError, BrokerError):
+                log.exception(
+                    f"Failed to fetch {sym} bars since {since}, retrying "
+                    f"in {backoff.delay}s")
+                await backoff.sleep()
+
+        n = fill_gap(writers[sym], bars)
+        log.info(f"Backfilled {n} bars of {sym} since {since}")
+
+    async with trio.open_nursery() as n:
+        for sym, since in gaps.items():
+            n.start_soon(fill, sym, since)
@@ -17,6 +17,7 @@
 """
 Console interface to broker client/daemons.
 """
+import inspect
 import os
 from functools import partial
 from operator import attrgetter
@@ -30,8 +31,9 @@ import tractor
 from ..cli import cli
 from .. import watchlists as wl
 from ..log import get_console_log, colorize_json, get_logger
-from ..data import maybe_spawn_brokerd
-from ..brokers import core, get_brokermod, data
+from ..data import open_feed, open_tick_recorder, maybe_spawn_brokerd
+from ..data._latency import record_hops, latency_report
+from ..brokers import core, get_brokermod
 
 log = get_logger('cli')
 DEFAULT_BROKER = 'questrade'
@@ -147,16 +149,29 @@ def bars(config, symbol, count, df_output):
         click.echo(colorize_json(bars))
 
 
+def _streams_to_shm(brokermod) -> bool:
+    """Whether the backend's ``stream_quotes()`` writes shm buffers and
+    can thus serve an ``open_feed()``.
+    """
+    stream_quotes = getattr(brokermod, 'stream_quotes', None)
+    return stream_quotes is not None and (
+        'shm_tokens' in inspect.signature(stream_quotes).parameters)
+
+
 @cli.command()
-@click.option('--rate', '-r', default=5, help='Logging level')
-@click.option('--filename', '-f', default='quotestream.jsonstream',
-              help='Logging level')
+@click.option('--rotate-mb', default=256,
+              help='Start a new file after this many MB')
+@click.option('--path', '-p', default=None,
+              help='Base path of the tick files, defaults to the name')
+@click.option('--rate', '-r', default=3,
+              help='Quote rate limit of polled (non-streaming) backends')
 @click.option('--dhost', '-dh', default='127.0.0.1',
               help='Daemon host address to connect to')
 @click.argument('name', nargs=1, required=True)
 @click.pass_obj
-def record(config, rate, name, dhost, filename):
-    """Record client side quotes to a file on disk
+def record(config, name, dhost, path, rotate_mb, rate):
+    """Record client side received ticks of a watchlist to binary tick
+    files on disk (see ``piker.data._recorder``).
     """
     # global opts
     brokermod = config['brokermod']
@@ -170,19 +185,102 @@ def record(config, rate, name, dhost, filename):
         log.error(f"No symbols found for watchlist `{name}`?")
         return
 
-    async def main(tries):
-        async with maybe_spawn_brokerd(
-            tries=tries, loglevel=loglevel
-        ) as portal:
-            # run app "main"
-            return await data.stream_to_file(
-                name, filename,
-                portal, tickers,
-                brokermod, rate,
-            )
-
-    filename = tractor.run(partial(main, tries=1), name='data-feed-recorder')
-    click.echo(f"Data feed recording saved to {filename}")
+    async def main():
+        async with open_tick_recorder(
+            path or name,
+            rotate_bytes=rotate_mb * 2**20,
+        ) as recorder:
+            try:
+                if _streams_to_shm(brokermod):
+                    async with open_feed(
+                        brokermod.name,
+                        tickers,
+                        loglevel=loglevel,
+                        policy='lossless',
+                    ) as feed:
+                        async for quotes in feed.stream:
+                            recorder.record(quotes)
+                else:
+                    # polled backends (eg. questrade) are recorded from
+                    # the daemon's (non shm) quote stream
+                    async with maybe_spawn_brokerd(
+                        brokermod.name,
+                        loglevel=loglevel,
+                    ) as portal:
+                        stream = await portal.run(
+                            'piker.brokers.data',
+                            'start_quote_stream',
+                            broker=brokermod.name,
+                            symbols=tickers,
+                            rate=rate,
+                        )
+                        async for quotes in stream:
+                            recorder.record(quotes)
+            finally:
+                click.echo(f"Ticks recorded to {recorder.files}")
+
+    tractor.run(
+        main,
+        name='data-feed-recorder',
+        # find (or register) the broker daemon on ``dhost``
+        arbiter_addr=(dhost, tractor._default_arbiter_port),
+    )
+
+
+@cli.command()
+@click.option('--period', '-p', default=5.,
+              help='Seconds between latency reports')
+@click.argument('symbols', nargs=-1, required=True)
+@click.pass_obj
+def latency(config, symbols, period):
+    """Trace quote latency per hop, from the broker to this client, and
+    periodically print percentiles (in ms) to the console.
+
+    If a chart is running its ``recv->render`` hop is reported as well.
+    """
+    # global opts
+    brokermod = config['brokermod']
+    loglevel = config['loglevel']
+
+    async def main():
+        async with open_feed(
+            brokermod.name,
+            symbols,
+            loglevel=loglevel,
+        ) as feed:
+
+            async def report():
+                while True:
+                    await trio.sleep(period)
+                    hops = latency_report()
+
+                    # the render hop is only recorded by the chart
+                    async with tractor.find_actor('qtractor') as portal:
+                        if portal is not None:
+                            hops.update({
+                                key: summary for key, summary in (
+                                    await portal.run(
+                                        'piker.data._latency',
+                                        'latency_report',
+                                    )
+                                ).items()
+                                if key.endswith('->render')
+                            })
+
+                    click.echo(pd.DataFrame.from_dict(hops, orient='index'))
+
+            async with trio.open_nursery() as n:
+                n.start_soon(report)
+
+                async for quotes in feed.stream:
+                    for quote in quotes.values():
+                        record_hops(quote)
+
+    tractor.run(
+        main,
+        name='latency_tracer',
+        loglevel=config['tractorloglevel'],
+    )
 
 
 # options utils
@@ -51,6 +51,21 @@ def load(
     return config, path
 
 
+def get_section(
+    name: str,
+    path: str = None,
+) -> dict:
+    """Return the ``[name]`` section of the broker config, empty if it
+    (or the config file) doesn't exist.
+    """
+    try:
+        conf, path = load(path)
+    except FileNotFoundError:
+        return {}
+
+    return conf.get(name, {})
+
+
 def write(
     config: dict,  # toml config as dict
     path: str = None,
@@ -20,7 +20,6 @@ Real-time data feed machinery
 import time
 from functools import partial
 from dataclasses import dataclass, field
-from itertools import cycle
 import socket
 import json
 from types import ModuleType
@@ -411,38 +410,26 @@ class DataFeed:
         )
 
 
-async def stream_to_file(
-    watchlist_name: str,
+def iter_packets(
     filename: str,
-    portal: tractor._portal.Portal,
-    tickers: List[str],
-    brokermod: ModuleType,
-    rate: int,
-):
-    """Record client side received quotes to file ``filename``.
+) -> typing.Iterator[Dict[str, Any]]:
+    """Lazily parse the packets of a JSON stream (``'--'`` separated)
+    quotes file.
     """
-    # an async generator instance
-    agen = await portal.run(
-        "piker.brokers.data", 'start_quote_stream',
-        broker=brokermod.name, symbols=tickers)
-
-    fname = filename or f'{watchlist_name}.jsonstream'
-    with open(fname, 'a') as f:
-        async for quotes in agen:
-            f.write(json.dumps(quotes))
-            f.write('\n--\n')
-
-    return fname
+    lines = []
+    with open(filename, 'r') as quotes_file:
+        for line in quotes_file:
+            if line.strip() == '--':
+                yield json.loads(''.join(lines))
+                lines = []
+            else:
+                lines.append(line)
 
 
 async def stream_from_file(
     filename: str,
 ):
-    with open(filename, 'r') as quotes_file:
-        content = quotes_file.read()
-
-    pkts = content.split('--')[:-1]  # simulate 2 separate quote packets
-    payloads = [json.loads(pkt) for pkt in pkts]
-    for payload in cycle(payloads):
-        yield payload
-        await trio.sleep(0.3)
+    while True:
+        for payload in iter_packets(filename):
+            yield payload
+            await trio.sleep(0.3)
@@ -21,7 +21,7 @@ Note the client runs under an ``asyncio`` loop (since ``ib_insync`` is
 built on it) and thus actor aware API calls must be spawned with
 ``infected_aio==True``.
 """
-from contextlib import asynccontextmanager, contextmanager
+from contextlib import asynccontextmanager
 from dataclasses import asdict
 from functools import partial
 from typing import List, Dict, Any, Tuple, Optional, AsyncIterator, Callable
@@ -37,6 +37,7 @@ from ib_insync.ticker import Ticker
 import ib_insync as ibis
 from ib_insync.wrapper import Wrapper
 from ib_insync.client import Client as ib_Client
+import numpy as np
 import trio
 import tractor
 
@@ -45,11 +46,22 @@ from ..data import (
     maybe_spawn_brokerd,
     iterticks,
     attach_shm_array,
-    get_shm_token,
+    activate_writer,
     subscribe_ohlc_for_increment,
+    open_derived_buffers,
+    update_derived,
+    open_tick_buffer,
+    push_ticks,
 )
 from ..data._source import from_df
+from ..data._calendar import (
+    MarketCalendar,
+    us_equities,
+    cme_globex,
+    forex,
+)
 from ._util import SymbolNotFound
+from ._reconnect import Backoff, backfill_gaps
 
 
 log = get_logger(__name__)
@@ -150,8 +162,10 @@ class Client:
         time_frame: str = '1m',
         count: int = int(2e3),  # <- max allowed per query
         is_paid_feed: bool = False,
+        duration_s: int = 5000 * 5,
     ) -> List[Dict[str, Any]]:
-        """Retreive OHLCV bars for a symbol over a range to the present.
+        """Retreive OHLCV bars for a symbol over the last ``duration_s``
+        seconds to the present.
         """
         bars_kwargs = {'whatToShow': 'TRADES'}
 
@@ -166,7 +180,7 @@ class Client:
             # durationStr='1 D',
 
             # time length calcs
-            durationStr='{count} S'.format(count=5000 * 5),
+            durationStr=f'{duration_s} S',
             barSizeSetting='5 secs',
 
             # always use extended hours
@@ -344,7 +358,11 @@ async def _aio_get_client(
 ) -> Client:
     """Return an ``ib_insync.IB`` instance wrapped in our client API.
     """
-    # first check cache for existing client
+    # first check cache for existing (still connected) client
+    client = _client_cache.get((host, port))
+    if client is not None and not client.ib.isConnected():
+        log.warning("Dropping disconnected client")
+        del _client_cache[(host, port)]
 
     try:
         yield _client_cache[(host, port)]
@@ -476,6 +494,23 @@ async def get_client(
         yield get_method_proxy(portal, Client)
 
 
+def get_calendar(symbol: str) -> MarketCalendar:
+    """Return the trading hours calendar for ``symbol`` by venue using
+    the same heuristics as ``Client.find_contract()``.
+
+    Note ``bars()`` always requests extended hours data.
+    """
+    exch = symbol.upper().rsplit('.', maxsplit=1)[-1]
+    if exch in ('GLOBEX', 'NYMEX', 'CME', 'CMECRYPTO'):
+        return cme_globex
+
+    elif exch in ('FOREX', 'CMDTY'):
+        return forex
+
+    # stonks
+    return us_equities
+
+
 # https://interactivebrokers.github.io/tws-api/tick_types.html
 tick_types = {
     77: 'trade',
@@ -490,6 +525,27 @@ tick_types = {
 }
 
 
+# ``Ticker`` fields sent with each quote mapped to their names in the
+# compact quote schema (see ``piker.data._normalize.quote_fields``)
+_ticker_fields = {
+    'bid': 'bid',
+    'bidSize': 'bsize',
+    'ask': 'ask',
+    'askSize': 'asize',
+    'last': 'last',
+    'lastSize': 'size',
+    'open': 'open',
+    'high': 'high',
+    'low': 'low',
+    'close': 'close',
+    'volume': 'volume',
+    'vwap': 'vwap',
+}
+
+# contract id -> serialized contract
+_contracts: Dict[int, dict] = {}
+
+
 def normalize(
     ticker: Ticker,
     calc_price: bool = False
@@ -511,195 +567,297 @@ def normalize(
             {'type': 'trade', 'price': ticker.marketPrice()}
         )
 
-    # serialize for transport
-    data = asdict(ticker)
+    # serialize for transport; only the (static) contract is nested
+    # and it's only serialized once
+    contract = ticker.contract
+    con = _contracts.get(contract.conId)
+    if con is None:
+        con = _contracts[contract.conId] = asdict(contract)
+
+    data = {
+        name: getattr(ticker, attr)
+        for attr, name in _ticker_fields.items()
+    }
+    data['contract'] = con
+    data['ticks'] = ticker.ticks
 
     # add time stamps for downstream latency measurements
     data['brokerd_ts'] = time.time()
 
-    # stupid stupid shit...don't even care any more..
-    # leave it until we do a proper latency study
-    # if ticker.rtTime is not None:
-    #     data['broker_ts'] = data['rtTime_s'] = float(
-    #         ticker.rtTime.timestamp) / 1000.
-    data.pop('rtTime')
+    # (last trade) time from the exchange when a "RT volume" tick
+    # was received this cycle
+    rt = ticker.rtTime
+    if rt:
+        data['broker_ts'] = (
+            rt.timestamp() if hasattr(rt, 'timestamp') else float(rt) / 1e3
+        )
 
     return data
 
 
-_local_buffer_writers = {}
+# TODO: figure out how to share quote feeds sanely despite
+# the wacky ``ib_insync`` api.
+# @tractor.msg.pub
+async def _stream_symbol(
+    sym: str,
+    shm_token: Dict[str, Any],
+    send_chan: trio.abc.SendChannel,
+    task_status=trio.TASK_STATUS_IGNORED,
+) -> None:
+    """Stream quotes for ``sym`` into ``send_chan`` and write its bar
+    buffer if no other writer exists.
 
+    The (writer's) shm token and whether we're the writer are passed
+    to ``task_status.started()`` once history has been loaded.
 
-@contextmanager
-def activate_writer(key: str):
-    try:
-        writer_already_exists = _local_buffer_writers.get(key, False)
+    The ticker stream is re-opened whenever the gateway connection is
+    lost; the bars missed meanwhile are re-fetched and filled in before
+    live updates resume.
+    """
+    # check if a writer already is alive in a streaming task,
+    # otherwise start one and mark it as now existing
+    with activate_writer(shm_token['shm_name']) as writer_already_exists:
+
+        # maybe load historical ohlcv in to shared mem
+        # check if shm has already been created by previous
+        # feed initialization
         if not writer_already_exists:
-            _local_buffer_writers[key] = True
 
-        yield writer_already_exists
-    finally:
-        _local_buffer_writers.pop(key, None)
+            shm = attach_shm_array(
+                token=shm_token,
 
+                # we are the buffer writer
+                readonly=False,
+            )
+            bars = await _trio_run_client_method(
+                method='bars',
+                symbol=sym,
+            )
 
-# TODO: figure out how to share quote feeds sanely despite
-# the wacky ``ib_insync`` api.
-# @tractor.msg.pub
-@tractor.stream
-async def stream_quotes(
-    ctx: tractor.Context,
-    symbols: List[str],
-    shm_token: Tuple[str, str, List[tuple]],
-    loglevel: str = None,
-    # compat for @tractor.msg.pub
-    topics: Any = None,
-    get_topics: Callable = None,
-) -> AsyncIterator[Dict[str, Any]]:
-    """Stream symbol quotes.
+            if bars is None:
+                raise SymbolNotFound(sym)
 
-    This is a ``trio`` callable routine meant to be invoked
-    once the brokerd is up.
-    """
-    # XXX: required to propagate ``tractor`` loglevel to piker logging
-    get_console_log(loglevel or tractor.current_actor().loglevel)
+            # write historical data to buffer
+            shm.push(bars)
+            shm_token = shm.token
 
-    # TODO: support multiple subscriptions
-    sym = symbols[0]
+            times = shm.array['time']
+            delay_s = times[-1] - times[times != times[-1]][-1]
+            subscribe_ohlc_for_increment(
+                shm,
+                delay_s,
+                calendar=get_calendar(sym),
+            )
 
-    stream = await _trio_run_client_method(
-        method='stream_ticker',
-        symbol=sym,
-    )
+            # keep higher time frame buffers in sync with the base bars
+            open_derived_buffers(shm, delay_s)
 
-    async with aclosing(stream):
+            # raw ticks for time & sales and tick fsps
+            ticks_shm = open_tick_buffer(shm)
 
-        # check if a writer already is alive in a streaming task,
-        # otherwise start one and mark it as now existing
-        with activate_writer(shm_token['shm_name']) as writer_already_exists:
+        task_status.started((shm_token, not writer_already_exists))
 
-            # maybe load historical ohlcv in to shared mem
-            # check if shm has already been created by previous
-            # feed initialization
-            if not writer_already_exists:
+        async def fetch(sym: str, since: float) -> np.ndarray:
+            # second resolution durations are limited to a day
+            return await _trio_run_client_method(
+                method='bars',
+                symbol=sym,
+                duration_s=min(int(time.time() - since) + 1, 86400),
+            )
 
-                shm = attach_shm_array(
-                    token=shm_token,
+        # time of the last bar written live; bars since are re-fetched
+        # after a reconnect
+        written = gap = None
+        backoff = Backoff()
 
-                    # we are the buffer writer
-                    readonly=False,
-                )
-                bars = await _trio_run_client_method(
-                    method='bars',
+        while True:
+            try:
+                stream = await _trio_run_client_method(
+                    method='stream_ticker',
                     symbol=sym,
                 )
+            except ConnectionError:
+                log.exception(
+                    f"Failed to connect for {sym}, retrying in "
+                    f"{backoff.delay}s")
+                await backoff.sleep()
+                continue
 
-                if bars is None:
-                    raise SymbolNotFound(sym)
+            async with aclosing(stream):
 
-                # write historical data to buffer
-                shm.push(bars)
-                shm_token = shm.token
+                if gap is not None:
+                    # fill in the bars missed while disconnected
+                    await backfill_gaps({sym: gap}, {sym: shm}, fetch)
+                    gap = None
 
-                times = shm.array['time']
-                delay_s = times[-1] - times[times != times[-1]][-1]
-                subscribe_ohlc_for_increment(shm, delay_s)
+                backoff.reset()
 
-            # pass back token, and bool, signalling if we're the writer
-            await ctx.send_yield((shm_token, not writer_already_exists))
+                # first quote can be ignored as a 2nd with newer data is sent?
+                first_ticker = await stream.__anext__()
 
-            # first quote can be ignored as a 2nd with newer data is sent?
-            first_ticker = await stream.__anext__()
+                quote = normalize(first_ticker)
 
-            quote = normalize(first_ticker)
+                # ugh, clear ticks since we've consumed them
+                # (ahem, ib_insync is stateful trash)
+                first_ticker.ticks = []
+
+                log.debug(f"First ticker received {quote}")
+
+                if type(first_ticker.contract) not in (
+                    ibis.Commodity, ibis.Forex
+                ):
+                    suffix = 'exchange'
+
+                    calc_price = False  # should be real volume for contract
+
+                    async for ticker in stream:
+                        # spin consuming tickers until we get a real
+                        # market datum
+                        if not ticker.rtTime:
+                            log.debug(f"New unsent ticker: {ticker}")
+                            continue
+                        else:
+                            log.debug("Received first real volume tick")
+                            # ugh, clear ticks since we've consumed them
+                            # (ahem, ib_insync is truly stateful trash)
+                            ticker.ticks = []
+
+                            # XXX: this works because we don't use
+                            # ``aclosing()`` above?
+                            break
+                else:
+                    # commodities don't have an exchange name for some
+                    # reason?
+                    suffix = 'secType'
+                    calc_price = True
+                    ticker = first_ticker
+
+                quote = normalize(ticker, calc_price=calc_price)
+                con = quote['contract']
+                topic = '.'.join((con['symbol'], con[suffix])).lower()
+                quote['symbol'] = topic
 
-            # ugh, clear ticks since we've consumed them
-            # (ahem, ib_insync is stateful trash)
-            first_ticker.ticks = []
+                first_quote = {topic: quote}
+                ticker.ticks = []
 
-            log.debug(f"First ticker received {quote}")
+                # yield first quote asap
+                await send_chan.send(first_quote)
 
-            if type(first_ticker.contract) not in (ibis.Commodity, ibis.Forex):
-                suffix = 'exchange'
+                # real-time stream
+                async for ticker in stream:
+                    quote = normalize(
+                        ticker,
+                        calc_price=calc_price
+                    )
+                    quote['symbol'] = topic
+                    # TODO: in theory you can send the IPC msg *before*
+                    # writing to the sharedmem array to decrease latency,
+                    # however, that will require `tractor.msg.pub` support
+                    # here or at least some way to prevent task switching
+                    # at the yield such that the array write isn't delayed
+                    # while another consumer is serviced..
+
+                    # if we are the lone tick writer start writing
+                    # the buffer with appropriate trade data
+                    if not writer_already_exists:
+                        push_ticks(
+                            ticks_shm,
+                            quote['ticks'],
+                            quote['brokerd_ts'],
+                            exchange=quote['contract'].get('exchange', ''),
+                        )
 
-                calc_price = False  # should be real volume for contract
+                        for tick in iterticks(
+                            quote, types=('trade', 'utrade',)
+                        ):
+                            last = tick['price']
+
+                            # update last entry
+                            # benchmarked in the 4-5 us range
+                            written, o, high, low, v = shm.last()[-1][
+                                ['time', 'open', 'high', 'low', 'volume']
+                            ]
+
+                            new_v = tick['size']
+
+                            if v == 0 and new_v:
+                                # no trades for this bar yet so the open
+                                # is also the close/last trade price
+                                o = last
+
+                            with shm.seqlock():
+                                shm.last()[
+                                    ['open', 'high', 'low', 'close', 'volume']
+                                ][-1] = (
+                                    o,
+                                    max(high, last),
+                                    min(low, last),
+                                    last,
+                                    v + new_v,
+                                )
+                            update_derived(shm)
+
+                        quote['shm_ts'] = time.time()
+
+                    con = quote['contract']
+                    topic = '.'.join((con['symbol'], con[suffix])).lower()
+                    quote['symbol'] = topic
+
+                    await send_chan.send({topic: quote})
+
+                    # ugh, clear ticks since we've consumed them
+                    ticker.ticks = []
+
+            # the ticker stream ends once the gateway disconnects
+            log.warning(f"Lost {sym} ticker stream, reconnecting")
+            if not writer_already_exists:
+                gap = written if written is not None else (
+                    shm.last()[-1]['time'])
 
-                async for ticker in stream:
-                    # spin consuming tickers until we get a real market datum
-                    if not ticker.rtTime:
-                        log.debug(f"New unsent ticker: {ticker}")
-                        continue
-                    else:
-                        log.debug("Received first real volume tick")
-                        # ugh, clear ticks since we've consumed them
-                        # (ahem, ib_insync is truly stateful trash)
-                        ticker.ticks = []
-
-                        # XXX: this works because we don't use
-                        # ``aclosing()`` above?
-                        break
-            else:
-                # commodities don't have an exchange name for some reason?
-                suffix = 'secType'
-                calc_price = True
-                ticker = first_ticker
-
-            quote = normalize(ticker, calc_price=calc_price)
-            con = quote['contract']
-            topic = '.'.join((con['symbol'], con[suffix])).lower()
-            quote['symbol'] = topic
-
-            first_quote = {topic: quote}
-            ticker.ticks = []
+            await backoff.sleep()
 
-            # yield first quote asap
-            await ctx.send_yield(first_quote)
 
-            # real-time stream
-            async for ticker in stream:
-                quote = normalize(
-                    ticker,
-                    calc_price=calc_price
-                )
-                quote['symbol'] = topic
-                # TODO: in theory you can send the IPC msg *before*
-                # writing to the sharedmem array to decrease latency,
-                # however, that will require `tractor.msg.pub` support
-                # here or at least some way to prevent task switching
-                # at the yield such that the array write isn't delayed
-                # while another consumer is serviced..
-
-                # if we are the lone tick writer start writing
-                # the buffer with appropriate trade data
-                if not writer_already_exists:
-                    for tick in iterticks(quote, types=('trade', 'utrade',)):
-                        last = tick['price']
-
-                        # update last entry
-                        # benchmarked in the 4-5 us range
-                        o, high, low, v = shm.array[-1][
-                            ['open', 'high', 'low', 'volume']
-                        ]
-
-                        new_v = tick['size']
-
-                        if v == 0 and new_v:
-                            # no trades for this bar yet so the open
-                            # is also the close/last trade price
-                            o = last
-
-                        shm.array[['open', 'high', 'low', 'close', 'volume']][-1] = (
-                            o,
-                            max(high, last),
-                            min(low, last),
-                            last,
-                            v + new_v,
-                        )
+@tractor.stream
+async def stream_quotes(
+    ctx: tractor.Context,
+    symbols: List[str],
+    shm_tokens: Dict[str, Dict[str, Any]],
+    loglevel: str = None,
+    # compat for @tractor.msg.pub
+    topics: Any = None,
+    get_topics: Callable = None,
+) -> AsyncIterator[Dict[str, Any]]:
+    """Stream symbol quotes.
 
-                con = quote['contract']
-                topic = '.'.join((con['symbol'], con[suffix])).lower()
-                quote['symbol'] = topic
+    This is a ``trio`` callable routine meant to be invoked
+    once the brokerd is up.
 
-                await ctx.send_yield({topic: quote})
+    A ticker stream (and bar buffer writer) task is started per symbol
+    and their quotes are multiplexed on to the single IPC stream.
+    """
+    # XXX: required to propagate ``tractor`` loglevel to piker logging
+    get_console_log(loglevel or tractor.current_actor().loglevel)
 
-                # ugh, clear ticks since we've consumed them
-                ticker.ticks = []
+    send_chan, recv_chan = trio.open_memory_channel(0)
+    tokens, writers = {}, {}
+
+    async with trio.open_nursery() as n:
+
+        async def start(sym: str) -> None:
+            tokens[sym], writers[sym] = await n.start(
+                _stream_symbol,
+                sym,
+                shm_tokens[sym],
+                send_chan,
+            )
+
+        # load history for all symbols concurrently
+        async with trio.open_nursery() as starters:
+            for sym in symbols:
+                starters.start_soon(start, sym)
+
+        # pass back tokens, and bools, signalling if we're the writer
+        await ctx.send_yield((tokens, writers))
+
+        async for quote in recv_chan:
+            await ctx.send_yield(quote)
@@ -17,9 +17,9 @@
 """
 Kraken backend.
 """
-from contextlib import asynccontextmanager
-from dataclasses import dataclass, asdict, field
-from typing import List, Dict, Any, Tuple, Optional
+from contextlib import asynccontextmanager, ExitStack
+from typing import List, Dict, Any, Optional
+import math
 import json
 import time
 
@@ -31,14 +31,23 @@ import numpy as np
 import trio
 import tractor
 
+from . import config
 from ._util import resproc, SymbolNotFound, BrokerError
+from ._reconnect import Backoff, backfill_gaps
 from ..log import get_logger, get_console_log
 from ..data import (
     # iterticks,
-    attach_shm_array,
-    get_shm_token,
+    ShmArray,
+    open_writers,
+    writers_msg,
     subscribe_ohlc_for_increment,
+    open_derived_buffers,
+    write_trades,
+    splice_history,
+    prepend_history,
+    open_tick_buffer,
 )
+from ..data._source import tick_dtype, tick_types
 
 log = get_logger(__name__)
 
@@ -64,6 +73,91 @@ _ohlc_dtype = [
 # (historical) fields can be exposed.
 ohlc_dtype = np.dtype(_ohlc_dtype)
 
+# XXX: crypto markets never close but bar buffers are *not* opened in
+# (wrapping) ring mode since the chart and fsp engine aren't wrap aware
+# (``.array`` is a copy once wrapped so in place writes through it are
+# lost); full (file backed) buffers instead drop their oldest bars
+# (see ``ShmArray.make_room()``).
+_shm_ring: bool = False
+
+# keep bar history on disk between sessions such that only the
+# (usually short) gap since the last run needs to be backfilled.
+_shm_persist: bool = True
+
+# min spacing of (paginated) history requests to stay within the
+# public api rate limit of ~1 call per second
+_public_rate_s: float = 1
+
+# deep history is fetched as trade pages (the ``OHLC`` endpoint only
+# serves the latest 720 bars) in concurrently paginated time windows
+_history_days: float = 7
+_history_window_s: int = 6 * 60 * 60
+_history_concurrency: int = 4
+_trades_page_size: int = 1000
+
+# (1m) bars reserved in front of the latest bars for the backfill
+_shm_prepend_size: int = int(_history_days * 24 * 60)
+
+
+def get_config() -> Dict[str, Any]:
+    return config.get_section('kraken')
+
+
+def decode_trades(rows: List[list]) -> np.ndarray:
+    """Decode a batch of ``[price, volume, time, side, type, misc]``
+    trade rows (as sent by both the rest and ws apis) into a
+    ``tick_dtype`` array.
+    """
+    trades = np.array([row[:3] for row in rows], dtype=float)
+    ticks = np.zeros(len(trades), dtype=tick_dtype)
+    if len(trades):
+        ticks['price'], ticks['size'], ticks['time'] = trades.T
+    ticks['type'] = tick_types.index('trade')
+    ticks['exchange'] = 'kraken'
+    return ticks
+
+
+def trades_to_bars(
+    ticks: np.ndarray,
+    period_s: int = 60,
+) -> np.ndarray:
+    """Aggregate time ordered trade ``ticks`` into contiguous
+    ``period_s`` bars; periods without trades get flat bars at the
+    last close.
+    """
+    t = ticks['time']
+    buckets = (t - t % period_s).astype(int)
+    starts = np.r_[0, np.flatnonzero(np.diff(buckets)) + 1]
+    ends = np.r_[starts[1:], len(ticks)] - 1
+    prices = ticks['price']
+    sizes = ticks['size']
+
+    first = buckets[0]
+    n = (buckets[-1] - first) // period_s + 1
+    pos = (buckets[starts] - first) // period_s
+
+    # forward fill the index of the last bar with trades
+    filled = np.zeros(n, dtype=int)
+    filled[pos] = np.arange(len(pos))
+    has = np.zeros(n, dtype=bool)
+    has[pos] = True
+    filled = np.maximum.accumulate(np.where(has, filled, 0))
+
+    closes = prices[ends][filled]
+    volumes = np.add.reduceat(sizes, starts)
+
+    bars = np.zeros(n, dtype=_ohlc_dtype)
+    bars['index'] = np.arange(n)
+    bars['time'] = first + period_s * np.arange(n)
+    bars['open'] = bars['high'] = bars['low'] = bars['close'] = closes
+    bars['vwap'] = (np.add.reduceat(prices * sizes, starts) / volumes)[filled]
+    bars['open'][pos] = prices[starts]
+    bars['high'][pos] = np.maximum.reduceat(prices, starts)
+    bars['low'][pos] = np.minimum.reduceat(prices, starts)
+    bars['volume'][pos] = volumes
+    bars['count'][pos] = np.diff(np.r_[starts, len(ticks)])
+    return bars
+
 
 class Client:
 
@@ -74,6 +168,8 @@ class Client:
             'User-Agent':
                 'krakenex/2.1.0 (+https://github.com/veox/python3-krakenex)'
         })
+        self._pace_lock = trio.Lock()
+        self._last_paced = -math.inf
 
     async def _public(
         self,
@@ -87,6 +183,64 @@ class Client:
         )
         return resproc(resp, log)
 
+    async def _paced_public(
+        self,
+        method: str,
+        data: dict,
+    ) -> Dict[str, Any]:
+        """Make a public api call spaced at least ``_public_rate_s``
+        after the last paced call, backing off while rate limited.
+        """
+        backoff = Backoff(start=_public_rate_s)
+        while True:
+            async with self._pace_lock:
+                await trio.sleep_until(self._last_paced + _public_rate_s)
+                self._last_paced = trio.current_time()
+
+            resp = await self._public(method, data)
+            err = resp['error']
+            if err and any('Too many requests' in e for e in err):
+                log.warning(f"Rate limited, backing off {backoff.delay}s")
+                await backoff.sleep()
+                continue
+
+            if err:
+                raise BrokerError(err)
+
+            return resp
+
+    async def trades(
+        self,
+        symbol: str,
+        start: float,
+        end: float,
+    ) -> np.ndarray:
+        """Return all trades of ``symbol`` in ``[start, end)`` as
+        a ``tick_dtype`` array, paginating (paced) trade pages forward
+        from ``start``.
+        """
+        pages = []
+        since = int(start * 1e9)
+        while True:
+            res = (await self._paced_public(
+                'Trades',
+                {'pair': symbol, 'since': str(since)},
+            ))['result']
+            since = int(res.pop('last'))
+            rows = next(iter(res.values()))
+
+            ticks = decode_trades(rows)
+            pages.append(ticks)
+            if (
+                len(rows) < _trades_page_size
+                or not len(ticks)
+                or ticks['time'][-1] >= end
+            ):
+                break
+
+        ticks = np.concatenate(pages)
+        return ticks[(ticks['time'] >= start) & (ticks['time'] < end)]
+
     async def symbol_info(
         self,
         pair: str = 'all',
@@ -122,76 +276,42 @@ class Client:
             res = json['result']
             res.pop('last')
             bars = next(iter(res.values()))
-
-            new_bars = []
-
-            first = bars[0]
-            last_nz_vwap = first[-3]
-            if last_nz_vwap == 0:
-                # use close if vwap is zero
-                last_nz_vwap = first[-4]
-
-            # convert all fields to native types
-            for i, bar in enumerate(bars):
-                # normalize weird zero-ed vwap values..cmon kraken..
-                # indicates vwap didn't change since last bar
-                vwap = float(bar.pop(-3))
-                if vwap != 0:
-                    last_nz_vwap = vwap
-                if vwap == 0:
-                    vwap = last_nz_vwap
-
-                # re-insert vwap as the last of the fields
-                bar.append(vwap)
-
-                new_bars.append(
-                    (i,) + tuple(
-                        ftype(bar[j]) for j, (name, ftype) in enumerate(
-                            _ohlc_dtype[1:]
-                        )
-                    )
-                )
-            array = np.array(new_bars, dtype=_ohlc_dtype) if as_np else bars
-            return array
         except KeyError:
             raise SymbolNotFound(json['error'][0] + f': {symbol}')
 
+        if not as_np:
+            return bars
+
+        # [time, open, high, low, close, vwap, volume, count]
+        raw = np.array(bars, dtype=float)
+        times, o, h, l, c, vwap, volume, count = raw.T
+
+        # normalize weird zero-ed vwap values..cmon kraken..
+        # indicates vwap didn't change since last bar, so forward fill
+        # the last non-zero one (or first close)
+        if len(vwap) and vwap[0] == 0:
+            vwap[0] = c[0]
+        nz = np.where(vwap != 0, np.arange(len(vwap)), 0)
+        vwap = vwap[np.maximum.accumulate(nz)]
+
+        array = np.zeros(len(raw), dtype=_ohlc_dtype)
+        array['index'] = np.arange(len(raw))
+        array['time'] = times
+        array['open'] = o
+        array['high'] = h
+        array['low'] = l
+        array['close'] = c
+        array['volume'] = volume
+        array['count'] = count
+        array['vwap'] = vwap
+        return array
+
 
 @asynccontextmanager
 async def get_client() -> Client:
     yield Client()
 
 
-@dataclass
-class OHLC:
-    """Description of the flattened OHLC quote format.
-
-    For schema details see:
-        https://docs.kraken.com/websockets/#message-ohlc
-    """
-    chan_id: int  # internal kraken id
-    chan_name: str  # eg. ohlc-1  (name-interval)
-    pair: str  # fx pair
-    time: float  # Begin time of interval, in seconds since epoch
-    etime: float  # End time of interval, in seconds since epoch
-    open: float  # Open price of interval
-    high: float  # High price within interval
-    low: float  # Low price within interval
-    close: float  # Close price of interval
-    vwap: float  # Volume weighted average price within interval
-    volume: float  # Accumulated volume **within interval**
-    count: int  # Number of trades within interval
-    # (sampled) generated tick data
-    ticks: List[Any] = field(default_factory=list)
-
-    # XXX: ugh, super hideous.. needs built-in converters.
-    def __post_init__(self):
-        for f, val in self.__dataclass_fields__.items():
-            if f == 'ticks':
-                continue
-            setattr(self, f, val.type(getattr(self, f)))
-
-
 async def recv_msg(recv):
     too_slow_count = last_hb = 0
 
@@ -228,9 +348,9 @@ async def recv_msg(recv):
         else:
             chan_id, *payload_array, chan_name, pair = msg
 
-            if 'ohlc' in chan_name:
+            if 'trade' in chan_name:
 
-                yield 'ohlc', OHLC(chan_id, chan_name, pair, *payload_array[0])
+                yield 'trades', (pair, decode_trades(payload_array[0]))
 
             elif 'spread' in chan_name:
 
@@ -257,22 +377,6 @@ async def recv_msg(recv):
                 print(f'UNHANDLED MSG: {msg}')
 
 
-def normalize(
-    ohlc: OHLC,
-) -> dict:
-    quote = asdict(ohlc)
-    quote['broker_ts'] = quote['time']
-    quote['brokerd_ts'] = time.time()
-    quote['symbol'] = quote['pair'] = quote['pair'].replace('/', '')
-
-    # seriously eh? what's with this non-symmetry everywhere
-    # in subscription systems...
-    topic = quote['pair'].replace('/', '')
-
-    # print(quote)
-    return topic, quote
-
-
 def make_sub(pairs: List[str], data: Dict[str, Any]) -> Dict[str, str]:
     """Create a request subscription packet dict.
 
@@ -288,21 +392,108 @@ def make_sub(pairs: List[str], data: Dict[str, Any]) -> Dict[str, str]:
     }
 
 
+async def load_history(
+    client: Client,
+    symbol: str,
+    shm: ShmArray,
+) -> ShmArray:
+    """Load (or backfill any persisted) bar history for ``symbol`` into
+    ``shm``, start incrementing it and open its derived time frame and
+    tick buffers; return the latter.
+    """
+    if len(shm.array):
+        # restored from a prior session, backfill the gap
+        since = int(shm.last()[-1]['time'])
+        bars = await client.bars(symbol=symbol, since=since)
+        n = splice_history(shm, bars)
+        log.info(f"Backfilled {n} bars of {symbol} since {since}")
+    else:
+        bars = await client.bars(symbol=symbol)
+        shm.push(bars)
+
+    times = shm.array['time']
+    delay_s = times[-1] - times[times != times[-1]][-1]
+    subscribe_ohlc_for_increment(shm, delay_s)
+
+    # keep higher time frame buffers in sync with the base bars
+    open_derived_buffers(shm, delay_s)
+
+    # raw trades for time & sales and tick fsps
+    return open_tick_buffer(shm)
+
+
+async def backfill_history(
+    client: Client,
+    symbol: str,
+    shm: ShmArray,
+    days: float = _history_days,
+) -> None:
+    """Extend the bar history of ``symbol`` in ``shm`` back to ``days``
+    ago (or as far as the buffer has room for) from trade pages.
+
+    Time windows of trades are fetched concurrently (paced by the
+    client) and prepended, as bars, newest window first such that the
+    buffer stays contiguous while older history keeps arriving.
+    """
+    times = shm.array['time']
+    period_s = int(times[-1] - times[times != times[-1]][-1])
+    end = int(times[0])
+    start = max(end - int(days * 24 * 60 * 60), 1499000000)
+    start -= start % period_s
+
+    windows = [
+        (max(w_end - _history_window_s, start), w_end)
+        for w_end in range(end, start, -_history_window_s)
+    ]
+    if not windows:
+        return
+
+    results = [None] * len(windows)
+    done = [trio.Event() for _ in windows]
+    limiter = trio.CapacityLimiter(_history_concurrency)
+
+    async def fetch(i: int, w_start: float, w_end: float) -> None:
+        async with limiter:
+            results[i] = await client.trades(symbol, w_start, w_end)
+        done[i].set()
+
+    async with trio.open_nursery() as n:
+        for i, (w_start, w_end) in enumerate(windows):
+            n.start_soon(fetch, i, w_start, w_end)
+
+        # prepend in order as windows complete
+        total = 0
+        for i, (w_start, w_end) in enumerate(windows):
+            await done[i].wait()
+            ticks, results[i] = results[i], None
+            if not len(ticks):
+                continue
+
+            prepended = prepend_history(shm, trades_to_bars(ticks, period_s))
+            total += prepended
+            if not prepended:
+                # buffer is full
+                n.cancel_scope.cancel()
+                break
+
+    log.info(f"Backfilled {total} bars of {symbol} history")
+
+
 # @tractor.msg.pub
 async def stream_quotes(
     # get_topics: Callable,
-    shm_token: Tuple[str, str, List[tuple]],
+    shm_tokens: Dict[str, dict],
     symbols: List[str] = ['XBTUSD', 'XMRUSD'],
-    # These are the symbols not expected by the ws api
-    # they are looked up inside this routine.
-    sub_type: str = 'ohlc',
     loglevel: str = None,
     # compat with eventual ``tractor.msg.pub``
     topics: Optional[List[str]] = None,
 ) -> None:
-    """Subscribe for ohlc stream of quotes for ``pairs``.
+    """Subscribe for trade and L1 (spread) streams of quotes for ``pairs``.
 
     ``pairs`` must be formatted <crypto_symbol>/<fiat_symbol>.
+
+    The bar buffer of each symbol in ``shm_tokens`` which has no
+    writer yet is written from this single ws connection.
     """
     # XXX: required to propagate ``tractor`` loglevel to piker logging
     get_console_log(loglevel or tractor.current_actor().loglevel)
@@ -314,144 +505,147 @@ async def stream_quotes(
         for sym in symbols:
             ws_pairs[sym] = (await client.symbol_info(sym))['wsname']
 
-        # maybe load historical ohlcv in to shared mem
-        # check if shm has already been created by previous
-        # feed initialization
-        writer_exists = get_shm_token(shm_token['shm_name'])
-
-        symbol = symbols[0]
-
-        if not writer_exists:
-            shm = attach_shm_array(
-                token=shm_token,
-                # we are writer
-                readonly=False,
-            )
-            bars = await client.bars(symbol=symbol)
-
-            shm.push(bars)
-            shm_token = shm.token
+        # ws pair name -> symbol
+        pairs_to_syms = {ws: sym for sym, ws in ws_pairs.items()}
+
+        with ExitStack() as stack:
+
+            # check if a writer already is alive in a streaming task,
+            # otherwise register this one as the writer
+            writers = stack.enter_context(open_writers(shm_tokens, symbols))
+
+            # maybe load historical ohlcv in to shared mem, for all
+            # symbols concurrently
+            ticks_shms = {}
+
+            async def load(sym: str) -> None:
+                ticks_shms[sym] = await load_history(
+                    client, sym, writers[sym])
+
+            async with trio.open_nursery() as n:
+                for sym in writers:
+                    n.start_soon(load, sym)
+
+            # pass back tokens, and bools, signalling if we're the writer
+            yield writers_msg(shm_tokens, symbols, writers)
+
+            # fill in deep history in the background, cancelled with
+            # this stream, such that recent bars are served right away
+            days = get_config().get('history_days', _history_days)
+
+            async def backfill(sym: str) -> None:
+                with trio.CancelScope() as cs:
+                    stack.callback(cs.cancel)
+                    try:
+                        await backfill_history(client, sym, writers[sym], days)
+                    except (OSError, BrokerError):
+                        log.exception(f"Failed to backfill {sym} history")
+
+            for sym in writers:
+                # XXX: an async gen can't (safely) yield inside a nursery
+                trio.lowlevel.spawn_system_task(backfill, sym)
+
+            async def fetch(sym: str, since: float) -> np.ndarray:
+                return await client.bars(symbol=sym, since=int(since) - 1)
+
+            # time of the last bar written live per symbol; bars since
+            # are re-fetched after a reconnect
+            written = {}
+            gaps = {}
+            backoff = Backoff()
+
+            while True:
+                if gaps:
+                    # fill in the bars missed while disconnected before
+                    # resuming live updates
+                    await backfill_gaps(gaps, writers, fetch)
+                    gaps = {}
+
+                try:
+                    async with trio_websocket.open_websocket_url(
+                        'wss://ws.kraken.com',
+                    ) as ws:
+                        backoff.reset()
+
+                        # XXX: setup subs
+                        # https://docs.kraken.com/websockets/#message-subscribe
+                        # specific logic for this in kraken's shitty sync
+                        # client:
+                        # https://github.com/krakenfx/kraken-wsclient-py/blob/master/kraken_wsclient_py/kraken_wsclient_py.py#L188
+                        trade_sub = make_sub(
+                            list(ws_pairs.values()),
+                            {'name': 'trade'}
+                        )
 
-            times = shm.array['time']
-            delay_s = times[-1] - times[times != times[-1]][-1]
-            subscribe_ohlc_for_increment(shm, delay_s)
+                        # TODO: we want to eventually allow unsubs which
+                        # should be completely fine to request from
+                        # a separate task since internally the ws methods
+                        # appear to be FIFO locked.
+                        await ws.send_message(json.dumps(trade_sub))
 
-        yield shm_token, not writer_exists
+                        # trade data (aka L1)
+                        l1_sub = make_sub(
+                            list(ws_pairs.values()),
+                            {'name': 'spread'}  # 'depth': 10}
 
-        while True:
-            try:
-                async with trio_websocket.open_websocket_url(
-                    'wss://ws.kraken.com',
-                ) as ws:
-
-                    # XXX: setup subs
-                    # https://docs.kraken.com/websockets/#message-subscribe
-                    # specific logic for this in kraken's shitty sync client:
-                    # https://github.com/krakenfx/kraken-wsclient-py/blob/master/kraken_wsclient_py/kraken_wsclient_py.py#L188
-                    ohlc_sub = make_sub(
-                        list(ws_pairs.values()),
-                        {'name': 'ohlc', 'interval': 1}
-                    )
-
-                    # TODO: we want to eventually allow unsubs which should
-                    # be completely fine to request from a separate task
-                    # since internally the ws methods appear to be FIFO
-                    # locked.
-                    await ws.send_message(json.dumps(ohlc_sub))
-
-                    # trade data (aka L1)
-                    l1_sub = make_sub(
-                        list(ws_pairs.values()),
-                        {'name': 'spread'}  # 'depth': 10}
-
-                    )
-                    await ws.send_message(json.dumps(l1_sub))
-
-                    async def recv():
-                        return json.loads(await ws.get_message())
-
-                    # pull a first quote and deliver
-                    msg_gen = recv_msg(recv)
-                    typ, ohlc_last = await msg_gen.__anext__()
-
-                    topic, quote = normalize(ohlc_last)
-
-                    # packetize as {topic: quote}
-                    yield {topic: quote}
-
-                    # keep start of last interval for volume tracking
-                    last_interval_start = ohlc_last.etime
-
-                    # start streaming
-                    async for typ, ohlc in msg_gen:
-
-                        if typ == 'ohlc':
-
-                            # TODO: can get rid of all this by using
-                            # ``trades`` subscription...
-
-                            # generate tick values to match time & sales pane:
-                            # https://trade.kraken.com/charts/KRAKEN:BTC-USD?period=1m
-                            volume = ohlc.volume
-
-                            # new interval
-                            if ohlc.etime > last_interval_start:
-                                last_interval_start = ohlc.etime
-                                tick_volume = volume
-                            else:
-                                # this is the tick volume *within the interval*
-                                tick_volume = volume - ohlc_last.volume
-
-                            last = ohlc.close
-                            if tick_volume:
-                                ohlc.ticks.append({
-                                    'type': 'trade',
-                                    'price': last,
-                                    'size': tick_volume,
-                                })
-
-                            topic, quote = normalize(ohlc)
-
-                            # if we are the lone tick writer start writing
-                            # the buffer with appropriate trade data
-                            if not writer_exists:
-                                # update last entry
-                                # benchmarked in the 4-5 us range
-                                o, high, low, v = shm.array[-1][
-                                    ['open', 'high', 'low', 'volume']
-                                ]
-                                new_v = tick_volume
-
-                                if v == 0 and new_v:
-                                    # no trades for this bar yet so the open
-                                    # is also the close/last trade price
-                                    o = last
-
-                                # write shm
-                                shm.array[
-                                    ['open',
-                                     'high',
-                                     'low',
-                                     'close',
-                                     'vwap',
-                                     'volume']
-                                ][-1] = (
-                                    o,
-                                    max(high, last),
-                                    min(low, last),
-                                    last,
-                                    ohlc.vwap,
-                                    volume,
-                                )
-                            ohlc_last = ohlc
-
-                        elif typ == 'l1':
-                            quote = ohlc
-                            topic = quote['symbol']
-
-                        # XXX: format required by ``tractor.msg.pub``
-                        # requires a ``Dict[topic: str, quote: dict]``
-                        yield {topic: quote}
-
-            except (ConnectionClosed, DisconnectionTimeout):
-                log.exception("Good job kraken...reconnecting")
+                        )
+                        await ws.send_message(json.dumps(l1_sub))
+
+                        async def recv():
+                            return json.loads(await ws.get_message())
+
+                        # start streaming
+                        async for typ, msg in recv_msg(recv):
+
+                            if typ == 'trades':
+                                pair, ticks = msg
+                                topic = pair.replace('/', '')
+                                prices = ticks['price']
+                                sizes = ticks['size']
+
+                                quote = {
+                                    'symbol': topic,
+                                    'last': prices[-1].item(),
+                                    'broker_ts': ticks['time'][-1].item(),
+                                    'brokerd_ts': time.time(),
+                                    'ticks': [
+                                        {
+                                            'type': 'trade',
+                                            'price': price,
+                                            'size': size,
+                                        }
+                                        for price, size in zip(
+                                            prices.tolist(), sizes.tolist())
+                                    ],
+                                }
+
+                                # if we are the lone tick writer write the
+                                # whole batch of trades to the buffers
+                                sym = pairs_to_syms.get(pair)
+                                shm = writers.get(sym)
+                                if shm is not None:
+                                    ticks_shms[sym].push(ticks)
+                                    written[sym] = shm.last()[-1]['time']
+                                    write_trades(shm, prices, sizes)
+                                    quote['shm_ts'] = time.time()
+
+                            elif typ == 'l1':
+                                quote = msg
+                                topic = quote['symbol']
+
+                            # XXX: format required by ``tractor.msg.pub``
+                            # requires a ``Dict[topic: str, quote: dict]``
+                            yield {topic: quote}
+
+                except (
+                    ConnectionClosed,
+                    DisconnectionTimeout,
+                    trio_websocket.HandshakeError,
+                    OSError,
+                ):
+                    log.exception("Good job kraken...reconnecting")
+                    gaps = {
+                        sym: written.get(sym, shm.last()[-1]['time'])
+                        for sym, shm in writers.items()
+                    }
+                    await backoff.sleep()
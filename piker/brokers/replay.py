@@ -0,0 +1,261 @@
+# piker: trading gear for hackers
+# Copyright (C) 2018-present  Tyler Goodlet (in stewardship of piker0)
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Recorded feed replay backend.
+
+Replays a recording of feed quote packets (``{topic: quote}`` msgs)
+with their original timing, optionally sped up, through the same shm
+bar and tick buffer writer paths as the live backends such that
+charts, fsps and ingest can be exercised offline.
+
+Set up in the ``[replay]`` section of ``brokers.toml``:
+
+    [replay]
+    # tick files (see ``piker record``), or a json stream file
+    path = "/path/to/recording.*.ticks"
+    speed = 100  # 1 is real-time, 0 is as fast as possible
+    start = 1607000000  # optional epoch time to seek to
+"""
+from glob import glob
+from typing import List, Dict, Any, Iterator, AsyncIterator, Optional, Tuple
+import os
+import time
+
+import numpy as np
+import trio
+import tractor
+
+from . import config
+from ._util import BrokerError
+from .data import iter_packets as iter_json_packets
+from ..log import get_logger, get_console_log
+from ..data import (
+    ShmArray,
+    open_writers,
+    writers_msg,
+    open_derived_buffers,
+    write_trades,
+    open_tick_buffer,
+    push_ticks,
+)
+from ..data._buffer import roll_derived
+from ..data._normalize import match_symbol
+from ..data._recorder import iter_packets
+
+log = get_logger(__name__)
+
+
+# bars are built from the replayed trades
+_bar_period_s: int = 60
+
+
+def get_config() -> Dict[str, Any]:
+    """Return the replay recording path and speed multiplier.
+    """
+    section = config.get_section('replay')
+    if 'path' not in section:
+        raise BrokerError(
+            "No recording `path` set in the [replay] section of "
+            f"{config.get_broker_conf_path()}")
+
+    return {
+        'path': section['path'],
+        'speed': float(section.get('speed', 1)),
+        'start': section.get('start'),
+    }
+
+
+def open_recording(
+    path: str,
+    start: Optional[float] = None,
+) -> Iterator[Dict[str, dict]]:
+    """Lazily read the packets of the (rotated) tick files matching
+    glob ``path`` or of a json stream file.
+    """
+    if path.endswith('.ticks'):
+        paths = sorted(glob(os.path.expanduser(path)))
+        if not paths:
+            raise BrokerError(f"No tick files match {path}")
+
+        return iter_packets(paths, start=start)
+
+    packets = iter_json_packets(os.path.expanduser(path))
+    if start is not None:
+        packets = (
+            p for p in packets if (packet_time(p) or start) >= start)
+
+    return packets
+
+
+def packet_time(packet: Dict[str, dict]) -> Optional[float]:
+    """Return the (latest) time stamp of the quotes in ``packet``.
+    """
+    times = [
+        quote.get('broker_ts') or quote.get('brokerd_ts')
+        for quote in packet.values()
+    ]
+    times = [t for t in times if t]
+    return max(times) if times else None
+
+
+async def replay(
+    packets: Iterator[Dict[str, dict]],
+    speed: float = 1,
+) -> AsyncIterator[Tuple[float, Dict[str, dict]]]:
+    """Deliver ``(time, packet)`` pairs with their original spacing
+    divided by ``speed``; a ``speed`` of 0 delivers as fast as possible.
+
+    Packets without a time stamp are delivered at the last one.
+    """
+    start = None
+    t = 0
+    for packet in packets:
+        t = packet_time(packet) or t
+        if speed:
+            if start is None:
+                start = (t, trio.current_time())
+
+            t0, wall0 = start
+            await trio.sleep_until(wall0 + (t - t0) / speed)
+        else:
+            await trio.sleep(0)
+
+        yield t, packet
+
+
+def trades(quote: dict) -> Tuple[np.ndarray, np.ndarray]:
+    """Return the prices and sizes of the trade ticks of ``quote``.
+    """
+    rows = [
+        (tick['price'], tick.get('size') or 0)
+        for tick in quote.get('ticks', ())
+        if tick.get('type') in ('trade', 'utrade')
+    ]
+    prices, sizes = np.array(rows, dtype=float).reshape(-1, 2).T
+    return prices, sizes
+
+
+def write_bar_trades(
+    shm: ShmArray,
+    t: float,
+    prices: np.ndarray,
+    sizes: np.ndarray,
+    period_s: int = _bar_period_s,
+) -> None:
+    """Write a batch of trades at time ``t`` to the bar buffer ``shm``
+    (see ``write_trades()``), first starting a new bar if ``t`` falls
+    after the last bar's period.
+    """
+    if not len(prices):
+        return
+
+    bucket = t - t % period_s
+    if not len(shm.array) or bucket > shm.last()[-1]['time']:
+        bar = np.zeros(1, dtype=shm.array.dtype)
+        if len(shm.array):
+            bar['index'] = shm.last()[-1]['index'] + 1
+        bar['time'] = bucket
+        shm.push(bar)
+        roll_derived(shm)
+
+    write_trades(shm, prices, sizes)
+
+
+async def stream_quotes(
+    shm_tokens: Dict[str, dict],
+    symbols: List[str],
+    loglevel: str = None,
+    # compat with eventual ``tractor.msg.pub``
+    topics: Optional[List[str]] = None,
+) -> None:
+    """Replay the configured recording's quotes for ``symbols``.
+
+    The bar buffer of each symbol in ``shm_tokens`` which has no
+    writer yet is written from the replayed trades; bars are stepped by
+    the recording's clock (not the wall clock).
+    """
+    # XXX: required to propagate ``tractor`` loglevel to piker logging
+    get_console_log(loglevel or tractor.current_actor().loglevel)
+
+    conf = get_config()
+    packets = open_recording(conf['path'], start=conf['start'])
+
+    with open_writers(shm_tokens, symbols) as writers:
+
+        # seed each (empty) buffer with a first bar from the first trade
+        # in the recording such that consumers have "history" to load;
+        # packets read ahead are replayed as normal
+        ahead = []
+        unseeded = {sym for sym, shm in writers.items() if not len(shm.array)}
+        for packet in packets if unseeded else ():
+            ahead.append(packet)
+            t = packet_time(packet) or 0
+            for topic, quote in packet.items():
+                sym = match_symbol(topic, unseeded)
+                if sym is None:
+                    continue
+
+                prices, _ = trades(quote)
+                if len(prices):
+                    write_bar_trades(writers[sym], t, prices[:1], [0])
+                    unseeded.discard(sym)
+
+            if not unseeded:
+                break
+
+        ticks_shms = {}
+        for sym, shm in writers.items():
+            open_derived_buffers(shm, _bar_period_s)
+            ticks_shms[sym] = open_tick_buffer(shm)
+
+        # pass back tokens, and bools, signalling if we're the writer
+        yield writers_msg(shm_tokens, symbols, writers)
+
+        async for t, packet in replay(
+            (p for ps in (ahead, packets) for p in ps),
+            speed=conf['speed'],
+        ):
+            msg = {}
+            for topic, quote in packet.items():
+                sym = match_symbol(topic, symbols)
+                if sym is None:
+                    continue
+
+                # keep the recorded stamp out of latency tracing but
+                # available to consumers
+                if 'broker_ts' in quote:
+                    quote['recorded_broker_ts'] = quote.pop('broker_ts')
+                quote['brokerd_ts'] = time.time()
+
+                shm = writers.get(sym)
+                if shm is not None:
+                    push_ticks(
+                        ticks_shms[sym],
+                        quote.get('ticks', ()),
+                        t,
+                        exchange='replay',
+                    )
+                    write_bar_trades(shm, t, *trades(quote))
+
+                    quote['shm_ts'] = time.time()
+
+                msg[topic] = quote
+
+            if msg:
+                yield msg
+
+        log.info(f"Finished replaying {conf['path']}")
@@ -0,0 +1,211 @@
+# piker: trading gear for hackers
+# Copyright (C) 2018-present  Tyler Goodlet (in stewardship of piker0)
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Simulated (random walk) broker backend.
+
+Generates deterministic (per symbol and seed) random walk bar history
+and trade ticks for any symbol without a network connection or
+credentials, for load and soak testing of the whole feed pipeline.
+
+Optionally tuned in the ``[sim]`` section of ``brokers.toml``:
+
+    [sim]
+    rate = 1000  # mean trade ticks per second, per symbol
+    vol = 0.0005  # std dev of per tick log returns
+    batch_s = 0.01  # tick generation (and msg) period
+    seed = 0
+"""
+from contextlib import asynccontextmanager
+from typing import List, Dict, Any, Optional
+import time
+import zlib
+
+import numpy as np
+import trio
+import tractor
+
+from . import config
+from ..log import get_logger, get_console_log
+from ..data import (
+    open_writers,
+    writers_msg,
+    subscribe_ohlc_for_increment,
+    open_derived_buffers,
+    splice_history,
+    open_tick_buffer,
+    write_trades,
+)
+from ..data._source import base_ohlc_dtype, tick_dtype, tick_types
+
+log = get_logger(__name__)
+
+
+_bar_period_s: int = 1
+_trade = tick_types.index('trade')
+
+_defaults = {
+    'rate': 1000,
+    'vol': 0.0005,
+    'batch_s': 0.01,
+    'seed': 0,
+}
+
+
+def get_config() -> Dict[str, Any]:
+    return {**_defaults, **config.get_section('sim')}
+
+
+class Client:
+    """Random walk market data "client".
+    """
+    def __init__(self, conf: Dict[str, Any]) -> None:
+        self.conf = conf
+
+    def rng(self, symbol: str) -> np.random.Generator:
+        return np.random.default_rng(
+            [self.conf['seed'], zlib.crc32(symbol.encode())])
+
+    async def symbol_info(self, symbol: str) -> Dict[str, Any]:
+        return {'symbol': symbol, 'tick_size': 0.01}
+
+    async def bars(
+        self,
+        symbol: str,
+        count: int = 1000,
+        end: Optional[float] = None,
+    ) -> np.ndarray:
+        """Return ``count`` random walk bars for ``symbol`` up to (and
+        including the bar at) time ``end``.
+        """
+        rng = self.rng(symbol)
+        end = end or time.time()
+        end -= end % _bar_period_s
+
+        # a bar's log return is the sum of its ticks' returns
+        ticks_per_bar = self.conf['rate'] * _bar_period_s
+        vol = self.conf['vol'] * np.sqrt(ticks_per_bar)
+        start = 10 + zlib.crc32(symbol.encode()) % 1000
+        closes = start * np.exp(np.cumsum(rng.normal(0, vol, count)))
+        opens = np.roll(closes, 1)
+        opens[0] = start
+        wick = np.abs(rng.normal(0, vol, (2, count))) * closes
+
+        bars = np.zeros(count, dtype=base_ohlc_dtype)
+        bars['index'] = np.arange(count)
+        bars['time'] = end - _bar_period_s * np.arange(count)[::-1]
+        bars['open'] = opens
+        bars['close'] = closes
+        bars['high'] = np.maximum(opens, closes) + wick[0]
+        bars['low'] = np.minimum(opens, closes) - wick[1]
+        bars['volume'] = rng.poisson(ticks_per_bar * 50, count)
+        return bars
+
+
+@asynccontextmanager
+async def get_client() -> Client:
+    yield Client(get_config())
+
+
+async def stream_quotes(
+    shm_tokens: Dict[str, dict],
+    symbols: List[str],
+    loglevel: str = None,
+    # compat with eventual ``tractor.msg.pub``
+    topics: Optional[List[str]] = None,
+) -> None:
+    """Stream random walk trade ticks for ``symbols``.
+
+    Ticks are generated (and sent) as packed ``tick_dtype`` arrays in
+    batches every ``batch_s`` such that each batch costs a single shm
+    write per buffer and symbol.
+    """
+    # XXX: required to propagate ``tractor`` loglevel to piker logging
+    get_console_log(loglevel or tractor.current_actor().loglevel)
+
+    async with get_client() as client:
+        conf = client.conf
+
+        with open_writers(shm_tokens, symbols) as writers:
+
+            last = {}
+            ticks_shms = {}
+            for sym in symbols:
+                bars = await client.bars(sym)
+                last[sym] = bars['close'][-1]
+
+                shm = writers.get(sym)
+                if shm is None:
+                    continue
+
+                if len(shm.array):
+                    splice_history(shm, bars)
+                else:
+                    shm.push(bars)
+
+                subscribe_ohlc_for_increment(shm, _bar_period_s)
+                open_derived_buffers(shm, _bar_period_s)
+                ticks_shms[sym] = open_tick_buffer(shm)
+
+            # pass back tokens, and bools, signalling if we're the writer
+            yield writers_msg(shm_tokens, symbols, writers)
+
+            rngs = {sym: client.rng(sym + '.ticks') for sym in symbols}
+            batch_s = conf['batch_s']
+            deadline = trio.current_time()
+
+            while True:
+                deadline += batch_s
+                await trio.sleep_until(deadline)
+                now = time.time()
+
+                msg = {}
+                for sym in symbols:
+                    rng = rngs[sym]
+                    n = rng.poisson(conf['rate'] * batch_s)
+                    if not n:
+                        continue
+
+                    # a packed batch of ticks, as written to the tick
+                    # buffer and sent as is
+                    ticks = np.zeros(n, dtype=tick_dtype)
+                    ticks['time'] = now
+                    ticks['price'] = last[sym] * np.exp(
+                        np.cumsum(rng.normal(0, conf['vol'], n)))
+                    ticks['size'] = rng.integers(1, 100, n)
+                    ticks['type'] = _trade
+                    price = last[sym] = ticks['price'][-1]
+
+                    quote = {
+                        'symbol': sym,
+                        'last': price,
+                        'broker_ts': now,
+                        'brokerd_ts': now,
+                        'ticks': ticks,
+                    }
+
+                    shm = writers.get(sym)
+                    if shm is not None:
+                        ticks_shms[sym].push(ticks)
+
+                        # one write for the whole batch
+                        write_trades(shm, ticks['price'], ticks['size'])
+                        quote['shm_ts'] = time.time()
+
+                    msg[sym] = quote
+
+                if msg:
+                    yield msg
@@ -30,23 +30,42 @@ from typing import (
     Sequence, AsyncIterator, Optional
 )
 
+import numpy as np
 import tractor
 
 from ..brokers import get_brokermod
 from ..log import get_logger, get_console_log
-from ._normalize import iterticks
+from ._normalize import iterticks, decode_quotes
 from ._sharedmem import (
     maybe_open_shm_array,
     attach_shm_array,
     open_shm_array,
     ShmArray,
+    ColumnarShmArray,
     get_shm_token,
+    lookup_shm_token,
+    open_shm_token,
+    activate_writer,
+    open_writers,
+    writers_msg,
 )
 from ._source import base_ohlc_dtype
 from ._buffer import (
     increment_ohlc_buffer,
-    subscribe_ohlc_for_increment
+    subscribe_ohlc_for_increment,
+    open_derived_buffers,
+    update_derived,
+    write_trades,
+    splice_history,
+    fill_gap,
+    prepend_history,
+    tf_shm_key,
+    tick_shm_key,
+    open_tick_buffer,
+    push_ticks,
 )
+from ._fanout import fan_out_quotes
+from ._recorder import open_tick_recorder
 
 
 __all__ = [
@@ -54,8 +73,24 @@ __all__ = [
     'maybe_open_shm_array',
     'attach_shm_array',
     'open_shm_array',
+    'ColumnarShmArray',
     'get_shm_token',
+    'lookup_shm_token',
+    'open_shm_token',
+    'activate_writer',
+    'open_writers',
+    'writers_msg',
     'subscribe_ohlc_for_increment',
+    'open_derived_buffers',
+    'update_derived',
+    'write_trades',
+    'splice_history',
+    'fill_gap',
+    'prepend_history',
+    'open_tick_buffer',
+    'push_ticks',
+    'fan_out_quotes',
+    'open_tick_recorder',
 ]
 
 
@@ -138,7 +173,8 @@ class Feed:
     """
     name: str
     stream: AsyncIterator[Dict[str, Any]]
-    shm: ShmArray
+    shm: ShmArray  # the first symbol's buffer
+    shms: Dict[str, ShmArray]
     _broker_portal: tractor._portal.Portal
     _index_stream: Optional[AsyncIterator[Dict[str, Any]]] = None
 
@@ -159,6 +195,45 @@ class Feed:
 
         return self._index_stream
 
+    async def attach_timeframe(
+        self,
+        tf: str,
+        symbol: Optional[str] = None,
+    ) -> ShmArray:
+        """Attach to the writer's buffer for time frame ``tf`` derived
+        from the base bar buffer of ``symbol`` (default the first).
+        """
+        shm = self.shms[symbol] if symbol else self.shm
+        key = tf_shm_key(shm.key, tf)
+        entry = await self._broker_portal.run(
+            'piker.data',
+            'lookup_shm_token',
+            key=key,
+        )
+        if entry is None:
+            raise ValueError(f"No {tf} buffer has been registered for {key}")
+
+        return attach_shm_array(token=entry['token'])
+
+    async def attach_ticks(
+        self,
+        symbol: Optional[str] = None,
+    ) -> ShmArray:
+        """Attach to the writer's raw tick ring buffer for ``symbol``
+        (default the first).
+        """
+        shm = self.shms[symbol] if symbol else self.shm
+        key = tick_shm_key(shm.key)
+        entry = await self._broker_portal.run(
+            'piker.data',
+            'lookup_shm_token',
+            key=key,
+        )
+        if entry is None:
+            raise ValueError(f"No tick buffer has been registered for {key}")
+
+        return attach_shm_array(token=entry['token'])
+
 
 def sym_to_shm_key(
     broker: str,
@@ -172,8 +247,17 @@ async def open_feed(
     name: str,
     symbols: Sequence[str],
     loglevel: Optional[str] = None,
+    policy: str = 'lossless',
+    rate: float = 60,
 ) -> AsyncIterator[Dict[str, Any]]:
     """Open a "data feed" which provides streamed real-time quotes.
+
+    A shm bar buffer is allocated (or attached to) for each of
+    ``symbols`` and quotes are received from the broker daemon's
+    upstream stream for each, shared with all other feeds.
+
+    ``policy`` determines how quotes are delivered if this feed's
+    consumer falls behind, see ``fan_out_quotes()``.
     """
     try:
         mod = get_brokermod(name)
@@ -183,46 +267,69 @@ async def open_feed(
     if loglevel is None:
         loglevel = tractor.current_actor().loglevel
 
-    # Attempt to allocate (or attach to) shm array for this broker/symbol
-    shm, opened = maybe_open_shm_array(
-        key=sym_to_shm_key(name, symbols[0]),
-
-        # use any broker defined ohlc dtype:
-        dtype=getattr(mod, '_ohlc_dtype', base_ohlc_dtype),
-
-        # we expect the sub-actor to write
-        readonly=True,
-    )
-
     async with maybe_spawn_brokerd(
         mod.name,
         loglevel=loglevel,
     ) as portal:
+
+        shms = {}
+        for sym in symbols:
+            # Resolve (or have allocated) the shm array for this
+            # broker/symbol through the registry hosted by the broker
+            # daemon such that concurrently starting feeds all get the
+            # same buffer.
+            entry = await portal.run(
+                'piker.data',
+                'open_shm_token',
+                key=sym_to_shm_key(name, sym),
+
+                # use any broker defined ohlc dtype:
+                dtype_descr=np.dtype(
+                    getattr(mod, '_ohlc_dtype', base_ohlc_dtype)).descr,
+
+                # brokers for always-open markets may request a wrapping
+                # buffer and/or a file backed buffer which persists
+                # across sessions
+                ring=getattr(mod, '_shm_ring', False),
+                persist=getattr(mod, '_shm_persist', False),
+
+                # room reserved in front of the first bar for backends
+                # which backfill (prepend) older history
+                prepend_size=getattr(mod, '_shm_prepend_size', 0),
+            )
+            shms[sym] = attach_shm_array(
+                token=entry['token'],
+
+                # we expect the sub-actor to write
+                readonly=True,
+            )
+
+        # subscribe to the daemon's single (shared) upstream quote
+        # stream per symbol
         stream = await portal.run(
-            mod.__name__,
-            'stream_quotes',
+            'piker.data',
+            'fan_out_quotes',
+            mod_path=mod.__name__,
             symbols=symbols,
-            shm_token=shm.token,
-
-            # compat with eventual ``tractor.msg.pub``
-            topics=symbols,
+            shm_tokens={sym: shm.token for sym, shm in shms.items()},
+            policy=policy,
+            rate=rate,
+            loglevel=loglevel,
         )
+        shm_tokens, writers = await stream.receive()
 
-        # TODO: we can't do this **and** be compate with
-        # ``tractor.msg.pub``, should we maybe just drop this after
-        # tests are in?
-        shm_token, is_writer = await stream.receive()
-
-        if opened:
-            assert is_writer
-            log.info("Started shared mem bar writer")
+        for sym, shm in shms.items():
+            if writers[sym]:
+                log.info(f"Shared mem bar writer is active for {sym}")
 
-        shm_token['dtype_descr'] = list(shm_token['dtype_descr'])
-        assert shm_token == shm.token  # sanity
+            shm_token = shm_tokens[sym]
+            shm_token['dtype_descr'] = list(shm_token['dtype_descr'])
+            assert shm_token == shm.token  # sanity
 
         yield Feed(
             name=name,
-            stream=stream,
-            shm=shm,
+            stream=decode_quotes(stream),
+            shm=shms[symbols[0]],
+            shms=shms,
             _broker_portal=portal,
         )
@@ -17,16 +17,260 @@
 """
 Data buffers for fast shared humpy.
 """
-from typing import Tuple, Callable, Dict
-# import time
+from dataclasses import dataclass
+from typing import Tuple, Callable, Dict, Optional, Sequence, List
+import time
 
+import numpy as np
+from numba import jit
+from numba.typed import List as TypedList
 import tractor
 import trio
 
-from ._sharedmem import ShmArray
+from ..log import get_logger
+from ._sharedmem import (
+    ShmArray,
+    ColumnarShmArray,
+    open_shm_array,
+    maybe_open_shm_array,
+)
+from ._source import tf_in_1m, tick_dtype
+from ._normalize import pack_ticks
+from ._calendar import MarketCalendar
 
 
-_shms: Dict[int, ShmArray] = {}
+log = get_logger(__name__)
+
+
+_shms: Dict[int, List[ShmArray]] = {}
+
+# increment period -> buffers packed as inputs for ``_increment_bars()``
+# along with the (data segment) generations they were packed at
+_packed: Dict[int, Tuple[Tuple[int], List[tuple]]] = {}
+
+# shm key -> trading hours of the buffer's instrument; buffers without
+# an entry are for markets which never close
+_calendars: Dict[str, MarketCalendar] = {}
+
+# set on each new subscription to wake ``increment_ohlc_buffer()`` early
+# (eg. while sleeping through closed markets) to reschedule
+_subscribed: Optional[trio.Event] = None
+
+# period at which file backed (persistent) buffers are synced to disk
+_flush_period_s: float = 60
+
+
+@jit(nopython=True, nogil=True)
+def _increment_bars(
+    rows,
+    indexes,
+    times,
+    opens,
+    highs,
+    lows,
+    closes,
+    volumes,
+    firsts,
+    counters,
+    seqs,
+    rings,
+    active,
+    delay_s,
+    t,
+    steps,
+):
+    """Append new "flat" bars (OHLC set to the last close, zero
+    volume) to every ``active`` buffer in a group with a common dtype.
+
+    Each buffer's last entry is copied as raw bytes (thus retaining
+    non-std fields like vwap) before the std fields are reset. The
+    newest bar's time is ``t`` snapped to its epoch aligned period
+    boundary (or the last bar's plus ``delay_s`` if ``t`` is zero).
+    Up to ``steps`` bars, one per period boundary ending at that time,
+    are written in the same (seqlocked) pass such that periods missed
+    during a stall are caught up on at once; bars are never written at
+    or before the last bar's time (eg. across a market close). Buffers
+    which are full (and not in ring mode) are skipped and flagged in
+    the returned array.
+    """
+    full = np.zeros(len(rows), dtype=np.bool_)
+
+    for k in range(len(rows)):
+        if not active[k]:
+            continue
+
+        buf = rows[k]
+        n = buf.shape[0]
+        i = counters[k][0]
+        if i == firsts[k][0]:
+            # nothing to increment from
+            continue
+
+        src = (i - 1) % n
+        last_t = times[k][src]
+        if t:
+            end = t - t % delay_s
+        else:
+            end = last_t + delay_s
+
+        count = min(steps, int((end - last_t) // delay_s))
+        if count < 1:
+            continue
+
+        if i + count > n and not rings[k]:
+            full[k] = True
+            continue
+
+        index = indexes[k][src]
+        close = closes[k][src]
+
+        # seqlock the write (see ``ShmArray.seqlock()``)
+        seqs[k][0] += 1
+
+        for j in range(count):
+            dst = (i + j) % n
+            buf[dst, :] = buf[src, :]
+            indexes[k][dst] = index + 1 + j
+            times[k][dst] = end - (count - 1 - j) * delay_s
+            opens[k][dst] = close
+            highs[k][dst] = close
+            lows[k][dst] = close
+            closes[k][dst] = close
+            volumes[k][dst] = 0
+
+        counters[k][0] = i + count
+        if rings[k] and i + count - firsts[k][0] > n:
+            # oldest entries were overwritten
+            firsts[k][0] = i + count - n
+
+        seqs[k][0] += 1
+
+    return full
+
+
+def _pack_for_increment(
+    shms: List[ShmArray],
+) -> List[tuple]:
+    """Group buffers by dtype and pack views of their rows, fields and
+    counters into typed lists ready for input to ``_increment_bars()``.
+    """
+    groups = {}
+    for shm in shms:
+        # map any grown data segment first
+        shm._maybe_remap()
+        groups.setdefault(shm._array.dtype, []).append(shm)
+
+    packed = []
+    for dtype, group in groups.items():
+        fields = [TypedList() for _ in range(11)]
+        for shm in group:
+            a = shm._array
+            views = (
+                a.view(np.uint8).reshape(len(a), dtype.itemsize),
+                a['index'],
+                a['time'],
+                a['open'],
+                a['high'],
+                a['low'],
+                a['close'],
+                a['volume'],
+                shm._first._array,
+                shm._i._array,
+                shm._seq._array,
+            )
+            for field, view in zip(fields, views):
+                field.append(view)
+
+        rings = np.array([shm._ring for shm in group])
+        calendars = [_calendars.get(shm.key) for shm in group]
+        packed.append(
+            (group, fields, rings, calendars, dtype['time'].type)
+        )
+
+    return packed
+
+
+def increment_bars(
+    delay_s: int,
+    t: float = 0,
+    steps: int = 1,
+) -> Optional[ShmArray]:
+    """Increment all buffers subscribed at period ``delay_s``, whose
+    market is open at time ``t``, by (up to) ``steps`` bars in a single
+    compiled call per dtype and return the last buffer incremented (if
+    any).
+    """
+    shm = None
+    shms = _shms[delay_s]
+
+    # repack views whenever any buffer has been grown (remapped)
+    gens = tuple(s.generation for s in shms)
+    packed_gens, packed = _packed.get(delay_s, (None, None))
+    if packed_gens != gens:
+        packed = _pack_for_increment(shms)
+        _packed[delay_s] = (gens, packed)
+
+    for group, fields, rings, calendars, time_type in packed:
+        is_open = {None: True}
+        for cal in calendars:
+            if cal not in is_open:
+                is_open[cal] = cal.is_open(t)
+
+        active = np.array([is_open[cal] for cal in calendars])
+        if not active.any():
+            continue
+
+        ends = [s._i.value for s in group]
+
+        full = _increment_bars(
+            *fields,
+            rings,
+            active,
+            time_type(delay_s),
+            time_type(t),
+            steps,
+        )
+        if full.any():
+            # make room in (grow or trim) full buffers then increment
+            # just those
+            grown = [s for s, f in zip(group, full) if f]
+            for s in grown:
+                s.make_room(steps)
+
+            for _, fields, rings, _, _ in _pack_for_increment(grown):
+                _increment_bars(
+                    *fields,
+                    rings,
+                    np.ones(len(grown), dtype=bool),
+                    time_type(delay_s),
+                    time_type(t),
+                    steps,
+                )
+
+        for shm, end in zip(group, ends):
+            if shm._i.value != end:
+                # the kernel bumps seq counters directly
+                shm._seq.wake()
+
+                # roll any higher time frames whose period just ended
+                roll_derived(shm)
+
+    return shm
+
+
+def next_open(
+    t: float,
+) -> float:
+    """Return the earliest time at or after ``t`` at which any
+    subscribed buffer's market is open.
+    """
+    if any(
+        shm.key not in _calendars
+        for shms in _shms.values() for shm in shms
+    ):
+        return t
+
+    return min(cal.next_open(t) for cal in set(_calendars.values()))
 
 
 @tractor.msg.pub
@@ -36,80 +280,622 @@ async def increment_ohlc_buffer(
     # delay_s: Optional[float] = None,
 ):
     """Task which inserts new bars into the provide shared memory array
-    every ``delay_s`` seconds.
+    every ``delay_s`` seconds, on the epoch aligned boundary.
 
     This task fulfills 2 purposes:
     - it takes the subscribed set of shm arrays and increments them
       on a common time period
-    - broadcast of this increment "signal" message to other actor
-      subscribers
+    - broadcast of this increment "signal" message (which includes this
+      task's wake up ``lateness`` in seconds) to other actor subscribers
 
     Note that if **no** actor has initiated this task then **none** of
     the underlying buffers will actually be incremented.
     """
-    # TODO: right now we'll spin printing bars if the last time stamp is
-    # before a large period of no market activity.  Likely the best way
-    # to solve this is to make this task aware of the instrument's
-    # tradable hours?
+    # Buffers are only incremented while their instrument's market is
+    # open (see ``subscribe_ohlc_for_increment()``) and this task sleeps
+    # through periods where all markets are closed.
 
-    # adjust delay to compensate for trio processing time
-    ad = min(_shms.keys()) - 0.001
+    # wake on absolute deadlines aligned to epoch multiples of the
+    # lowest period (instead of sleeping relative to the last wake up)
+    # such that scheduling jitter and processing time never accumulate
+    # and bars across actors (and hosts) all step in unison.
+    global _subscribed
+    lowest = int(min(_shms.keys()))
+    step = int(time.time() // lowest) + 1  # next boundary (in periods)
+    last_flush = time.time()
 
-    # async def sleep():
-    #     """Sleep until next time frames worth has passed from last bar.
-    #     """
-    #     # last_ts = shm.array[-1]['time']
-    #     # delay = max((last_ts + ad) - time.time(), 0)
-    #     # await trio.sleep(delay)
-    #     await trio.sleep(ad)
+    while True:
+        deadline = step * lowest
+        if _subscribed is None:
+            _subscribed = trio.Event()
 
-    total_s = 0  # total seconds counted
-    lowest = min(_shms.keys())
-    ad = lowest - 0.001
+        with trio.move_on_after(max(deadline - time.time(), 0)):
+            await _subscribed.wait()
+            _subscribed = trio.Event()
 
-    while True:
-        # TODO: do we want to support dynamically
-        # adding a "lower" lowest increment period?
-        await trio.sleep(ad)
-        total_s += lowest
+            # a buffer was subscribed before the deadline; reschedule
+            # from the next boundary of the (possibly new) lowest period
+            # in case its market is open or its period is lower.
+            lowest = int(min(_shms.keys()))
+            step = int(time.time() // lowest) + 1
+            continue
+
+        lateness = time.time() - deadline
+
+        # catch up on any steps missed (eg. due to the process being
+        # suspended) by writing all of them in one batch; note the wall
+        # clock may read slightly early relative to trio's monotonic
+        # clock.
+        missed = max(int(lateness // lowest), 0)
+        if missed:
+            log.warning(
+                f"Woke {lateness:.3f}s late, incrementing {missed} "
+                "missed bars")
+
+        shm = None
+        first = step * lowest
+        last = (step + missed) * lowest
+        for delay_s in _shms:
+            # the latest of this period's boundaries passed and how many
+            # of them were passed since the last wake up
+            period = int(delay_s)
+            boundary = last - last % period
+            steps = last // period - (first - 1) // period
+            if steps:
+                shm = increment_bars(delay_s, boundary, steps) or shm
+
+        step += missed + 1
+
+        # skip ahead to the next session open if every market is closed
+        opens_at = next_open(step * lowest)
+        if opens_at > step * lowest:
+            log.info(f"All markets closed, sleeping until {opens_at}")
+            step = int(-(-opens_at // lowest))
+
+        if time.time() - last_flush >= _flush_period_s:
+            flush_persisted()
+            last_flush = time.time()
+
+        if shm is not None:
+            # broadcast the buffer index step
+            yield {'index': shm._i.value, 'lateness': lateness}
+
+
+def flush_persisted() -> None:
+    """Sync all subscribed file backed buffers to disk.
+    """
+    for shms in _shms.values():
+        for shm in shms:
+            if shm.persist_dir:
+                shm.flush()
+
+
+def splice_history(
+    shm: ShmArray,
+    bars: np.ndarray,
+) -> int:
+    """Write (backfilled) ``bars`` on to the end of ``shm``.
+
+    Bars older then the buffer's last entry are dropped, a bar with
+    the same time overwrites the last entry and the rest are appended
+    with a ``index`` field which continues on from the last entry.
+
+    Returns the number of appended bars.
+    """
+    with shm.seqlock():
+        last = shm.last()
+        if not len(last):
+            shm._push(bars)
+            return len(bars)
+
+        t = last[-1]['time']
+        bars = bars[bars['time'] >= t]
+        if len(bars) and bars[0]['time'] == t:
+            index = last[-1]['index']
+            last[-1] = bars[0]
+            last[-1]['index'] = index
+            bars = bars[1:]
+
+        if not len(bars):
+            return 0
 
-        # # sleep for duration of current bar
-        # await sleep()
+        bars = bars.copy()
+        bars['index'] = np.arange(len(bars)) + last[-1]['index'] + 1
+        shm._push(bars)
+        return len(bars)
 
-        # increment all subscribed shm arrays
-        # TODO: this in ``numba``
-        for delay_s, shms in _shms.items():
-            if total_s % delay_s != 0:
-                continue
 
-            # TODO: numa this!
-            for shm in shms:
-                # TODO: in theory we could make this faster by copying the
-                # "last" readable value into the underlying larger buffer's
-                # next value and then incrementing the counter instead of
-                # using ``.push()``?
+def _splice_by_time(
+    shm: ShmArray,
+    bars: np.ndarray,
+) -> int:
+    """Overwrite the entries of ``shm`` with the ``bars`` of the same
+    time (keeping their ``index``) and append any newer bars, in one
+    seqlocked write.
+
+    Returns the number of written bars.
+    """
+    with shm.seqlock():
+        array = shm.array
+        if not len(array):
+            shm._push(bars)
+            return len(bars)
 
-                # append new entry to buffer thus "incrementing" the bar
-                array = shm.array
-                last = array[-1:].copy()
-                (index, t, close) = last[0][['index', 'time', 'close']]
+        # entries at or after the first bar's time
+        n = len(array) - int(np.searchsorted(array['time'], bars['time'][0]))
+        tail = array[len(array) - n:].copy()
 
-                # this copies non-std fields (eg. vwap) from the last datum
-                last[
-                    ['index', 'time', 'volume', 'open', 'high', 'low', 'close']
-                ][0] = (index + 1, t + delay_s, 0, close, close, close, close)
+        pos = np.minimum(
+            np.searchsorted(bars['time'], tail['time']), len(bars) - 1)
+        match = bars['time'][pos] == tail['time']
+        index = tail['index'].copy()
+        tail[match] = bars[pos[match]]
+        tail['index'] = index
+        shm._write(shm.last_index - n, tail)
 
-                # write to the buffer
-                shm.push(last)
+        newer = bars[bars['time'] > array['time'][-1]].copy()
+        newer['index'] = np.arange(len(newer)) + array['index'][-1] + 1
+        shm._push(newer)
 
-        # broadcast the buffer index step
-        yield {'index': shm._i.value}
+        return int(match.sum()) + len(newer)
+
+
+def fill_gap(
+    shm: ShmArray,
+    bars: np.ndarray,
+) -> int:
+    """Fill in the entries of ``shm`` from the time of the first of
+    ``bars`` onward (eg. the flat bars incremented in while a feed was
+    disconnected) with the (re-fetched) ``bars`` of the same time and
+    append any newer ones, then re-derive any higher time frame bars
+    over the same range.
+
+    Returns the number of written (base) bars.
+    """
+    if not len(bars):
+        return 0
+
+    n = _splice_by_time(shm, bars)
+    _rederive(shm, bars['time'][0])
+    return n
+
+
+def _rederive(
+    base: ShmArray,
+    t0: float,
+    bufs: Optional[Sequence['_DerivedBuffer']] = None,
+) -> None:
+    """Re-derive the higher time frame bars (of ``bufs``, default all)
+    derived from ``base`` from the one including time ``t0`` onward.
+    """
+    if bufs is None:
+        bufs = _derived.get(base.key, {}).values()
+
+    array = base.array
+    for buf in bufs:
+        rows = array[array['time'] >= t0 - t0 % buf.period_s]
+        if not len(rows):
+            continue
+
+        _splice_by_time(buf.shm, resample(rows, buf.period_s))
+
+        # re-aggregate the completed base bars of the current derived bar
+        t = rows['time'][-1]
+        closed = rows[rows['time'] >= t - t % buf.period_s][:-1]
+        buf.closed = (
+            closed['open'][0],
+            closed['high'].max(),
+            closed['low'].min(),
+            closed['volume'].sum(),
+        ) if len(closed) else None
 
 
 def subscribe_ohlc_for_increment(
     shm: ShmArray,
     delay: int,
+    calendar: Optional[MarketCalendar] = None,
 ) -> None:
     """Add an OHLC ``ShmArray`` to the increment set.
+
+    If a ``calendar`` is provided the buffer is only incremented during
+    the market's trading sessions such that no (flat) bars are
+    allocated while it's closed.
     """
-    _shms.setdefault(delay, []).append(shm)
+    if isinstance(shm, ColumnarShmArray):
+        # the increment kernel copies whole (row) entries
+        raise TypeError(f"Can't increment columnar {shm.key}")
+
+    # a restarted writer re-subscribes (a new attachment of) the same
+    # buffer which replaces the prior one
+    shms = _shms.setdefault(delay, [])
+    shms[:] = [s for s in shms if s.key != shm.key]
+    shms.append(shm)
+    if calendar is not None:
+        _calendars[shm.key] = calendar
+
+    # repack kernel inputs on next increment
+    _packed.pop(delay, None)
+
+    if _subscribed is not None:
+        _subscribed.set()
+
+
+# default higher time frames derived from each base bar buffer
+_derived_tfs: Tuple[str] = ('1m', '5m', '1h', '1d')
+
+
+@dataclass
+class _DerivedBuffer:
+    """A higher time frame buffer derived from a base bar buffer.
+
+    ``closed`` holds the (open, high, low, volume) aggregate of the
+    *completed* base bars in the current derived bar such that the
+    in-progress bar can be recomputed from it and the base's last bar
+    on every write.
+    """
+    shm: ShmArray
+    period_s: int
+    closed: Optional[Tuple[float, float, float, float]] = None
+
+
+# base shm key -> time frame key -> derived buffer
+_derived: Dict[str, Dict[str, _DerivedBuffer]] = {}
+
+
+def tf_shm_key(
+    key: str,
+    tf: str,
+) -> str:
+    """Return the shm key of time frame ``tf`` derived from the
+    base buffer with key ``key``.
+    """
+    return f'{key}.{tf}'
+
+
+def resample(
+    array: np.ndarray,
+    period_s: int,
+) -> np.ndarray:
+    """Aggregate an OHLC(V) struct array into ``period_s`` length bars
+    aligned to epoch multiples of the period.
+    """
+    if not len(array):
+        return array.copy()
+
+    times = array['time']
+    buckets = times - times % period_s
+    starts = np.r_[0, np.flatnonzero(np.diff(buckets)) + 1]
+    ends = np.r_[starts[1:], len(array)] - 1
+
+    # copy any non-std fields (eg. vwap) from the last bar of each bucket
+    bars = array[ends]
+    bars['index'] = np.arange(len(starts))
+    bars['time'] = buckets[starts]
+    bars['open'] = array['open'][starts]
+    bars['high'] = np.maximum.reduceat(array['high'], starts)
+    bars['low'] = np.minimum.reduceat(array['low'], starts)
+    bars['volume'] = np.add.reduceat(array['volume'], starts)
+    return bars
+
+
+def open_derived_buffers(
+    base: ShmArray,
+    delay_s: int,
+    tfs: Sequence[str] = _derived_tfs,
+) -> Dict[str, ShmArray]:
+    """Allocate and backfill shm buffers for each time frame in ``tfs``
+    derived from the ``delay_s`` period ``base`` buffer.
+
+    The derived buffers are then kept up to date incrementally by
+    ``update_derived()`` (on each base bar write) and
+    ``roll_derived()`` (on each base bar increment) such that readers
+    can attach to them by key (see ``tf_shm_key()``) without ever
+    resampling history themselves. Only time frames which are an
+    integer multiple of the base period are derived.
+
+    Buffers already derived (eg. before the base's writer restarted)
+    are reused and re-derived from their last bar onward.
+    """
+    key = base.key
+    array = base.array
+    bufs = _derived.setdefault(key, {})
+
+    for tf in tfs:
+        period_s = tf_in_1m[tf] * 60
+        if period_s <= delay_s or period_s % delay_s:
+            continue
+
+        buf = bufs.get(tf)
+        if buf is not None:
+            last = buf.shm.last()
+            _rederive(base, last[-1]['time'] if len(last) else 0, [buf])
+            continue
+
+        history = resample(array, period_s)
+        shm = open_shm_array(
+            key=tf_shm_key(key, tf),
+            size=base._len,
+            dtype=array.dtype,
+            ring=base._ring,
+        )
+        shm.push(history)
+
+        buf = bufs[tf] = _DerivedBuffer(shm, period_s)
+        if not len(history):
+            # the first derived bar is started by ``roll_derived()``
+            continue
+
+        # aggregate all but the base's (in-progress) last bar
+        # which make up the current derived bar
+        closed = array[array['time'] >= history['time'][-1]][:-1]
+        if len(closed):
+            buf.closed = (
+                closed['open'][0],
+                closed['high'].max(),
+                closed['low'].min(),
+                closed['volume'].sum(),
+            )
+
+    return {tf: buf.shm for tf, buf in bufs.items()}
+
+
+@jit(nopython=True, nogil=True)
+def _write_trades(
+    opens,
+    highs,
+    lows,
+    closes,
+    volumes,
+    vwaps,
+    counts,
+    seq,
+    prices,
+    sizes,
+):
+    """Fold a batch of trades in to the bar held by the single entry
+    field views ``opens`` through ``counts``; ``vwaps`` and ``counts``
+    are empty for bars without those fields.
+    """
+    n = len(prices)
+    v = volumes[0]
+    o, h, l = opens[0], highs[0], lows[0]
+    if v == 0:
+        # no trades for this bar yet so its prices are just the last
+        # close carried forward
+        o = h = l = prices[0]
+
+    size = 0.
+    pv = 0.
+    for i in range(n):
+        p = prices[i]
+        s = sizes[i]
+        h = max(h, p)
+        l = min(l, p)
+        size += s
+        pv += p * s
+
+    # seqlock the write (see ``ShmArray.seqlock()``)
+    seq[0] += 1
+
+    opens[0] = o
+    highs[0] = h
+    lows[0] = l
+    closes[0] = prices[n - 1]
+    volumes[0] = v + size
+    if len(vwaps) and v + size:
+        vwaps[0] = (vwaps[0] * v + pv) / (v + size)
+    if len(counts):
+        counts[0] += n
+
+    seq[0] += 1
+
+
+def write_trades(
+    shm: ShmArray,
+    prices: np.ndarray,
+    sizes: np.ndarray,
+) -> None:
+    """Update the last bar of ``shm`` (including any ``vwap`` and
+    ``count`` fields) with a batch of trades in a single compiled write
+    and keep its derived time frames in sync.
+    """
+    if not len(prices):
+        return
+
+    # ``.last()`` is always a view even if the ring has wrapped
+    last = shm.last()
+    fields = last.dtype.names
+    _write_trades(
+        last['open'],
+        last['high'],
+        last['low'],
+        last['close'],
+        last['volume'],
+        last['vwap'] if 'vwap' in fields else np.empty(0),
+        last['count'] if 'count' in fields else np.empty(0, dtype=int),
+        shm._seq._array,
+        np.asarray(prices, dtype=float),
+        np.asarray(sizes, dtype=float),
+    )
+    shm._seq.wake()
+    update_derived(shm)
+
+
+def _prepend_room(shm: ShmArray) -> int:
+    if shm._ring:
+        return shm._len - (shm.last_index - shm.first_index)
+    return shm.first_index
+
+
+def prepend_history(
+    shm: ShmArray,
+    bars: np.ndarray,
+) -> int:
+    """Write (older) ``bars`` in front of the first entry of ``shm``
+    and extend any derived time frames back over them.
+
+    Bars which aren't older then the first entry are dropped as are the
+    oldest bars which don't fit in front of it.
+
+    Returns the number of prepended bars.
+    """
+    array = shm.array
+    if len(array):
+        bars = bars[bars['time'] < array['time'][0]]
+
+    bars = bars[max(len(bars) - _prepend_room(shm), 0):]
+    if not len(bars):
+        return 0
+
+    shm.prepend(bars)
+
+    array = shm.array
+    for buf in _derived.get(shm.key, {}).values():
+        dshm = buf.shm
+        first = dshm.array['time'][0]
+        resampled = resample(
+            array[array['time'] < first + buf.period_s], buf.period_s)
+
+        # the first derived bar may now aggregate prepended base bars
+        straddle = resampled[resampled['time'] == first]
+        if len(straddle):
+            if len(dshm.array) == 1:
+                # it's also the in-progress bar
+                rows = array[array['time'] >= first][:-1]
+                buf.closed = (
+                    rows['open'][0],
+                    rows['high'].max(),
+                    rows['low'].min(),
+                    rows['volume'].sum(),
+                ) if len(rows) else None
+
+            with dshm.seqlock():
+                dshm._read(dshm.first_index, dshm.first_index + 1)[
+                    ['open', 'high', 'low', 'volume']
+                ][0] = tuple(straddle[0][['open', 'high', 'low', 'volume']])
+
+        older = resampled[resampled['time'] < first]
+        older = older[max(len(older) - _prepend_room(dshm), 0):]
+        if len(older):
+            dshm.prepend(older)
+
+    return len(bars)
+
+
+def update_derived(
+    base: ShmArray,
+) -> None:
+    """Recompute the current bar of every buffer derived from ``base``
+    from its last (in-progress) bar.
+
+    Writers must call this after each update of the base's last bar.
+    """
+    bufs = _derived.get(base.key)
+    if not bufs:
+        return
+
+    o, h, l, c, v = base.last()[-1][
+        ['open', 'high', 'low', 'close', 'volume']
+    ]
+    for buf in bufs.values():
+        if buf.shm.first_index == buf.shm.last_index:
+            # empty until the next ``roll_derived()``
+            continue
+
+        bar = (o, h, l, c, v)
+        if buf.closed is not None:
+            co, ch, cl, cv = buf.closed
+            bar = (co, max(ch, h), min(cl, l), c, cv + v)
+
+        with buf.shm.seqlock():
+            buf.shm.last()[
+                ['open', 'high', 'low', 'close', 'volume']
+            ][-1] = bar
+
+
+def roll_derived(
+    base: ShmArray,
+) -> None:
+    """Handle a new bar having been pushed to ``base``: start a new bar
+    in each derived buffer whose period has ended or otherwise fold the
+    now completed base bar into the derived buffer's aggregate.
+    """
+    bufs = _derived.get(base.key)
+    if not bufs:
+        return
+
+    t = base.last()[-1]['time']
+    for buf in bufs.values():
+        shm = buf.shm
+        bucket = t - t % buf.period_s
+        last = shm.last().copy()
+        if not len(last):
+            # start an empty buffer from the new base bar
+            buf.closed = None
+            last = base.last().copy()
+            last[['index', 'time']][0] = (0, bucket)
+            shm.push(last)
+            continue
+
+        (index, close) = last[0][['index', 'close']]
+
+        if bucket > last[0]['time']:
+            buf.closed = None
+            last[
+                ['index', 'time', 'volume', 'open', 'high', 'low', 'close']
+            ][0] = (index + 1, bucket, 0, close, close, close, close)
+            shm.push(last)
+        else:
+            # the current derived bar already includes the completed
+            # base bar so it *is* the new closed aggregate
+            buf.closed = tuple(
+                last[0][['open', 'high', 'low', 'volume']]
+            )
+
+
+# number of (latest) raw ticks kept per symbol
+_tick_buffer_size: int = 2**16
+
+
+def tick_shm_key(key: str) -> str:
+    """Return the shm key of the tick buffer kept alongside the
+    base bar buffer with key ``key``.
+    """
+    return f'{key}.ticks'
+
+
+def open_tick_buffer(
+    base: ShmArray,
+    size: int = _tick_buffer_size,
+) -> ShmArray:
+    """Allocate (or attach to) the raw tick ring buffer for the
+    instrument of bar buffer ``base``.
+
+    Only the (lone) bar writer should write ticks (see
+    ``push_ticks()``); readers attach by key (see ``tick_shm_key()``)
+    and get batches of the latest ticks through ``.last()``.
+    """
+    shm, opened = maybe_open_shm_array(
+        tick_shm_key(base.key),
+        dtype=tick_dtype,
+        ring=True,
+        size=size,
+        readonly=False,
+    )
+    return shm
+
+
+def push_ticks(
+    shm: ShmArray,
+    ticks: Sequence[dict],
+    t: float,
+    exchange: str = '',
+) -> int:
+    """Encode normalized quote ``ticks`` (as found in
+    ``quote['ticks']``) received at time ``t`` and push them on to
+    tick buffer ``shm``.
+    """
+    if not ticks:
+        return shm.last_index
+
+    return shm.push(pack_ticks(ticks, t, exchange))
@@ -0,0 +1,119 @@
+# piker: trading gear for hackers
+# Copyright (C) 2018-present  Tyler Goodlet (in stewardship of piker0)
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Market (trading hours) calendars.
+
+Sessions are defined as a weekly schedule in the venue's local time
+zone; holidays are not (yet) handled.
+"""
+from dataclasses import dataclass
+from typing import Tuple
+
+import pandas as pd
+
+
+_mins_in_day = 24 * 60
+_mins_in_week = 7 * _mins_in_day
+
+
+@dataclass(frozen=True)
+class MarketCalendar:
+    """A weekly trading session schedule.
+
+    Each session is a ``(start, end)`` pair of minutes since Monday
+    00:00 (local time); sessions may wrap across the week boundary.
+    """
+    name: str
+    tz: str
+    sessions: Tuple[Tuple[int, int], ...]
+
+    def _local(self, epoch: float) -> pd.Timestamp:
+        return pd.Timestamp(epoch, unit='s', tz='UTC').tz_convert(self.tz)
+
+    def _min_of_week(self, epoch: float) -> float:
+        ts = self._local(epoch)
+        return (
+            ts.weekday() * _mins_in_day
+            + ts.hour * 60
+            + ts.minute
+            + ts.second / 60
+        )
+
+    def is_open(self, epoch: float) -> bool:
+        """Is the market open at time ``epoch``.
+        """
+        m = self._min_of_week(epoch)
+        for start, end in self.sessions:
+            if (m - start) % _mins_in_week < (end - start) % _mins_in_week:
+                return True
+        return False
+
+    def next_open(self, epoch: float) -> float:
+        """Return the epoch time of the next session open at or after
+        ``epoch``, or ``epoch`` itself if the market is open.
+        """
+        if self.is_open(epoch):
+            return epoch
+
+        m = self._min_of_week(epoch)
+        wait = min(
+            (start - m) % _mins_in_week for start, _ in self.sessions
+        )
+        t = epoch + wait * 60
+
+        # the wait is in local (wall clock) minutes so correct for any
+        # daylight savings transition in between
+        shift = self._local(t).utcoffset() - self._local(epoch).utcoffset()
+        return t - shift.total_seconds()
+
+
+def _weekdays(
+    start: int,
+    end: int,
+    days: Tuple[int] = tuple(range(5)),
+) -> Tuple[Tuple[int, int], ...]:
+    """Build daily sessions of local minutes ``[start, end)`` for
+    each of ``days`` (Monday is 0); a negative ``start`` opens on the
+    previous evening.
+    """
+    return tuple(
+        ((day * _mins_in_day + start) % _mins_in_week,
+         (day * _mins_in_day + end) % _mins_in_week)
+        for day in days
+    )
+
+
+# US equities including pre and post market (extended) hours
+us_equities = MarketCalendar(
+    'us_equities',
+    'America/New_York',
+    _weekdays(4 * 60, 20 * 60),
+)
+
+# CME globex: 18:00 previous evening to 17:00, Sunday to Friday
+cme_globex = MarketCalendar(
+    'cme_globex',
+    'America/Chicago',
+    _weekdays(-6 * 60, 17 * 60),
+)
+
+# spot fx: continuous from Sunday 17:00 to Friday 17:00
+forex = MarketCalendar(
+    'forex',
+    'America/New_York',
+    ((6 * _mins_in_day + 17 * 60, 4 * _mins_in_day + 17 * 60),),
+)
@@ -0,0 +1,419 @@
+# piker: trading gear for hackers
+# Copyright (C) 2018-present  Tyler Goodlet (in stewardship of piker0)
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Broker quote stream fan out.
+
+A broker daemon runs a single upstream quote stream per symbol no
+matter how many local consumers (charts, fsp cascades, ingestors)
+subscribe, where one (multi-symbol) broker stream serves all the
+symbols it was started for; every message is broadcast to each
+consumer through its own queue, with a per-consumer delivery policy,
+such that a slow consumer only ever falls behind itself.
+"""
+import inspect
+import math
+import time
+from importlib import import_module
+from types import ModuleType
+from typing import Dict, List, Any, Tuple, Set, Callable, Optional
+
+import numpy as np
+import trio
+import tractor
+
+from ..log import get_logger
+from ._normalize import QuoteEncoder, match_symbol
+
+
+log = get_logger(__name__)
+
+
+class _Subscriber:
+    """A consumer's bounded quote queue.
+
+    When full the oldest queued message is dropped to make room for
+    the latest.
+    """
+    def __init__(self, maxsize: int) -> None:
+        if maxsize < 1:
+            raise ValueError("Subscriber queues must hold at least 1 msg")
+
+        self._send, self._recv = trio.open_memory_channel(maxsize)
+        self.dropped = 0
+
+    def put(self, msg: Any) -> None:
+        try:
+            self._send.send_nowait(msg)
+        except trio.WouldBlock:
+            self._recv.receive_nowait()
+            self.dropped += 1
+            self._send.send_nowait(msg)
+        except trio.ClosedResourceError:
+            pass
+
+    def close(self) -> None:
+        self._send.close()
+
+    def __aiter__(self):
+        return self._recv.__aiter__()
+
+
+class _LosslessSubscriber(_Subscriber):
+    """A consumer's unbounded quote queue; no msg is ever dropped at the
+    cost of a backlog growing without limit if the consumer can't keep
+    up.
+    """
+    def __init__(self) -> None:
+        self._send, self._recv = trio.open_memory_channel(math.inf)
+        self.dropped = 0
+
+
+def _conflate(last: dict, quote: dict) -> dict:
+    """Merge a newer ``quote`` into ``last`` keeping the latest value of
+    every field and only the latest tick of each type.
+    """
+    new = quote.get('ticks', ())
+    if isinstance(new, np.ndarray):
+        # packed (``tick_dtype``) ticks
+        old = last.get('ticks', ())
+        ticks = np.concatenate([old, new]) if len(old) else new
+        types = ticks['type'][::-1]
+        _, latest = np.unique(types, return_index=True)
+        return {
+            **last,
+            **quote,
+            'ticks': ticks[np.sort(len(ticks) - 1 - latest)],
+        }
+
+    ticks = {}
+    for tick in [*last.get('ticks', ()), *quote.get('ticks', ())]:
+        ticks.pop(tick.get('type'), None)
+        ticks[tick.get('type')] = tick
+
+    return {**last, **quote, 'ticks': list(ticks.values())}
+
+
+class _ConflatingSubscriber:
+    """A consumer's latest quote per symbol (topic).
+
+    Quotes for a symbol which has not yet been delivered are merged
+    such that a slow consumer always receives the freshest state
+    instead of a backlog. When ``rate`` is set msgs are delivered at
+    most ``rate`` times a second.
+    """
+    def __init__(self, rate: Optional[float] = None) -> None:
+        self._pending: Dict[str, dict] = {}
+        self._ready = trio.Event()
+        self._closed = False
+        self._period = 1 / rate if rate else 0
+        self.dropped = 0
+
+    def put(self, msg: Dict[str, dict]) -> None:
+        if self._closed:
+            return
+
+        for topic, quote in msg.items():
+            last = self._pending.get(topic)
+            if last is not None:
+                quote = _conflate(last, quote)
+                self.dropped += 1
+
+            self._pending[topic] = quote
+
+        self._ready.set()
+
+    def close(self) -> None:
+        self._closed = True
+        self._ready.set()
+
+    async def __aiter__(self):
+        while True:
+            await self._ready.wait()
+            if not self._pending:
+                # closed
+                return
+
+            msg, self._pending = self._pending, {}
+            if not self._closed:
+                self._ready = trio.Event()
+            yield msg
+
+            if self._period:
+                await trio.sleep(self._period)
+
+
+# delivery policies for (slow) consumers
+_policies = (
+    'drop_oldest',  # bounded queue dropping the oldest msgs when full
+    'lossless',  # unbounded queue
+    'conflate',  # latest quote per symbol
+    'max_rate',  # latest quote per symbol at most ``rate`` times/s
+)
+
+
+def _open_subscriber(
+    policy: str,
+    maxsize: int,
+    rate: float,
+):
+    if policy == 'drop_oldest':
+        return _Subscriber(maxsize)
+    elif policy == 'lossless':
+        return _LosslessSubscriber()
+    elif policy == 'conflate':
+        return _ConflatingSubscriber()
+    elif policy == 'max_rate':
+        return _ConflatingSubscriber(rate)
+    else:
+        raise ValueError(
+            f"Unknown delivery policy {policy}, must be one of {_policies}")
+
+
+class _Upstream:
+    """A (running) broker quote stream for a set of symbols.
+    """
+    def __init__(self, mod_path: str, symbols: List[str]) -> None:
+        self.mod_path = mod_path
+        self.symbols = symbols
+
+        # subscriber -> the symbols it receives from this upstream
+        self.subs: Dict[_Subscriber, Set[str]] = {}
+
+        # the ``(shm_tokens, writers)`` startup msg from the broker
+        self.first: Optional[Tuple[dict, dict]] = None
+        self.ready = trio.Event()
+        self.stopped = trio.Event()
+        self.cancel_scope = trio.CancelScope()
+
+    def unsubscribe(self, sub: _Subscriber) -> None:
+        self.subs.pop(sub, None)
+        if not self.subs:
+            # the last subscriber left; stop streaming from the broker
+            # and have new subscribers start a fresh upstream
+            self.cancel_scope.cancel()
+            self.unregister()
+            for sym in self.symbols:
+                _stopping[(self.mod_path, sym)] = self
+
+    def unregister(self) -> None:
+        for sym in self.symbols:
+            key = (self.mod_path, sym)
+            if _upstreams.get(key) is self:
+                del _upstreams[key]
+
+
+# (broker module path, symbol) -> upstream streaming it
+_upstreams: Dict[Tuple[str, str], _Upstream] = {}
+
+# (broker module path, symbol) -> cancelled upstream yet to stop (and
+# release its buffers' writer registration)
+_stopping: Dict[Tuple[str, str], _Upstream] = {}
+
+
+class _LocalContext:
+    """Stand-in for a ``tractor.Context`` handed to a ``@tractor.stream``
+    broker endpoint which is invoked in this actor.
+    """
+    def __init__(self, on_msg: Callable[[Any], None]) -> None:
+        self._on_msg = on_msg
+
+    async def send_yield(self, data: Any) -> None:
+        self._on_msg(data)
+
+
+async def _run_upstream(
+    mod: ModuleType,
+    shm_tokens: Dict[str, dict],
+    upstream: _Upstream,
+    loglevel: Optional[str],
+) -> None:
+    """Drive a single broker ``stream_quotes()`` for all of the
+    upstream's symbols and broadcast each msg to the subscribers of
+    the symbols it contains.
+    """
+    mod_path, symbols = upstream.mod_path, upstream.symbols
+
+    # feed topic -> the symbol it's for; topics may differ from (eg. be
+    # suffixed versions of) the symbols, unknown ones go to everyone
+    routes: Dict[str, Optional[str]] = {}
+
+    def on_msg(msg: Any) -> None:
+        if upstream.first is None:
+            upstream.first = msg
+            upstream.ready.set()
+            return
+
+        for topic in msg:
+            if topic not in routes:
+                routes[topic] = match_symbol(topic, symbols)
+
+        for sub, syms in upstream.subs.items():
+            if len(syms) == len(symbols):
+                sub.put(msg)
+                continue
+
+            quotes = {
+                topic: quote for topic, quote in msg.items()
+                if routes[topic] is None or routes[topic] in syms
+            }
+            if quotes:
+                sub.put(quotes)
+
+    func = mod.stream_quotes
+    kwargs = dict(
+        symbols=symbols,
+        shm_tokens={sym: shm_tokens[sym] for sym in symbols},
+        loglevel=loglevel,
+    )
+    log.info(f"Starting upstream quote stream for {mod_path}: {symbols}")
+    try:
+        with upstream.cancel_scope:
+            if inspect.isasyncgenfunction(func):
+                async for msg in func(**kwargs):
+                    on_msg(msg)
+            else:
+                # ``@tractor.stream`` endpoints push through the context
+                await func(ctx=_LocalContext(on_msg), **kwargs)
+
+    except Exception:
+        # this is a system task so errors must not propagate
+        log.exception(f"Upstream quote stream for {symbols} failed")
+
+    finally:
+        upstream.unregister()
+        for sym in symbols:
+            if _stopping.get((mod_path, sym)) is upstream:
+                del _stopping[(mod_path, sym)]
+
+        upstream.stopped.set()
+        upstream.ready.set()
+        for sub in upstream.subs:
+            sub.close()
+
+        log.info(f"Stopped upstream quote stream for {mod_path}: {symbols}")
+
+
+@tractor.stream
+async def fan_out_quotes(
+    ctx: tractor.Context,
+    mod_path: str,
+    symbols: List[str],
+    shm_tokens: Dict[str, dict],
+    policy: str = 'lossless',
+    maxsize: int = 128,
+    rate: float = 60,
+    loglevel: str = None,
+) -> None:
+    """Stream quotes for ``symbols`` from the broker backend at
+    ``mod_path``, sharing the upstream stream of each symbol with all
+    other subscribers in this actor.
+
+    Symbols which aren't yet streamed are started together in a single
+    (multi-symbol) upstream broker stream. The first msg sent is the
+    ``(shm_tokens, writers)`` pair reported by the symbols' upstreams.
+    An upstream is stopped once its last subscriber unsubscribes.
+
+    ``policy`` selects how msgs are delivered when the subscriber
+    falls behind:
+
+    - ``'drop_oldest'``: queue at most ``maxsize`` msgs, beyond which
+      the oldest are dropped
+    - ``'lossless'``: queue every msg
+    - ``'conflate'``: deliver only the latest quote per symbol
+    - ``'max_rate'``: as ``'conflate'`` but at most ``rate`` msgs
+      per second
+    """
+    mod = import_module(mod_path)
+    sub = _open_subscriber(policy, maxsize, rate)
+    upstreams: Dict[_Upstream, Set[str]] = {}
+    try:
+        # wait for any cancelled upstream of these symbols to stop (and
+        # release its buffers' writer registration) before resolving,
+        # without a checkpoint, the upstreams to subscribe to
+        while True:
+            stopping = {
+                _stopping[(mod_path, sym)] for sym in symbols
+                if (mod_path, sym) in _stopping
+            }
+            if not stopping:
+                break
+            for upstream in stopping:
+                await upstream.stopped.wait()
+
+        # reuse the running upstream of each symbol where there is one
+        missing = []
+        for sym in symbols:
+            upstream = _upstreams.get((mod_path, sym))
+            if upstream is None:
+                missing.append(sym)
+            else:
+                upstreams.setdefault(upstream, set()).add(sym)
+
+        # and start a single upstream for all the others
+        if missing:
+            upstream = _Upstream(mod_path, missing)
+            for sym in missing:
+                _upstreams[(mod_path, sym)] = upstream
+
+            # upstreams outlive the subscriber which started them
+            trio.lowlevel.spawn_system_task(
+                _run_upstream,
+                mod,
+                shm_tokens,
+                upstream,
+                loglevel,
+                name=f'upstream.{mod_path}.{",".join(missing)}',
+            )
+            upstreams[upstream] = set(missing)
+
+        for upstream, syms in upstreams.items():
+            upstream.subs[sub] = syms
+
+        tokens, writers = {}, {}
+        for upstream, syms in upstreams.items():
+            await upstream.ready.wait()
+            if upstream.first is None:
+                raise RuntimeError(f"Quote stream for {syms} failed to start")
+
+            up_tokens, up_writers = upstream.first
+            for sym in syms:
+                tokens[sym] = up_tokens[sym]
+                writers[sym] = up_writers[sym]
+
+        await ctx.send_yield((tokens, writers))
+
+        # quotes are sent in compact form, see ``decode_quotes()``
+        encoder = QuoteEncoder()
+        async for msg in sub:
+
+            # stamp (copies of the quotes shared with other
+            # subscribers) for latency tracing
+            now = time.time()
+            msg = {
+                topic: {**quote, 'send_ts': now}
+                for topic, quote in msg.items()
+            }
+            await ctx.send_yield(encoder.encode(msg))
+
+    finally:
+        for upstream in upstreams:
+            upstream.unsubscribe(sub)
+
+        if sub.dropped:
+            log.warning(
+                f"Dropped (or conflated) {sub.dropped} msgs for "
+                f"{policy} subscriber of {symbols}")
@@ -0,0 +1,136 @@
+# piker: trading gear for hackers
+# Copyright (C) 2018-present  Tyler Goodlet (in stewardship of piker0)
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+End to end quote latency tracing.
+
+Quotes are stamped with a ``<hop>_ts`` (epoch seconds) field at each
+hop on their way from the broker to the screen and the time between
+consecutive hops is kept in per-hop (HDR style) histograms.
+"""
+import math
+from typing import Dict, Optional
+
+import numpy as np
+
+
+# quote hops in order of traversal:
+# - broker: exchange/broker time as reported by the backend
+# - brokerd: received by the broker daemon
+# - shm: written to the shm bar/tick buffers
+# - send: sent over IPC to a feed subscriber
+# - recv: received by the feed consumer
+# - render: drawn by the chart
+hops = ('broker', 'brokerd', 'shm', 'send', 'recv', 'render')
+
+
+class Histogram:
+    """A log-linear bucketed histogram of durations in seconds.
+
+    Each power of 2 multiple of ``lowest`` is split in to
+    ``sub_buckets`` linear buckets such that values are recorded with
+    a relative error of at most ``1 / sub_buckets``. Values below
+    ``lowest`` (including negative ones due to clock skew) are counted
+    in the first bucket.
+    """
+    def __init__(
+        self,
+        lowest: float = 1e-6,
+        highest: float = 100,
+        sub_buckets: int = 64,
+    ) -> None:
+        self.lowest = lowest
+        self.sub_buckets = sub_buckets
+        exps = math.ceil(math.log2(highest / lowest)) + 1
+        self.counts = np.zeros(exps * sub_buckets, dtype=np.int64)
+        self.count = 0
+        self.max = 0.
+
+    def _index(self, value: float) -> int:
+        v = max(value / self.lowest, 1)
+        exp = int(math.log2(v))
+        sub = int((v / 2**exp - 1) * self.sub_buckets)
+        return min(exp * self.sub_buckets + sub, len(self.counts) - 1)
+
+    def _value(self, index: int) -> float:
+        # upper edge of the bucket
+        exp, sub = divmod(index, self.sub_buckets)
+        return self.lowest * 2**exp * (1 + (sub + 1) / self.sub_buckets)
+
+    def record(self, value: float) -> None:
+        self.counts[self._index(value)] += 1
+        self.count += 1
+        self.max = max(self.max, value)
+
+    def percentile(self, q: float) -> float:
+        """Return the (upper bound of the) ``q``-th percentile value.
+        """
+        if not self.count:
+            return math.nan
+
+        target = max(q / 100 * self.count, 1)
+        index = int(np.searchsorted(np.cumsum(self.counts), target))
+        return min(self._value(index), self.max)
+
+    def summary(self) -> Dict[str, float]:
+        """Return the count and percentiles, in ms.
+        """
+        summary = {'count': self.count}
+        for q in (50, 90, 99, 99.9):
+            summary[f'p{q:g}'] = self.percentile(q) * 1e3
+        summary['max'] = self.max * 1e3
+        return summary
+
+
+# ``'<hop>-><next hop>'`` -> histogram
+_histograms: Dict[str, Histogram] = {}
+
+
+def record_hops(
+    quote: dict,
+    **stamps: Optional[float],
+) -> None:
+    """Record the time between each pair of consecutive hop stamps in
+    ``quote``; ``stamps`` passed by hop name take precedence.
+    """
+    last = None
+    for hop in hops:
+        ts = stamps.get(hop) or quote.get(f'{hop}_ts')
+        if ts is None:
+            continue
+
+        if last is not None:
+            prev, prev_ts = last
+            key = f'{prev}->{hop}'
+            hist = _histograms.get(key)
+            if hist is None:
+                hist = _histograms[key] = Histogram()
+            hist.record(ts - prev_ts)
+
+        last = hop, ts
+
+
+def latency_report() -> Dict[str, Dict[str, float]]:
+    """Return a summary (see ``Histogram.summary()``) of each hop's
+    histogram recorded in this actor.
+    """
+    return {
+        key: _histograms[key].summary()
+        for key in sorted(
+            _histograms,
+            key=lambda key: hops.index(key.split('->')[0]),
+        )
+    }
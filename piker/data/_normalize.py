@@ -18,21 +18,262 @@
 Stream format enforcement.
 """
 
-from typing import AsyncIterator, Optional, Tuple
+import struct
+import time
+from operator import itemgetter
+from typing import (
+    AsyncIterator, Callable, Tuple, Dict, Sequence, Any, List, Optional,
+)
 
 import numpy as np
 
+from ._source import tick_dtype, tick_types
+
 
 def iterticks(
     quote: dict,
     types: Tuple[str] = ('trade', 'utrade'),
 ) -> AsyncIterator:
     """Iterate through ticks delivered per quote cycle.
+
+    Feed quotes (see ``QuoteDecoder``) deliver their ticks as a packed
+    ``tick_dtype`` array whose matching rows are yielded as is.
     """
     # print(f"{quote}\n\n")
     ticks = quote.get('ticks', ())
+    if isinstance(ticks, np.ndarray):
+        codes = [_tick_codes[name] for name in types]
+        yield from ticks[np.isin(ticks['type'], codes)]
+        return
+
     if ticks:
         for tick in ticks:
             print(f"{quote['symbol']}: {tick}")
             if tick.get('type') in types:
                 yield tick
+
+
+def match_symbol(topic: str, symbols: List[str]) -> Optional[str]:
+    """Return the symbol in ``symbols`` which feed ``topic`` is for
+    (topics may be suffixed, eg. ``'spy.arca'``).
+    """
+    topic = topic.lower()
+    for sym in symbols:
+        s = sym.lower()
+        if topic == s or topic.startswith(s + '.'):
+            return sym
+
+
+_tick_codes = {name: code for code, name in enumerate(tick_types)}
+
+# the (unaligned) ``tick_dtype`` layout
+_tick_struct = struct.Struct('<dddB8s')
+assert _tick_struct.size == tick_dtype.itemsize
+
+
+def _pack_tick_bytes(
+    ticks: Sequence[dict],
+    t: float,
+    exchange: bytes = b'',
+) -> bytes:
+    pack, codes, nan = _tick_struct.pack, _tick_codes, np.nan
+    return b''.join([
+        pack(
+            t,
+            tick.get('price', nan),
+            tick.get('size') or 0,
+            codes.get(tick.get('type'), 0),
+            exchange,
+        )
+        for tick in ticks
+    ])
+
+
+def pack_ticks(
+    ticks: Sequence[dict],
+    t: float,
+    exchange: str = '',
+) -> np.ndarray:
+    """Encode normalized quote ``ticks`` (as found in ``quote['ticks']``)
+    received at time ``t`` into a (read only) ``tick_dtype`` array.
+    """
+    return np.frombuffer(
+        _pack_tick_bytes(ticks, t, exchange.encode()),
+        dtype=tick_dtype,
+    )
+
+
+# numeric quote fields which are packed as doubles on the wire, see
+# ``QuoteEncoder``
+quote_fields = (
+    'time',
+    'etime',
+    'broker_ts',
+    'brokerd_ts',
+    'bid',
+    'bsize',
+    'ask',
+    'asize',
+    'last',
+    'size',
+    'open',
+    'high',
+    'low',
+    'close',
+    'volume',
+    'vwap',
+    'count',
+
+    # latency tracing stamps, see ``piker.data._latency``
+    'shm_ts',
+    'send_ts',
+
+    # a replayed quote's original ``broker_ts``, see
+    # ``piker.brokers.replay``
+    'recorded_broker_ts',
+)
+_quote_fields = frozenset(quote_fields)
+_no_ticks = np.frombuffer(b'', dtype=tick_dtype)
+_structs = {}
+
+
+def _struct(n: int) -> struct.Struct:
+    try:
+        return _structs[n]
+    except KeyError:
+        st = _structs[n] = struct.Struct(f'<{n}d')
+        return st
+
+
+class _Layout:
+    """The packed field names and static values of an encoded quote.
+    """
+    def __init__(self, quote: dict) -> None:
+        self.size = len(quote)
+        self.ticks = 'ticks' in quote
+        self.names = tuple(
+            key for key, value in quote.items()
+            if key in _quote_fields
+            and isinstance(value, (int, float))
+            and not isinstance(value, bool)
+        )
+        self.static_keys = tuple(
+            key for key in quote if key not in self.names and key != 'ticks'
+        )
+        self.pack = _struct(len(self.names)).pack
+        self.get_fields = _getter(self.names)
+        self.get_static = _getter(self.static_keys)
+        self.static = self.get_static(quote)
+
+
+def _getter(keys: Tuple[str, ...]) -> Callable[[dict], tuple]:
+    # ``itemgetter()`` of a tuple of values for any number of keys
+    if len(keys) == 1:
+        key, = keys
+        return lambda quote: (quote[key],)
+
+    return itemgetter(*keys) if keys else lambda quote: ()
+
+
+class QuoteEncoder:
+    """Compact (binary) encoder of normalized quote msgs for a single
+    IPC stream.
+
+    Each ``{topic: quote}`` entry is encoded as a ``(fields, ticks,
+    layout)`` tuple where:
+
+    - ``fields`` are the packed doubles of the numeric ``quote_fields``
+    - ``ticks`` are the packed bytes of a ``tick_dtype`` array
+    - ``layout`` is a ``(names, static)`` pair of the packed field names
+      (in order) and all other (eg. contract) fields, only sent when it
+      differs from that last sent for the topic, otherwise ``None``
+
+    The layout is cached per topic and reused for quotes with the same
+    keys and (identical or equal) static values such that, as for most
+    quotes of a stream, fields are packed without any per field checks.
+    """
+    def __init__(self) -> None:
+        self._layouts: Dict[str, _Layout] = {}
+
+    def encode(self, msg: Dict[str, dict]) -> Dict[str, tuple]:
+        encoded = {}
+        for topic, quote in msg.items():
+            fields = layout = None
+            cached = self._layouts.get(topic)
+            if (
+                cached is not None
+                and len(quote) == cached.size
+                and ('ticks' in quote) == cached.ticks
+            ):
+                try:
+                    if cached.get_static(quote) == cached.static:
+                        fields = cached.pack(*cached.get_fields(quote))
+                except (KeyError, struct.error):
+                    # a key was replaced or a field changed type (eg. to
+                    # ``None``)
+                    pass
+
+            if fields is None:
+                cached = self._layouts[topic] = _Layout(quote)
+                fields = cached.pack(*cached.get_fields(quote))
+                layout = (
+                    cached.names,
+                    dict(zip(cached.static_keys, cached.static)),
+                )
+
+            ticks = quote.get('ticks')
+            if isinstance(ticks, np.ndarray):
+                ticks = ticks.tobytes()
+            elif ticks:
+                ticks = _pack_tick_bytes(ticks, quote.get('brokerd_ts', 0))
+            else:
+                ticks = b''
+
+            encoded[topic] = (fields, ticks, layout)
+
+        return encoded
+
+
+class QuoteDecoder:
+    """Decoder of msgs packed by a ``QuoteEncoder``; layouts are cached
+    per topic and static fields merged back in to every decoded quote.
+
+    A decoded quote's ``'ticks'`` are a (read only) ``tick_dtype`` array
+    which consumers can read directly (see ``iterticks()``).
+    """
+    def __init__(self) -> None:
+        self._layouts: Dict[str, tuple] = {}
+
+    def decode(self, msg: Dict[str, tuple]) -> Dict[str, dict]:
+        decoded = {}
+        for topic, (fields, ticks, layout) in msg.items():
+            if layout is not None:
+                names, static = layout
+                self._layouts[topic] = (
+                    tuple(names), _struct(len(names)), static)
+
+            names, st, static = self._layouts[topic]
+            quote = dict(static)
+            quote.update(zip(names, st.unpack(fields)))
+            quote['ticks'] = np.frombuffer(
+                ticks, dtype=tick_dtype) if ticks else _no_ticks
+            decoded[topic] = quote
+
+        return decoded
+
+
+async def decode_quotes(
+    stream: AsyncIterator[Dict[str, tuple]],
+) -> AsyncIterator[Dict[str, Any]]:
+    """Decode a stream of msgs packed by a ``QuoteEncoder``.
+    """
+    decoder = QuoteDecoder()
+    async for msg in stream:
+        quotes = decoder.decode(msg)
+
+        # stamp for latency tracing
+        now = time.time()
+        for quote in quotes.values():
+            quote['recv_ts'] = now
+
+        yield quotes
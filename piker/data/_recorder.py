@@ -0,0 +1,405 @@
+# piker: trading gear for hackers
+# Copyright (C) 2018-present  Tyler Goodlet (in stewardship of piker0)
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Binary tick recording.
+
+A tick file is a magic string followed by a sequence of typed,
+length prefixed blocks, each with a header of:
+
+- block type (1 byte): ``b'S'`` symbol table or ``b'T'`` ticks
+- payload length (u4)
+- first and last tick time (2 x f8), zero for non-tick blocks
+
+Symbol table payloads are json ``{topic: id}`` maps of the topics
+introduced since the last table. Tick payloads are zlib compressed
+columns of ticks with times delta encoded (in us) and prices delta
+encoded per topic (in units of 1e-8) such that blocks can be seeked
+by time reading only their headers.
+
+Changes to a quote's L1 fields (see ``l1_fields``) are recorded as
+rows of type ``_field_type + <field position>`` with the value in the
+price column such that replays can rebuild L1 state.
+"""
+from contextlib import asynccontextmanager
+from typing import Dict, List, Iterator, Optional, Tuple, Sequence
+import json
+import os
+import struct
+import time
+import zlib
+
+import numpy as np
+import trio
+
+from ..log import get_logger
+from ._normalize import _tick_codes
+from ._source import tick_types
+
+
+log = get_logger(__name__)
+
+
+_magic = b'PKRTICK1'
+_header = struct.Struct('<cIdd')
+_symbols_block = b'S'
+_ticks_block = b'T'
+
+_time_scale = 1e6
+_price_scale = 1e8
+
+# scalar quote fields recorded (when changed) alongside the ticks
+l1_fields = ('bid', 'bsize', 'ask', 'asize', 'last', 'size', 'volume')
+_field_type = 128
+
+# layout of decoded tick blocks; ``topic`` indexes the symbol table
+rec_dtype = np.dtype(
+    [
+        ('time', float),
+        ('topic', 'u2'),
+        ('type', 'u1'),  # index into ``tick_types``
+        ('price', float),
+        ('size', float),
+    ]
+)
+
+
+def _group_delta(values: np.ndarray, ids: np.ndarray) -> np.ndarray:
+    """Delta encode ``values`` within each group of equal ``ids``; the
+    first value of each group is kept as is.
+    """
+    order = np.argsort(ids, kind='stable')
+    v = values[order]
+    first = np.ones(len(v), dtype=bool)
+    first[1:] = ids[order][1:] != ids[order][:-1]
+
+    d = np.diff(v, prepend=0)
+    d[first] = v[first]
+
+    deltas = np.empty_like(d)
+    deltas[order] = d
+    return deltas
+
+
+def _group_cumsum(deltas: np.ndarray, ids: np.ndarray) -> np.ndarray:
+    """Inverse of ``_group_delta()``.
+    """
+    order = np.argsort(ids, kind='stable')
+    d = deltas[order]
+    first = np.ones(len(d), dtype=bool)
+    first[1:] = ids[order][1:] != ids[order][:-1]
+    starts = np.flatnonzero(first)
+
+    cs = np.cumsum(d)
+    base = cs[starts] - d[starts]
+    v = cs - np.repeat(base, np.diff(np.append(starts, len(d))))
+
+    values = np.empty_like(v)
+    values[order] = v
+    return values
+
+
+def _encode_ticks(ticks: np.ndarray) -> bytes:
+    t = np.round(ticks['time'] * _time_scale).astype(np.int64)
+    price = ticks['price']
+    nan = np.isnan(price)
+    scaled = np.round(
+        np.where(nan, 0, price) * _price_scale).astype(np.int64)
+
+    return zlib.compress(
+        b''.join((
+            struct.pack('<I', len(ticks)),
+            ticks['topic'].astype('<u2').tobytes(),
+            np.diff(t, prepend=0).astype('<i8').tobytes(),
+            ticks['type'].astype('u1').tobytes(),
+            nan.astype('u1').tobytes(),
+            _group_delta(scaled, ticks['topic']).astype('<i8').tobytes(),
+            ticks['size'].astype('<f8').tobytes(),
+        )),
+        1,
+    )
+
+
+def _decode_ticks(payload: bytes) -> np.ndarray:
+    buf = zlib.decompress(payload)
+    n, = struct.unpack_from('<I', buf)
+
+    offset = 4
+    columns = []
+    for dtype in ('<u2', '<i8', 'u1', 'u1', '<i8', '<f8'):
+        col = np.frombuffer(buf, dtype=dtype, count=n, offset=offset)
+        offset += col.nbytes
+        columns.append(col)
+
+    topic, dt, typ, nan, dprice, size = columns
+
+    ticks = np.empty(n, dtype=rec_dtype)
+    ticks['time'] = np.cumsum(dt) / _time_scale
+    ticks['topic'] = topic
+    ticks['type'] = typ
+    ticks['price'] = _group_cumsum(dprice, topic) / _price_scale
+    ticks['price'][nan.astype(bool)] = np.nan
+    ticks['size'] = size
+    return ticks
+
+
+class TickRecorder:
+    """Buffered, rotating binary tick file writer.
+
+    ``record()`` only appends to an in memory buffer; ``run()``
+    periodically encodes buffered ticks as a block and writes it from
+    a worker thread. Files are named ``<path>.<epoch>-<n>.ticks`` (such
+    that they sort in order) and rotated once larger then
+    ``rotate_bytes``.
+    """
+    def __init__(
+        self,
+        path: str,
+        rotate_bytes: int = 2**28,
+        flush_period_s: float = 1,
+    ) -> None:
+        self.path = path
+        self.rotate_bytes = rotate_bytes
+        self.flush_period_s = flush_period_s
+        self.files: List[str] = []
+
+        self._ids: Dict[str, int] = {}
+        self._new: Dict[str, int] = {}
+        self._fields: Dict[str, dict] = {}
+        self._rows: List[tuple] = []
+        self._file = None
+
+        # blocks are written one at a time
+        self._lock = trio.Lock()
+
+    def record(
+        self,
+        quotes: Dict[str, dict],
+        t: Optional[float] = None,
+    ) -> None:
+        """Buffer the ticks and changed L1 fields of ``quotes``, a feed
+        ``{topic: quote}`` msg, stamped with the quote's brokerd receive
+        time (or ``t``).
+        """
+        for topic, quote in quotes.items():
+            last = self._fields.setdefault(topic, {})
+            fields = [
+                (i, name) for i, name in enumerate(l1_fields)
+                if quote.get(name) is not None
+                and quote[name] != last.get(name)
+            ]
+            ticks = quote.get('ticks')
+            if ticks is None:
+                ticks = ()
+            if not len(ticks) and not fields:
+                continue
+
+            tid = self._ids.get(topic)
+            if tid is None:
+                tid = self._ids[topic] = self._new[topic] = len(self._ids)
+
+            ts = t or quote.get('brokerd_ts') or time.time()
+            for i, name in fields:
+                value = last[name] = quote[name]
+                self._rows.append((ts, tid, _field_type + i, value, 0))
+
+            if isinstance(ticks, np.ndarray):
+                # packed feed ticks, see ``QuoteDecoder``
+                n = len(ticks)
+                self._rows.extend(zip(
+                    [ts] * n,
+                    [tid] * n,
+                    ticks['type'].tolist(),
+                    ticks['price'].tolist(),
+                    ticks['size'].tolist(),
+                ))
+                continue
+
+            for tick in ticks:
+                self._rows.append((
+                    ts,
+                    tid,
+                    _tick_codes.get(tick.get('type'), 0),
+                    tick.get('price', np.nan),
+                    tick.get('size') or 0,
+                ))
+
+    def _open(self) -> None:
+        path = f'{self.path}.{int(time.time())}-{len(self.files):04d}.ticks'
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+
+        self._file = open(path, 'wb')
+        self._file.write(_magic)
+        self.files.append(path)
+        log.info(f"Recording ticks to {path}")
+
+    def _write(
+        self,
+        ticks: np.ndarray,
+        new: Dict[str, int],
+        ids: Dict[str, int],
+    ) -> None:
+        if self._file is not None and self._file.tell() > self.rotate_bytes:
+            self._file.close()
+            self._file = None
+
+        if self._file is None:
+            self._open()
+
+            # each file is self contained
+            new = ids
+
+        if new:
+            payload = json.dumps(new).encode()
+            self._file.write(
+                _header.pack(_symbols_block, len(payload), 0, 0) + payload)
+
+        payload = _encode_ticks(ticks)
+        self._file.write(
+            _header.pack(
+                _ticks_block,
+                len(payload),
+                ticks['time'].min(),
+                ticks['time'].max(),
+            )
+            + payload
+        )
+
+    async def flush(self) -> None:
+        """Write all buffered ticks as a block.
+        """
+        async with self._lock:
+            if not self._rows:
+                return
+
+            rows, self._rows = self._rows, []
+            new, self._new = self._new, {}
+
+            ticks = np.array(rows, dtype=rec_dtype)
+            await trio.to_thread.run_sync(
+                self._write, ticks, new, dict(self._ids))
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    async def run(self) -> None:
+        try:
+            while True:
+                await trio.sleep(self.flush_period_s)
+                await self.flush()
+        finally:
+            with trio.CancelScope(shield=True):
+                await self.flush()
+            self.close()
+
+
+@asynccontextmanager
+async def open_tick_recorder(
+    path: str,
+    **kwargs,
+) -> TickRecorder:
+    """Open a ``TickRecorder`` writing in a background task.
+    """
+    recorder = TickRecorder(path, **kwargs)
+    async with trio.open_nursery() as n:
+        n.start_soon(recorder.run)
+        try:
+            yield recorder
+        finally:
+            n.cancel_scope.cancel()
+
+
+def iter_blocks(
+    path: str,
+    start: Optional[float] = None,
+) -> Iterator[Tuple[Dict[int, str], np.ndarray]]:
+    """Lazily read the tick blocks of a tick file as ``(topics, ticks)``
+    pairs, where ``topics`` maps the ``topic`` ids of ``ticks`` to
+    names, skipping ahead to ticks at or after time ``start``.
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(_magic)) != _magic:
+            raise ValueError(f"{path} is not a tick file")
+
+        topics = {}
+        while True:
+            header = f.read(_header.size)
+            if len(header) < _header.size:
+                return
+
+            typ, length, first, last = _header.unpack(header)
+            if typ == _symbols_block:
+                topics.update(
+                    (tid, topic)
+                    for topic, tid in json.loads(f.read(length)).items()
+                )
+
+            elif typ == _ticks_block:
+                if start is not None and last < start:
+                    # seek past without reading the payload
+                    f.seek(length, os.SEEK_CUR)
+                    continue
+
+                ticks = _decode_ticks(f.read(length))
+                if start is not None and first < start:
+                    ticks = ticks[ticks['time'] >= start]
+
+                yield topics, ticks
+
+            else:
+                # unknown block types are skipped
+                f.seek(length, os.SEEK_CUR)
+
+
+def iter_packets(
+    paths: Sequence[str],
+    start: Optional[float] = None,
+) -> Iterator[Dict[str, dict]]:
+    """Lazily read the tick files ``paths`` (in order) as feed
+    ``{topic: quote}`` msgs, one per topic and (receive) time, with any
+    recorded L1 field changes set on the quote.
+    """
+    for path in paths:
+        for topics, ticks in iter_blocks(path, start=start):
+            last = None
+            packet = {}
+            for t, tid, typ, price, size in ticks.tolist():
+                if t != last and packet:
+                    yield packet
+                    packet = {}
+
+                last = t
+                topic = topics[tid]
+                quote = packet.get(topic)
+                if quote is None:
+                    quote = packet[topic] = {'brokerd_ts': t, 'ticks': []}
+
+                if typ >= _field_type:
+                    quote[l1_fields[typ - _field_type]] = price
+                    continue
+
+                quote['ticks'].append({
+                    'type': tick_types[typ],
+                    'price': price,
+                    'size': size,
+                })
+
+            if packet:
+                yield packet
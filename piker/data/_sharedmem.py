@@ -17,18 +17,28 @@
 """
 NumPy compatible shared memory buffers for real-time FSP.
 """
+from contextlib import contextmanager, ExitStack
 from typing import List
 from dataclasses import dataclass, asdict
-from sys import byteorder
-from typing import Tuple, Optional
+from typing import Tuple, Optional, Iterator, Union, Dict
+from functools import partial
 from multiprocessing import shared_memory
+import ctypes
+import mmap
+import os
+import platform
+import struct
+import sys
+import zlib
 from multiprocessing import resource_tracker as mantracker
 from _posixshmem import shm_unlink
 
 import tractor
 import numpy as np
+import trio
 
 from ..log import get_logger
+from ..brokers import config
 from ._source import base_ohlc_dtype
 
 
@@ -57,47 +67,223 @@ mantracker.unregister = mantracker._resource_tracker.unregister
 mantracker.getfd = mantracker._resource_tracker.getfd
 
 
+def get_persist_dir() -> str:
+    """Return the dir holding file backed (persistent) arrays.
+    """
+    return os.path.join(config._config_dir, 'shm')
+
+
+class _FileSegment:
+    """A memory mapped file with (the subset of) the
+    ``shared_memory.SharedMemory`` interface we use.
+
+    Any process which maps the same file shares its (page cache)
+    memory but, unlike a ``/dev/shm`` segment, contents also persist
+    across process (and system) restarts.
+    """
+    def __init__(
+        self,
+        name: str,
+        dirpath: str,
+        create: bool = False,
+        size: int = 0,
+    ) -> None:
+        self.name = name
+        self.path = os.path.join(dirpath, name)
+
+        flags = os.O_RDWR
+        if create:
+            os.makedirs(dirpath, exist_ok=True)
+            flags |= os.O_CREAT
+
+        self._fd = os.open(self.path, flags)
+        self.size = os.fstat(self._fd).st_size
+
+        # whether previously written contents are (re)mapped
+        self.restored = not create or self.size == size
+        if not self.restored:
+            # truncate first such that the file is zero filled
+            os.ftruncate(self._fd, 0)
+            os.ftruncate(self._fd, size)
+            self.size = size
+
+        self._mmap = mmap.mmap(self._fd, self.size)
+        self.buf = memoryview(self._mmap)
+
+    def flush(self) -> None:
+        """Sync dirty pages to the underlying file.
+        """
+        self._mmap.flush()
+
+    def close(self) -> None:
+        self.buf.release()
+        self._mmap.close()
+        os.close(self._fd)
+
+
+def _open_segment(
+    name: str,
+    create: bool = False,
+    size: int = 0,
+    persist_dir: Optional[str] = None,
+) -> Union[shared_memory.SharedMemory, _FileSegment]:
+    if persist_dir is None:
+        return shared_memory.SharedMemory(
+            name=name,
+            create=create,
+            size=size,
+        )
+    return _FileSegment(name, persist_dir, create=create, size=size)
+
+
+# Linux futexes on (the low 32 bits of) a shared counter let readers
+# block until a writer wakes them instead of polling; elsewhere readers
+# fall back to polling.
+_SYS_futex = {
+    'x86_64': 202,
+    'aarch64': 98,
+}.get(platform.machine()) if (
+    sys.platform.startswith('linux') and sys.byteorder == 'little'
+) else None
+
+if _SYS_futex is not None:
+    _syscall = ctypes.CDLL(None, use_errno=True).syscall
+    _syscall.restype = ctypes.c_long
+
+    # constant syscall args, prebuilt since writers wake on every write
+    _c_futex = ctypes.c_long(_SYS_futex)
+    _c_wait = ctypes.c_int(0)  # FUTEX_WAIT
+    _c_wake = ctypes.c_int(1)  # FUTEX_WAKE
+    _c_all = ctypes.c_int(2**31 - 1)
+    _c_zero = ctypes.c_int(0)
+
+
+class _Timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+
+def _futex_wait(
+    addr: ctypes.c_void_p,
+    value: int,
+    timeout: float,
+) -> None:
+    # returns once woken, on timeout or right away if the value at
+    # ``addr`` no longer is ``value``
+    _syscall(
+        _c_futex,
+        addr,
+        _c_wait,
+        ctypes.c_uint32(value & 0xffffffff),
+        ctypes.byref(_Timespec(int(timeout), int(timeout % 1 * 1e9))),
+        None,
+        _c_zero,
+    )
+
+
+def _futex_wake(addr: ctypes.c_void_p) -> None:
+    _syscall(_c_futex, addr, _c_wake, _c_all, None, None, _c_zero)
+
+
 class SharedInt:
     def __init__(
         self,
         token: str,
         create: bool = False,
+        persist_dir: Optional[str] = None,
     ) -> None:
         # create a single entry array for storing an index counter
-        self._shm = shared_memory.SharedMemory(
-            name=token,
+        self._shm = _open_segment(
+            token,
             create=create,
-            size=4,  # std int
+            size=8,  # int64 so monotonic write counters never overflow
+            persist_dir=persist_dir,
         )
+        # aligned 8 byte loads/stores are atomic on the platforms we
+        # care about which a raw bytes copy doesn't guarantee.
+        self._array = np.ndarray((1,), dtype=np.int64, buffer=self._shm.buf)
+        self._addr = ctypes.c_void_p(self._array.ctypes.data)
 
     @property
     def value(self) -> int:
-        return int.from_bytes(self._shm.buf, byteorder)
+        return int(self._array[0])
 
     @value.setter
     def value(self, value) -> None:
-        self._shm.buf[:] = value.to_bytes(4, byteorder)
+        self._array[0] = value
+
+    async def wait(
+        self,
+        value: int,
+        timeout: float,
+    ) -> None:
+        """Wait until woken by a ``.wake()`` (from any process) after
+        the value changed from ``value``, or at most ``timeout``.
+
+        Without futex support this simply sleeps ``timeout``.
+        """
+        if _SYS_futex is None:
+            await trio.sleep(timeout)
+            return
+
+        await trio.to_thread.run_sync(
+            partial(_futex_wait, self._addr, value, timeout),
+            # an abandoned wait returns by itself within ``timeout``
+            cancellable=True,
+        )
+
+    def wake(self) -> None:
+        """Wake all ``.wait()``-ers.
+        """
+        if _SYS_futex is not None:
+            _futex_wake(self._addr)
+
+    def close(self) -> None:
+        # release our view first otherwise the mmap can't be closed
+        self._array = None
+        self._shm.close()
 
     def destroy(self) -> None:
+        if isinstance(self._shm, _FileSegment):
+            # file backed values are meant to persist
+            return
+
         if shared_memory._USE_POSIX:
             # We manually unlink to bypass all the "resource tracker"
             # nonsense meant for non-SC systems.
             shm_unlink(self._shm.name)
 
 
+def _dtype_from_descr(descr: List[Tuple[str]]) -> np.dtype:
+    """Rebuild a dtype from its ``.descr``, which may have been
+    round tripped through msgpack (and thus have lists in place of the
+    field (shape) tuples).
+    """
+    return np.dtype([
+        tuple(f[:2]) + tuple(tuple(shape) for shape in f[2:])
+        for f in descr
+    ])
+
+
 @dataclass
 class _Token:
     """Internal represenation of a shared memory "token"
     which can be used to key a system wide post shm entry.
     """
     shm_name: str  # this servers as a "key" value
-    shm_counter_name: str
+    shm_first_name: str  # first (oldest) entry's index
+    shm_counter_name: str  # write index; one past the last entry
+    shm_seq_name: str  # seqlock sequence number
+    shm_gen_name: str  # data segment generation; bumped on each growth
     dtype_descr: List[Tuple[str]]
+    ring: bool = False  # wrap-around write mode
+    # dir of backing files if the array (and its first and write
+    # indices) are persistent; the seqlock is always in ``/dev/shm``.
+    persist_dir: Optional[str] = None
+    # struct-of-arrays layout (see ``ColumnarShmArray``)
+    columnar: bool = False
 
     def __post_init__(self):
-        # np.array requires a list for dtype
-        self.dtype_descr = np.dtype(
-            list(self.dtype_descr)).descr
+        self.dtype_descr = _dtype_from_descr(self.dtype_descr).descr
 
     def as_msg(self):
         return asdict(self)
@@ -115,6 +301,12 @@ class _Token:
 # process-local store of keys to tokens
 _known_tokens = {}
 
+# The registry: in the actor hosting it (the broker daemon) arrays are
+# allocated through ``open_shm_token()`` and their tokens (and writer)
+# are served to every other actor from here.
+_registered: Dict[str, 'ShmArray'] = {}
+_writers: Dict[str, Tuple[str, str]] = {}
+
 
 def get_shm_token(key: str) -> _Token:
     """Convenience func to check if a token
@@ -123,9 +315,112 @@ def get_shm_token(key: str) -> _Token:
     return _known_tokens.get(key)
 
 
+async def lookup_shm_token(key: str) -> Optional[dict]:
+    """Return the registry entry for ``key``: the array's token, its
+    dtype and the uid of the actor writing it (if any), or ``None``
+    if no such array is known to this actor.
+    """
+    token = _known_tokens.get(key)
+    if token is None:
+        return None
+
+    return {
+        'token': token.as_msg(),
+        'dtype_descr': token.dtype_descr,
+        'writer': _writers.get(key),
+    }
+
+
+async def open_shm_token(
+    key: str,
+    dtype_descr: List[Tuple[str]],
+    ring: bool = False,
+    persist: bool = False,
+    **kwargs,
+) -> dict:
+    """Return the registry entry for ``key`` allocating (and registering)
+    a new array if none exists yet.
+
+    This is meant to be invoked over IPC in the registry hosting actor
+    such that any actor can resolve (or have allocated) a buffer in one
+    round trip; since no checkpoint is hit between lookup and allocation
+    concurrent requests can never race to create the same segment.
+    """
+    if key not in _known_tokens:
+        shm, opened = maybe_open_shm_array(
+            key,
+            dtype=_dtype_from_descr(dtype_descr),
+            ring=ring,
+            persist=persist,
+            readonly=False,
+            **kwargs,
+        )
+        # this actor now owns (and eventually destroys) the array
+        _registered[key] = shm
+
+    return await lookup_shm_token(key)
+
+
+@contextmanager
+def activate_writer(key: str) -> Iterator[bool]:
+    """Register the current actor as the (lone) writer of the array at
+    ``key`` for the duration of this context, yielding whether a writer
+    already exists (in which case nothing is registered).
+    """
+    writer = _writers.get(key)
+    if writer is None:
+        _writers[key] = tractor.current_actor().uid
+    try:
+        yield writer is not None
+    finally:
+        if writer is None:
+            _writers.pop(key, None)
+
+
+@contextmanager
+def open_writers(
+    shm_tokens: Dict[str, dict],
+    symbols: List[str],
+) -> Iterator[Dict[str, 'ShmArray']]:
+    """Register the current actor as the writer of the bar buffer (by
+    its token in ``shm_tokens``) of each of ``symbols`` which has none
+    yet, for the duration of this context, and yield those buffers
+    (attached for writing) by symbol.
+    """
+    with ExitStack() as stack:
+        writers = {}
+        for sym in symbols:
+            token = shm_tokens[sym]
+            if not stack.enter_context(activate_writer(token['shm_name'])):
+                writers[sym] = attach_shm_array(token=token, readonly=False)
+
+        yield writers
+
+
+def writers_msg(
+    shm_tokens: Dict[str, dict],
+    symbols: List[str],
+    writers: Dict[str, 'ShmArray'],
+) -> Tuple[Dict[str, dict], Dict[str, bool]]:
+    """Return the first msg of a backend's ``stream_quotes()``: the
+    (writer's) shm token of each of ``symbols`` and whether the
+    ``writers`` (see ``open_writers()``) include it.
+    """
+    return (
+        {
+            sym: writers[sym].token if sym in writers else shm_tokens[sym]
+            for sym in symbols
+        },
+        {sym: sym in writers for sym in symbols},
+    )
+
+
 def _make_token(
     key: str,
     dtype: Optional[np.dtype] = None,
+    ring: bool = False,
+    persist_dir: Optional[str] = None,
+    columnar: bool = False,
 ) -> _Token:
     """Create a serializable token that can be used
     to access a shared array.
@@ -133,35 +428,144 @@ def _make_token(
     dtype = base_ohlc_dtype if dtype is None else dtype
     return _Token(
         key,
+        key + "_first",
         key + "_counter",
-        np.dtype(dtype).descr
+        key + "_seq",
+        key + "_gen",
+        np.dtype(dtype).descr,
+        ring=ring,
+        persist_dir=persist_dir,
+        columnar=columnar,
     )
 
 
+def _gen_segment_name(
+    key: str,
+    gen: int,
+) -> str:
+    """Return the name of the data segment of generation ``gen``
+    of the array with key ``key``.
+    """
+    return f'{key}.g{gen}' if gen else key
+
+
+# every data segment starts with a (cache line sized) header holding
+# the number of entries it was allocated for, such that attaching
+# processes never have to infer it from the (padded) segment size, and
+# a checksum of the entries' dtype such that a file backed segment is
+# never restored with a different layout
+_header = struct.Struct('<qI')
+_header_nbytes: int = 64
+
+
+def _dtype_crc(dtype: np.dtype) -> int:
+    return zlib.crc32(repr(dtype.descr).encode())
+
+
+def _write_header(
+    buf: memoryview,
+    size: int,
+    dtype: np.dtype,
+) -> None:
+    _header.pack_into(buf, 0, size, _dtype_crc(dtype))
+
+
+def _read_header(buf: memoryview) -> int:
+    """Return the entry capacity of a data segment.
+    """
+    return _header.unpack_from(buf, 0)[0]
+
+
+def _header_matches(
+    buf: memoryview,
+    size: int,
+    dtype: np.dtype,
+) -> bool:
+    """Return whether the data segment was allocated for ``size``
+    entries of ``dtype``.
+    """
+    return _header.unpack_from(buf, 0) == (size, _dtype_crc(dtype))
+
+
+def _column_layout(
+    dtype: np.dtype,
+    size: int,
+) -> Tuple[Dict[str, int], int]:
+    """Return the byte offset of each field's column of ``size``
+    entries and the total segment size of a columnar array.
+
+    Columns are cache line (64 byte) aligned.
+    """
+    offsets = {}
+    nbytes = 0
+    for name in dtype.names:
+        offsets[name] = nbytes
+        nbytes += -(-size * dtype.fields[name][0].itemsize // 64) * 64
+
+    return offsets, nbytes
+
+
 class ShmArray:
+    """A ``numpy`` array view over a shared memory segment.
+
+    Valid entries are tracked by a pair of shared (absolute) indices:
+    the first (oldest) entry and the write counter which is one past
+    the last entry. ``.push()`` appends after the last entry and
+    ``.prepend()`` writes (eg. older history) in front of the first.
+
+    In the default mode the segment is append only and is grown (see
+    ``.grow()``) once full; space for prepends is reserved at open time
+    (see ``open_shm_array()``). In ``ring`` mode the segment is reused and
+    writes wrap around such that only the latest ``len(self._array)``
+    entries are valid.
+
+    All writes are done inside a sequence lock (see ``.seqlock()``) so
+    that readers can get untorn copies without ever blocking the writer.
+    """
     def __init__(
         self,
         shmarr: np.ndarray,
+        first: SharedInt,
         counter: SharedInt,
+        seq: SharedInt,
+        gen: SharedInt,
         shm: shared_memory.SharedMemory,
         readonly: bool = True,
+        ring: bool = False,
+        key: Optional[str] = None,
     ) -> None:
         self._array = shmarr
+        self._dtype = shmarr.dtype
+        self._first = first
         self._i = counter
+        self._seq = seq
+        self._gen = gen
+        self._gen_seen = gen.value
         self._len = len(shmarr)
         self._shm = shm
+        self._key = key or shm.name
         self._readonly = readonly
-
-    # TODO: ringbuf api?
+        self._ring = ring
 
     @property
     def _token(self) -> _Token:
         return _Token(
-            self._shm.name,
+            self._key,
+            self._first._shm.name,
             self._i._shm.name,
-            self._array.dtype.descr,
+            self._seq._shm.name,
+            self._gen._shm.name,
+            self._dtype.descr,
+            ring=self._ring,
+            persist_dir=self.persist_dir,
+            columnar=isinstance(self, ColumnarShmArray),
         )
 
+    @property
+    def persist_dir(self) -> Optional[str]:
+        if isinstance(self._shm, _FileSegment):
+            return os.path.dirname(self._shm.path)
+
     @property
     def token(self) -> dict:
         """Shared memory token that can be serialized
@@ -173,15 +577,307 @@ class ShmArray:
     def index(self) -> int:
         return self._i.value % self._len
 
+    @property
+    def last_index(self) -> int:
+        """Absolute write index: one past the latest written entry.
+        """
+        return self._i.value
+
+    @property
+    def first_index(self) -> int:
+        """Absolute write index of the oldest entry still held in
+        the buffer.
+        """
+        return self._first.value
+
+    def _read_from(
+        self,
+        array: np.ndarray,
+        start: int,
+        end: int,
+    ) -> np.ndarray:
+        """Return entries of (segment backed) ``array`` in the absolute
+        index range ``[start, end)`` in write order.
+
+        A zero-copy view is returned whenever the range is contiguous
+        in the underlying segment, otherwise (the range straddles the
+        end of a wrapped ring) the two halves are stitched into a copy.
+        """
+        length = end - start
+        i = start % self._len if self._ring else start
+        if i + length <= self._len:
+            return array[i:i + length]
+
+        return np.concatenate((
+            array[i:],
+            array[:i + length - self._len],
+        ))
+
+    def _read(
+        self,
+        start: int,
+        end: int,
+    ) -> np.ndarray:
+        return self._read_from(self._array, start, end)
+
+    @property
+    def key(self) -> str:
+        return self._key
+
+    @property
+    def generation(self) -> int:
+        """Generation of the (current) data segment, bumped each time
+        the array is grown (see ``.grow()``).
+        """
+        return self._gen.value
+
+    @classmethod
+    def _nbytes(
+        cls,
+        dtype: np.dtype,
+        size: int,
+    ) -> int:
+        return _header_nbytes + size * dtype.itemsize
+
+    def _map(
+        self,
+        shm: shared_memory.SharedMemory,
+        size: int,
+    ) -> None:
+        """Map ``size`` entries of segment ``shm`` as this array's data.
+        """
+        array = np.ndarray(
+            (size,),
+            dtype=self._dtype,
+            buffer=shm.buf,
+            offset=_header_nbytes,
+        )
+        array.setflags(write=int(not self._readonly))
+        self._array = array
+        self._len = size
+        self._shm = shm
+
+    def _maybe_remap(self) -> None:
+        """Remap the data segment if the writer has grown the array
+        since it was last mapped by this process.
+        """
+        while self._gen_seen != self._gen.value:
+            gen = self._gen.value
+            try:
+                shm = shared_memory.SharedMemory(
+                    name=_gen_segment_name(self._key, gen),
+                )
+            except FileNotFoundError:
+                # grown (and unlinked) yet again, retry
+                continue
+
+            old = self._shm
+            self._map(shm, _read_header(shm.buf))
+            self._gen_seen = gen
+            _release(old)
+
+    def grow(
+        self,
+        size: int,
+    ) -> None:
+        """Reallocate the array with room for ``size`` entries.
+
+        All entries are copied to a new (larger) data segment which is
+        then published by bumping the shared generation counter; any
+        attached readers transparently remap on their next read. Absolute
+        indices are preserved.
+        """
+        with self.seqlock():
+            self._grow(size)
+
+    def _grow(
+        self,
+        size: int,
+    ) -> None:
+        if self.persist_dir:
+            raise ValueError(f"Can't grow file backed {self._key}")
+
+        if size <= self._len:
+            raise ValueError(
+                f"Can't shrink {self._key} from {self._len} to {size}")
+
+        gen = self._gen.value + 1
+        shm = shared_memory.SharedMemory(
+            name=_gen_segment_name(self._key, gen),
+            create=True,
+            size=self._nbytes(self._dtype, size),
+        )
+        _write_header(shm.buf, size, self._dtype)
+        old = self._shm
+        first, end = self._first.value, self._i.value
+        entries = self._read(first, end)
+        self._map(shm, size)
+        self._write(first, entries)
+        del entries
+        self._gen.value = self._gen_seen = gen
+
+        log.info(f"Grew {self._key} to {size} entries (generation {gen})")
+        if shared_memory._USE_POSIX:
+            shm_unlink(old.name)
+        _release(old)
+
+    def make_room(
+        self,
+        length: int,
+    ) -> None:
+        """Make room for ``length`` more entries after the last.
+
+        The array is grown if need be (see ``.grow()``) except if it's
+        file backed, in which case the oldest entries are dropped: the
+        latest (up to half of the buffer) are moved to the front of the
+        segment such that a persisted buffer never fills up. Note that
+        this resets the first and write indices.
+        """
+        with self.seqlock():
+            self._make_room(length)
+
+    def _make_room(
+        self,
+        length: int,
+    ) -> None:
+        first, i = self._first.value, self._i.value
+        end = i + length
+        if self._ring or end <= self._len:
+            return
+
+        if not self.persist_dir:
+            self._grow(max(2 * self._len, end))
+            return
+
+        keep = max(min(self._len // 2, self._len - length, i - first), 0)
+        kept = self._read(i - keep, i).copy()
+        self._write(0, kept)
+        self._first.value = 0
+        self._i.value = keep
+        log.warning(
+            f"Dropped the oldest {i - first - keep} entries of file "
+            f"backed {self._key} to make room")
+
     @property
     def array(self) -> np.ndarray:
-        return self._array[:self._i.value]
+        self._maybe_remap()
+        return self._read(self.first_index, self._i.value)
+
+    def column(
+        self,
+        name: str,
+    ) -> np.ndarray:
+        """Return all valid entries of field ``name``.
+
+        In this (row oriented) layout this is a strided view; see
+        ``ColumnarShmArray`` for contiguous columns.
+        """
+        return self.array[name]
 
     def last(
         self,
         length: int = 1,
     ) -> np.ndarray:
-        return self.array[-length:]
+        self._maybe_remap()
+        end = self._i.value
+        return self._read(max(end - length, self.first_index), end)
+
+    @property
+    def seq(self) -> int:
+        """Sequence number of the last write; odd while a write is
+        in progress.
+        """
+        return self._seq.value
+
+    @contextmanager
+    def seqlock(self) -> Iterator[None]:
+        """Writer side of the sequence lock.
+
+        Any in-place updates (eg. to the last bar) must be done inside
+        this block. The sequence number is made odd for the duration of
+        the write and bumped to the next even value on exit so that
+        readers can detect, and retry, any read which overlapped it.
+        """
+        seq = self._seq
+        seq.value += 1
+        try:
+            yield
+        finally:
+            seq.value += 1
+            seq.wake()
+
+    def read_last_consistent(
+        self,
+        length: int = 1,
+        max_tries: int = 10000,
+    ) -> np.ndarray:
+        """Return a copy of the last ``length`` entries which is
+        guaranteed not to be torn by a concurrent writer.
+
+        Reads are retried (without any blocking of the writer) until
+        one is made which didn't overlap a write.
+        """
+        for _ in range(max_tries):
+            start = self._seq.value
+            if start & 1:
+                # writer is mid-update
+                continue
+
+            last = self.last(length).copy()
+            if self._seq.value == start:
+                return last
+
+        raise RuntimeError(
+            f"No consistent read of {self._key} after {max_tries} "
+            "tries, did the writer die mid-update?"
+        )
+
+    async def wait_for_update(
+        self,
+        last_seen: int,
+        min_poll_s: float = 0.0005,
+        max_poll_s: float = 0.001,
+        max_spins: int = 100,
+        idle_s: float = 0.05,
+    ) -> int:
+        """Wait for a write to complete after the one which produced
+        the ``.seq`` value ``last_seen`` and return the new seq value.
+
+        The seq counter (which every write bumps) is read directly in
+        shared memory, so readers are woken without any IPC msg. It's
+        polled with a backoff from ``min_poll_s`` up to ``max_poll_s``
+        such that bursts of writes are picked up quickly, after which
+        (idle) readers block until woken by the writer's next
+        ``.seqlock()`` exit (see ``SharedInt.wait()``), at a cost of
+        a thread hop (some 10s of us) in wake up latency.
+
+        Where futexes aren't supported idle readers instead poll every
+        ``idle_s``, trading up to that much latency for not keeping
+        a core busy.
+
+        A write in progress is spun on (yielding to the scheduler) for
+        at most ``max_spins`` polls before falling back to the backoff,
+        in case the writer died mid-update.
+        """
+        delay = min_poll_s
+        spins = 0
+        while True:
+            seq = self._seq.value
+            if seq & 1 and spins < max_spins:
+                # writer is mid-update, it'll be done very soon
+                spins += 1
+                await trio.sleep(0)
+                continue
+
+            if seq != last_seen and not seq & 1:
+                return seq
+
+            if delay < max_poll_s or seq & 1:
+                await trio.sleep(delay)
+                delay = min(delay * 2, max_poll_s)
+                continue
+
+            await self._seq.wait(seq, idle_s)
 
     def push(
         self,
@@ -190,28 +886,253 @@ class ShmArray:
         """Ring buffer like "push" to append data
         into the buffer and return updated index.
         """
+        with self.seqlock():
+            return self._push(data)
+
+    def _write_into(
+        self,
+        array: np.ndarray,
+        start: int,
+        data: np.ndarray,
+    ) -> None:
+        """Write ``data`` into (segment backed) ``array`` starting at
+        absolute index ``start`` wrapping (in ring mode) around the end
+        of the segment.
+        """
+        if not self._ring:
+            array[start:start + len(data)] = data[:]
+            return
+
+        i = start % self._len
+        split = min(len(data), self._len - i)
+        array[i:i + split] = data[:split]
+        # wrap any remainder to the front of the segment
+        array[:len(data) - split] = data[split:]
+
+    def _write(
+        self,
+        start: int,
+        data: np.ndarray,
+    ) -> None:
+        self._write_into(self._array, start, data)
+
+    def _push(
+        self,
+        data: np.ndarray,
+    ) -> int:
         length = len(data)
-        # TODO: use .index for actual ring logic?
-        index = self._i.value
-        end = index + length
-        self._array[index:end] = data[:]
+        if not self._ring:
+            if self.persist_dir and length > self._len:
+                # only the latest ``self._len`` entries can be kept
+                data = data[-self._len:]
+                length = self._len
+
+            self._make_room(length)
+
+        start = self._i.value
+        end = start + length
+
+        if self._ring and length > self._len:
+            # only the latest ``self._len`` entries can survive
+            data = data[-self._len:]
+            start = end - self._len
+
+        self._write(start, data)
         self._i.value = end
+
+        if self._ring and end - self._first.value > self._len:
+            # oldest entries were overwritten
+            self._first.value = end - self._len
+
         return end
 
+    def prepend(
+        self,
+        data: np.ndarray,
+    ) -> int:
+        """Write ``data`` (in a single copy) in front of the first entry
+        and return the updated first index.
+
+        If the array has an ``index`` field it's rewritten to count
+        down from the current first entry's such that index values
+        remain contiguous (and thus aligned with any source buffer).
+        """
+        length = len(data)
+        self._maybe_remap()
+        with self.seqlock():
+            first = self._first.value
+            start = first - length
+
+            if self._ring:
+                room = self._len - (self._i.value - first)
+            else:
+                room = first
+
+            if length > room:
+                raise ValueError(
+                    f"Can't prepend {length} entries to {self._key}, "
+                    f"only {room} slots left in front"
+                )
+
+            if 'index' in self._dtype.names and self._i.value > first:
+                index = self._read(first, first + 1)['index'][0]
+                data = data.copy()
+                data['index'] = np.arange(index - length, index)
+
+            self._write(start, data)
+            self._first.value = start
+
+        return start
+
     def close(self) -> None:
-        self._i._shm.close()
+        self._first.close()
+        self._i.close()
+        self._seq.close()
+        self._gen.close()
         self._shm.close()
 
     def destroy(self) -> None:
+        self._seq.destroy()
+        self._gen.destroy()
+        if self.persist_dir:
+            # keep file backed contents for the next session
+            self.flush()
+            return
+
         if shared_memory._USE_POSIX:
             # We manually unlink to bypass all the "resource tracker"
             # nonsense meant for non-SC systems.
             shm_unlink(self._shm.name)
+        self._first.destroy()
         self._i.destroy()
 
     def flush(self) -> None:
+        """Sync the dirty pages of a file backed array to storage.
+        """
         # TODO: flush to storage backend like markestore?
-        ...
+        if self.persist_dir:
+            for segment in (self._shm, self._first._shm, self._i._shm):
+                segment.flush()
+
+
+class ColumnarShmArray(ShmArray):
+    """A ``ShmArray`` with a struct-of-arrays layout: each field is
+    stored as its own contiguous column in the segment.
+
+    ``.column()`` thus returns contiguous zero-copy views (unless a ring
+    has wrapped) and readers of a single field only touch that field's
+    memory. Entries are still pushed and prepended as structured arrays
+    but ``.array`` and ``.last()`` return structured *copies* so in-place
+    updates must be written through ``.column()`` views.
+    """
+    def __init__(
+        self,
+        columns: Dict[str, np.ndarray],
+        dtype: np.dtype,
+        first: SharedInt,
+        counter: SharedInt,
+        seq: SharedInt,
+        gen: SharedInt,
+        shm: shared_memory.SharedMemory,
+        readonly: bool = True,
+        ring: bool = False,
+        key: Optional[str] = None,
+    ) -> None:
+        self._columns = columns
+        self._dtype = dtype
+        self._first = first
+        self._i = counter
+        self._seq = seq
+        self._gen = gen
+        self._gen_seen = gen.value
+        self._len = len(next(iter(columns.values())))
+        self._shm = shm
+        self._key = key or shm.name
+        self._readonly = readonly
+        self._ring = ring
+
+    @classmethod
+    def _nbytes(
+        cls,
+        dtype: np.dtype,
+        size: int,
+    ) -> int:
+        return _header_nbytes + _column_layout(dtype, size)[1]
+
+    def _map(
+        self,
+        shm: shared_memory.SharedMemory,
+        size: int,
+    ) -> None:
+        self._columns = _map_columns(
+            self._dtype,
+            size,
+            shm.buf,
+            readonly=self._readonly,
+        )
+        self._len = size
+        self._shm = shm
+
+    def _read(
+        self,
+        start: int,
+        end: int,
+    ) -> np.ndarray:
+        array = np.empty(end - start, dtype=self._dtype)
+        for name, column in self._columns.items():
+            array[name] = self._read_from(column, start, end)
+
+        return array
+
+    def column(
+        self,
+        name: str,
+    ) -> np.ndarray:
+        self._maybe_remap()
+        return self._read_from(
+            self._columns[name],
+            self.first_index,
+            self._i.value,
+        )
+
+    def _write(
+        self,
+        start: int,
+        data: np.ndarray,
+    ) -> None:
+        for name, column in self._columns.items():
+            self._write_into(column, start, data[name])
+
+
+def _release(shm: shared_memory.SharedMemory) -> None:
+    """Close a (retired) data segment mapping unless views of it are
+    still held in which case it's freed once they're collected.
+    """
+    try:
+        shm.close()
+    except BufferError:
+        pass
+
+
+def _map_columns(
+    dtype: np.dtype,
+    size: int,
+    buf: memoryview,
+    readonly: bool = True,
+) -> Dict[str, np.ndarray]:
+    offsets, _ = _column_layout(dtype, size)
+    columns = {}
+    for name, offset in offsets.items():
+        column = np.ndarray(
+            (size,),
+            dtype=dtype.fields[name][0],
+            buffer=buf,
+            offset=_header_nbytes + offset,
+        )
+        column.setflags(write=int(not readonly))
+        columns[name] = column
+
+    return columns
 
 
 def open_shm_array(
@@ -220,44 +1141,135 @@ def open_shm_array(
     size: int = int(2*60*60*10/5),
     dtype: Optional[np.dtype] = None,
     readonly: bool = False,
+    ring: bool = False,
+    prepend_size: int = 0,
+    persist: bool = False,
+    columnar: bool = False,
 ) -> ShmArray:
     """Open a memory shared ``numpy`` using the standard library.
 
+    If ``ring`` is set the fixed size segment is reused indefinitely
+    by wrapping writes (see ``ShmArray``) instead of overflowing.
+
+    An extra ``prepend_size`` entries are allocated; in the default
+    (non-ring) mode they're reserved in front of the first pushed entry
+    for later ``ShmArray.prepend()`` calls.
+
+    If ``persist`` is set the array is backed by memory mapped files
+    in the piker config dir (see ``get_persist_dir()``) which are synced
+    on ``ShmArray.flush()`` and remapped (with all previously written
+    contents) on the next open.
+
+    If ``columnar`` is set a ``ColumnarShmArray`` (one contiguous column
+    per field) is returned.
+
     This call unlinks (aka permanently destroys) the buffer on teardown
     and thus should be used from the parent-most accessor (process).
     """
+    persist_dir = get_persist_dir() if persist else None
+
+    dtype = np.dtype(base_ohlc_dtype if dtype is None else dtype)
+    length = size + prepend_size
+    cls = ColumnarShmArray if columnar else ShmArray
+    nbytes = cls._nbytes(dtype, length)
+
     # create new shared mem segment for which we
     # have write permission
-    a = np.zeros(size, dtype=dtype)
-    shm = shared_memory.SharedMemory(
-        name=key,
+    shm = _open_segment(
+        key,
         create=True,
-        size=a.nbytes
+        size=nbytes,
+        persist_dir=persist_dir,
     )
-    array = np.ndarray(a.shape, dtype=a.dtype, buffer=shm.buf)
-    array[:] = a[:]
-    array.setflags(write=int(not readonly))
 
     token = _make_token(
         key=key,
-        dtype=dtype
+        dtype=dtype,
+        ring=ring,
+        persist_dir=persist_dir,
+        columnar=columnar,
     )
 
+    first = SharedInt(
+        token=token.shm_first_name,
+        create=True,
+        persist_dir=persist_dir,
+    )
     counter = SharedInt(
         token=token.shm_counter_name,
         create=True,
+        persist_dir=persist_dir,
     )
-    counter.value = 0
 
-    shmarr = ShmArray(
-        array,
-        counter,
-        shm,
-        readonly=readonly,
+    restored = persist_dir and all(
+        s.restored for s in (shm, first._shm, counter._shm)
     )
+    if restored and not _header_matches(shm.buf, length, dtype):
+        log.warning(
+            f"Discarding persisted {key} from {persist_dir}, it was "
+            "written with a different size or dtype"
+        )
+        restored = False
+
+    if restored:
+        log.info(
+            f"Restored {counter.value - first.value} entries "
+            f"of {key} from {persist_dir}"
+        )
+    else:
+        shm.buf[:nbytes] = bytes(nbytes)
+        _write_header(shm.buf, length, dtype)
+
+        # in ring mode prepends can use any free slots
+        start = 0 if ring else prepend_size
+        first.value = start
+        counter.value = start
+
+    seq = SharedInt(
+        token=token.shm_seq_name,
+        create=True,
+    )
+    seq.value = 0
+
+    gen = SharedInt(
+        token=token.shm_gen_name,
+        create=True,
+    )
+    gen.value = 0
+
+    if columnar:
+        shmarr = ColumnarShmArray(
+            _map_columns(dtype, length, shm.buf, readonly=readonly),
+            dtype,
+            first,
+            counter,
+            seq,
+            gen,
+            shm,
+            readonly=readonly,
+            ring=ring,
+        )
+    else:
+        array = np.ndarray(
+            (length,),
+            dtype=dtype,
+            buffer=shm.buf,
+            offset=_header_nbytes,
+        )
+        array.setflags(write=int(not readonly))
+        shmarr = ShmArray(
+            array,
+            first,
+            counter,
+            seq,
+            gen,
+            shm,
+            readonly=readonly,
+            ring=ring,
+        )
 
     assert shmarr._token == token
-    _known_tokens[key] = shmarr.token
+    _known_tokens[key] = shmarr._token
 
     # "unlink" created shm on process teardown by
     # pushing teardown calls onto actor context stack
@@ -269,35 +1281,95 @@ def open_shm_array(
 
 def attach_shm_array(
     token: Tuple[str, str, Tuple[str, str]],
-    size: int = int(60*60*10/5),
+    size: Optional[int] = None,
     readonly: bool = True,
 ) -> ShmArray:
     """Load and attach to an existing shared memory array previously
     created by another process using ``open_shared_array``.
+
+    If ``size`` is not provided it's computed from the segment's
+    length such that the whole buffer (which ring readers require
+    to compute wrapped offsets) is mapped.
+
+    The data segment of the array's current generation is mapped (see
+    ``ShmArray.grow()``).
     """
     token = _Token.from_msg(token)
     key = token.shm_name
     if key in _known_tokens:
         assert _known_tokens[key] == token, "WTF"
 
-    shm = shared_memory.SharedMemory(name=key)
-    shmarr = np.ndarray(
-        (size,),
-        dtype=token.dtype_descr,
-        buffer=shm.buf
-    )
-    shmarr.setflags(write=int(not readonly))
+    # the seqlock is never persisted so attaching to a file backed
+    # array left over from a prior session fails here (and thus should
+    # be reopened with ``open_shm_array()``)
+    seq = SharedInt(token=token.shm_seq_name)
+    gen = SharedInt(token=token.shm_gen_name)
+
+    while True:
+        generation = gen.value
+        try:
+            shm = _open_segment(
+                _gen_segment_name(key, generation),
+                persist_dir=token.persist_dir,
+            )
+            break
+        except FileNotFoundError:
+            if generation == gen.value:
+                raise
+            # grown (and unlinked) while attaching, retry
+
+    dtype = _dtype_from_descr(token.dtype_descr)
+    if size is None:
+        size = _read_header(shm.buf)
 
-    counter = SharedInt(token=token.shm_counter_name)
+    first = SharedInt(
+        token=token.shm_first_name,
+        persist_dir=token.persist_dir,
+    )
+    counter = SharedInt(
+        token=token.shm_counter_name,
+        persist_dir=token.persist_dir,
+    )
     # make sure we can read
+    first.value
     counter.value
+    seq.value
+
+    if token.columnar:
+        sha = ColumnarShmArray(
+            _map_columns(dtype, size, shm.buf, readonly=readonly),
+            dtype,
+            first,
+            counter,
+            seq,
+            gen,
+            shm,
+            readonly=readonly,
+            ring=token.ring,
+            key=key,
+        )
+    else:
+        shmarr = np.ndarray(
+            (size,),
+            dtype=dtype,
+            buffer=shm.buf,
+            offset=_header_nbytes,
+        )
+        shmarr.setflags(write=int(not readonly))
+        sha = ShmArray(
+            shmarr,
+            first,
+            counter,
+            seq,
+            gen,
+            shm,
+            readonly=readonly,
+            ring=token.ring,
+            key=key,
+        )
+    # any later growth is picked up on the next read
+    sha._gen_seen = generation
 
-    sha = ShmArray(
-        shmarr,
-        counter,
-        shm,
-        readonly=readonly,
-    )
     # read test
     sha.array
 
@@ -316,6 +1388,11 @@ def attach_shm_array(
 def maybe_open_shm_array(
     key: str,
     dtype: Optional[np.dtype] = None,
+    ring: bool = False,
+    size: Optional[int] = None,
+    prepend_size: int = 0,
+    persist: bool = False,
+    columnar: bool = False,
     **kwargs,
 ) -> Tuple[ShmArray, bool]:
     """Attempt to attach to a shared memory block by a
@@ -331,6 +1408,10 @@ def maybe_open_shm_array(
     by the actors who have previously stored a
     "key" -> ``_Token`` map in an actor local variable.
 
+    The allocation parameters (``ring``, ``size``,
+    ``prepend_size``, ``persist``, ``columnar``) are only used if
+    a new block is opened.
+
     If you know the explicit ``_Token`` for your memory
     instead use ``attach_shm_array``.
     """
@@ -341,15 +1422,32 @@ def maybe_open_shm_array(
     except KeyError:
         log.warning(f"Could not find {key} in shms cache")
         if dtype:
-            token = _make_token(key, dtype)
+            token = _make_token(
+                key,
+                dtype,
+                ring=ring,
+                persist_dir=get_persist_dir() if persist else None,
+                columnar=columnar,
+            )
             try:
                 return attach_shm_array(token=token, **kwargs), False
             except FileNotFoundError:
                 log.warning(f"Could not attach to shm with token {token}")
 
+        if size is not None:
+            kwargs['size'] = size
+
         # This actor does not know about memory
         # associated with the provided "key".
         # Attempt to open a block and expect
         # to fail if a block has been allocated
         # on the OS by someone else.
-        return open_shm_array(key=key, dtype=dtype, **kwargs), True
+        return open_shm_array(
+            key=key,
+            dtype=dtype,
+            ring=ring,
+            prepend_size=prepend_size,
+            persist=persist,
+            columnar=columnar,
+            **kwargs
+        ), True
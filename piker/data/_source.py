@@ -37,6 +37,31 @@ base_ohlc_dtype = np.dtype(
     ]
 )
 
+# raw tick (time & sales) layout
+tick_dtype = np.dtype(
+    [
+        ('time', float),
+        ('price', float),
+        ('size', float),
+        ('type', 'u1'),  # index into ``tick_types``
+        ('exchange', 'S8'),
+    ]
+)
+
+# normalized quote tick types, encoded by position
+tick_types = (
+    'n/a',
+    'trade',
+    'utrade',
+    'bid',
+    'bsize',
+    'ask',
+    'asize',
+    'last',
+    'size',
+    'volume',
+)
+
 # map time frame "keys" to minutes values
 tf_in_1m = {
     '1m': 1,
@@ -87,20 +112,14 @@ def from_df(
     df: pd.DataFrame,
     source=None,
     default_tf=None
-) -> np.recarray:
-    """Convert OHLC formatted ``pandas.DataFrame`` to ``numpy.recarray``.
+) -> np.ndarray:
+    """Convert OHLC formatted ``pandas.DataFrame`` to a
+    ``base_ohlc_dtype`` struct array.
 
+    Each column is converted in a single vectorized copy. Time stamps
+    without a time zone are taken as UTC (as ``Timestamp.timestamp()``
+    does), not as local time.
     """
-    df.reset_index(inplace=True)
-
-    # hackery to convert field names
-    date = 'Date'
-    if 'date' in df.columns:
-        date = 'date'
-
-    # convert to POSIX time
-    df[date] = [d.timestamp() for d in df[date]]
-
     # try to rename from some camel case
     columns = {
         'Date': 'time',
@@ -111,20 +130,25 @@ def from_df(
         'Close': 'close',
         'Volume': 'volume',
     }
-
     df = df.rename(columns=columns)
 
-    for name in df.columns:
-        if name not in base_ohlc_dtype.names[1:]:
-            del df[name]
+    # the time stamps may also be the frame's index
+    times = df['time'] if 'time' in df.columns else df.index
+
+    out = np.empty(len(df), dtype=base_ohlc_dtype)
+
+    # convert to POSIX time; the index's resolution depends on the
+    # input (and pandas version) so normalize it to ns first
+    out['time'] = pd.DatetimeIndex(
+        pd.to_datetime(times, utc=True)
+    ).as_unit('ns').asi8 / 1e9
+    out['index'] = np.arange(len(df))
+    for name in base_ohlc_dtype.names[2:]:
+        out[name] = df[name].to_numpy()
 
-    # TODO: it turns out column access on recarrays is actually slower:
-    # https://jakevdp.github.io/PythonDataScienceHandbook/02.09-structured-data-numpy.html#RecordArrays:-Structured-Arrays-with-a-Twist
-    # it might make sense to make these structured arrays?
-    array = df.to_records()
-    _nan_to_closest_num(array)
+    _nan_to_closest_num(out)
 
-    return array
+    return out
 
 
 def _nan_to_closest_num(array: np.ndarray):
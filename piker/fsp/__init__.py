@@ -31,29 +31,32 @@ from ..data import attach_shm_array, Feed
 log = get_logger(__name__)
 
 
-_fsps = {'rsi': _rsi}
-
-
 async def latency(
     source: 'TickStream[Dict[str, float]]',  # noqa
-    ohlcv: np.ndarray
+    ohlcv: 'ShmArray',  # noqa
 ) -> AsyncIterator[np.ndarray]:
-    """Latency measurements, broker to piker.
+    """Latency measurements, broker to piker, in ms.
     """
     # TODO: do we want to offer yielding this async
     # before the rt data connection comes up?
 
     # deliver zeros for all prior history
-    yield np.zeros(len(ohlcv))
+    yield np.zeros(len(ohlcv.array))
 
     async for quote in source:
         ts = quote.get('broker_ts')
         if ts:
             # This is codified in the per-broker normalization layer
-            # TODO: Add more measure points and diffs for full system
-            # stack tracing.
-            value = quote['brokerd_ts'] - quote['broker_ts']
-            yield value
+            # and the per hop breakdown is kept by
+            # ``piker.data._latency``.
+            value = quote['recv_ts'] - ts
+            yield value * 1e3
+
+
+_fsps = {
+    'rsi': _rsi,
+    'latency': latency,
+}
 
 
 async def increment_signals(
@@ -65,8 +68,8 @@ async def increment_signals(
 
     """
     async for msg in await feed.index_stream():
-        array = dst_shm.array
-        last = array[-1:].copy()
+        last = dst_shm.last().copy()
+        last['index'] += 1
 
         # write new slot to the buffer
         dst_shm.push(last)
@@ -108,53 +111,34 @@ async def cascade(
             feed.shm,
         )
 
-        # TODO: XXX:
-        # THERE'S A BIG BUG HERE WITH THE `index` field since we're
-        # prepending a copy of the first value a few times to make
-        # sub-curves align with the parent bar chart.
-        # 
-        # This likely needs to be fixed either by,
-        # - manually assigning the index and historical data
-        #   seperately to the shm array (i.e. not using .push())
-        # - developing some system on top of the shared mem array that
-        #   is `index` aware such that historical data can be indexed
-        #   relative to the true first datum? Not sure if this is sane
-        #   for derivatives.
-
         # Conduct a single iteration of fsp with historical bars input
         # and get historical output
         history_output = await out_stream.__anext__()
 
-        # build a struct array which includes an 'index' field to push 
-        # as history
-        history = np.array(
-            np.arange(len(history_output)),
-            dtype=dst.array.dtype
-        )
+        # build a struct array which includes an 'index' field aligned
+        # with the source's last entries
+        history = np.zeros(len(history_output), dtype=dst.array.dtype)
+        history['index'] = src.last(len(history))['index']
         history[fsp_func_name] = history_output
 
-        # TODO: talk to ``pyqtgraph`` core about proper way to solve this:
-        # XXX: hack to get curves aligned with bars graphics: prepend
-        # a copy of the first datum..
-        # dst.push(history[:1])
-
-        # check for data length mis-allignment and fill missing values
-        diff = len(src.array) - len(history)
-        if diff >= 0:
-            print(f"WTF DIFFZZZ {diff}")
-            for _ in range(diff):
-                dst.push(history[:1])
-
         # compare with source signal and time align
         index = dst.push(history)
 
+        # fill any missing (leading) values such that the output is
+        # index aligned with the source: a single write into the front
+        # of the buffer which also assigns the correct ``index`` values.
+        diff = len(src.array) - len(history)
+        if diff > 0:
+            dst.prepend(np.repeat(history[:1], diff))
+
         yield index
 
         async with trio.open_nursery() as n:
             n.start_soon(increment_signals, feed, dst)
 
+            # readers are woken by the write itself (see
+            # ``ShmArray.wait_for_update()``) so no msg is sent
             async for processed in out_stream:
                 log.debug(f"{fsp_func_name}: {processed}")
-                index = src.index
-                dst.array[-1][fsp_func_name] = processed
-                await ctx.send_yield(index)
+                with dst.seqlock():
+                    dst.column(fsp_func_name)[-1] = processed
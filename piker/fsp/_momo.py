@@ -163,7 +163,7 @@ async def _rsi(
 
     https://en.wikipedia.org/wiki/Relative_strength_index
     """
-    sig = ohlcv.array['close']
+    sig = ohlcv.column('close')
 
     # wilder says to seed the RSI EMAs with the SMA for the "period"
     seed = wma(ohlcv.last(period)['close'], period)[0]
@@ -177,7 +177,7 @@ async def _rsi(
     # deliver history
     yield rsi_h
 
-    index = ohlcv.index
+    index = ohlcv.last_index
 
     async for quote in source:
         # tick based updates
@@ -191,10 +191,10 @@ async def _rsi(
 
             # the ema needs to be computed from the "last bar"
             # TODO: how to make this cleaner
-            if ohlcv.index > index:
+            if ohlcv.last_index > index:
                 last_up_ema_close = up_ema_last
                 last_down_ema_close = down_ema_last
-                index = ohlcv.index
+                index = ohlcv.last_index
 
             rsi_out, up_ema_last, down_ema_last = rsi(
                 sig,
@@ -217,7 +217,7 @@ async def _wma(
     ``weights = np.arange(1, N) * N*(N-1)/2``.
     """
     # deliver historical output as "first yield"
-    yield wma(ohlcv.array['close'], length)
+    yield wma(ohlcv.column('close'), length)
 
     # begin real-time section
 
@@ -20,6 +20,7 @@ Chart axes graphics and behavior.
 
 from typing import List, Tuple, Optional
 
+import numpy as np
 import pandas as pd
 import pyqtgraph as pg
 from PyQt5 import QtCore, QtGui
@@ -118,14 +119,22 @@ class DynamicDateAxis(Axis):
         bars_len = len(bars)
         times = bars['time']
 
+        # bar indexes don't start at 0 (and are negative for history
+        # prepended to the buffer) so map them to array positions
+        start = bars['index'][0] if bars_len else 0
         epochs = times[list(
-            map(int, filter(lambda i: i < bars_len, indexes))
+            filter(
+                lambda i: 0 <= i < bars_len,
+                map(lambda i: int(i) - start, indexes),
+            )
         )]
         # TODO: **don't** have this hard coded shift to EST
         dts = pd.to_datetime(epochs, unit='s')  # - 4*pd.offsets.Hour()
 
-        delay = times[-1] - times[-2]
-        return dts.strftime(self.tick_tpl[delay])
+        # use the smallest recent step as the bar period since
+        # market closes (with no bars) leave gaps in time
+        delay = np.diff(times[-16:]).min()
+        return dts.strftime(self.tick_tpl.get(delay, '%Y-%b-%d %H:%M'))
 
     def tickStrings(self, values: List[float], scale, spacing):
         return self._indexes_to_timestrs(values)
@@ -19,6 +19,7 @@ High level Qt chart widgets.
 """
 from typing import Tuple, Dict, Any, Optional
 from functools import partial
+import time
 
 from PyQt5 import QtCore, QtGui
 import numpy as np
@@ -47,10 +48,11 @@ from ._style import (
     _bars_from_right_in_follow_mode,
     _bars_to_left_in_follow_mode,
 )
-from ..data._source import Symbol, float_digits
+from ..data._source import Symbol, float_digits, tick_types
 from .. import brokers
 from .. import data
 from ..data import maybe_open_shm_array
+from ..data._latency import record_hops
 from ..log import get_logger
 from ._exec import run_qtractor, current_screen
 from ._interaction import ChartView
@@ -571,14 +573,20 @@ class ChartPlotWidget(pg.PlotWidget):
     ) -> pg.GraphicsObject:
         """Update the named internal graphics from ``array``.
 
+        ``array`` may also be a plain (contiguous) column of values, eg.
+        from ``ColumnarShmArray.column()``, which is drawn as is.
         """
-        if name not in self._overlays:
-            self._array = array
+        if array.dtype.names is None:
+            data = array
+        else:
+            data = array[name]
+            if name not in self._overlays:
+                self._array = array
 
         curve = self._graphics[name]
         # TODO: we should instead implement a diff based
         # "only update with new items" on the pg.PlotDataItem
-        curve.setData(array[name], **kwargs)
+        curve.setData(data, **kwargs)
         return curve
 
     def _set_yrange(
@@ -704,6 +712,7 @@ async def _async_main(
 
     # all kwargs are passed through from the CLI entrypoint
     loglevel: str = None,
+    fsps: Tuple[str, ...] = ('rsi',),
 ) -> None:
     """Main Qt-trio routine invoked by the Qt loop with
     the widgets ``dict``.
@@ -729,6 +738,10 @@ async def _async_main(
         brokername,
         [sym],
         loglevel=loglevel,
+
+        # if graphics fall behind during bursts only draw the latest
+        # quote instead of working through a backlog
+        policy='conflate',
     ) as feed:
 
         ohlcv = feed.shm
@@ -752,15 +765,16 @@ async def _async_main(
         async with trio.open_nursery() as n:
 
             # load initial fsp chain (otherwise known as "indicators")
-            n.start_soon(
-                chart_from_fsp,
-                linked_charts,
-                'rsi',  # eventually will be n-compose syntax
-                sym,
-                ohlcv,
-                brokermod,
-                loglevel,
-            )
+            for fsp_func_name in fsps:
+                n.start_soon(
+                    chart_from_fsp,
+                    linked_charts,
+                    fsp_func_name,  # eventually will be n-compose syntax
+                    sym,
+                    ohlcv,
+                    brokermod,
+                    loglevel,
+                )
 
             # update last price sticky
             last_price_sticky = chart._ysticks[chart.name]
@@ -840,18 +854,20 @@ async def chart_from_quotes(
         for sym, quote in quotes.items():
             # print(f'CHART: {quote}')
 
-            for tick in quote.get('ticks', ()):
+            # ticks are delivered packed, see ``QuoteDecoder``
+            for code, price, size in quote['ticks'][
+                ['type', 'price', 'size']
+            ].tolist():
 
                 # print(f"CHART: {quote['symbol']}: {tick}")
-                ticktype = tick.get('type')
-                price = tick.get('price')
-                size = tick.get('size')
+                ticktype = tick_types[code]
 
                 if ticktype in ('trade', 'utrade'):
                     array = ohlcv.array
 
-                    # update price sticky(s)
-                    last = array[-1]
+                    # update price sticky(s) from an untorn copy of
+                    # the bar the writer may be updating right now
+                    last = ohlcv.read_last_consistent()[-1]
                     last_price_sticky.update_from_data(
                         *last[['index', 'close']]
                     )
@@ -922,6 +938,20 @@ async def chart_from_quotes(
                     last_mx, last_mn = mx_in_view, mn_in_view
                     last_bars_range = brange
 
+            # latency tracing up to the quote being drawn
+            record_hops(quote, render=time.time())
+
+
+# per fsp sub-chart settings
+_fsp_charts = {
+    'rsi': {
+        'static_yrange': (0, 100),
+        # over-[sold/bought] levels
+        'levels': (30, 70),
+    },
+    'latency': {},
+}
+
 
 async def chart_from_fsp(
     linked_charts,
@@ -936,6 +966,7 @@ async def chart_from_fsp(
     Pass target entrypoint and historical data.
     """
     name = f'fsp.{fsp_func_name}'
+    settings = _fsp_charts.get(fsp_func_name, {})
 
     # TODO: load function here and introspect
     # return stream type(s)
@@ -951,6 +982,13 @@ async def chart_from_fsp(
             # TODO: create entry for each time frame
             dtype=fsp_dtype,
             readonly=True,
+
+            # room to front-fill output that's shorter then its source
+            size=src_shm._len,
+            prepend_size=src_shm._len,
+
+            # contiguous output column for the curve
+            columnar=True,
         )
 
         # XXX: fsp may have been opened by a duplicate chart. Error for
@@ -989,7 +1027,7 @@ async def chart_from_fsp(
             ohlc=False,
 
             # settings passed down to ``ChartPlotWidget``
-            static_yrange=(0, 100),
+            static_yrange=settings.get('static_yrange'),
         )
 
         # display contents labels asap
@@ -1015,30 +1053,42 @@ async def chart_from_fsp(
         # graphics.curve.setFillLevel(50)
 
         # add moveable over-[sold/bought] lines
-        level_line(chart, 30)
-        level_line(chart, 70, orient_v='top')
+        levels = settings.get('levels')
+        if levels:
+            low, high = levels
+            level_line(chart, low)
+            level_line(chart, high, orient_v='top')
 
         chart._shm = shm
         chart._set_yrange()
 
-        # update chart graphics
-        async for value in stream:
+        # update chart graphics on every write to the fsp's buffer
+        seq = shm.seq
+        last_index = shm.last_index
+        while True:
+            seq = await shm.wait_for_update(seq)
             # p = pg.debug.Profiler(disabled=False, delayed=False)
-            array = shm.array
-            value = array[-1][fsp_func_name]
-            last_val_sticky.update_from_data(-1, value)
-            chart.update_curve_from_array(fsp_func_name, array)
+
+            # draw straight from the contiguous output column; rows
+            # (for contents labels and x-limits) are only rebuilt on
+            # new entries since ``.array`` is a copy for columnar shm
+            column = shm.column(fsp_func_name)
+            last_val_sticky.update_from_data(-1, column[-1])
+            chart.update_curve_from_array(fsp_func_name, column)
+
+            if shm.last_index != last_index:
+                last_index = shm.last_index
+                chart._array = shm.array
             # p('rendered rsi datum')
 
 
 async def check_for_new_bars(feed, ohlcv, linked_charts):
     """Task which updates from new bars in the shared ohlcv buffer every
     ``delay_s`` seconds.
+
+    No index msgs are sent (and thus no bars are drawn) while the
+    instrument's market is closed.
     """
-    # TODO: right now we'll spin printing bars if the last time
-    # stamp is before a large period of no market activity.
-    # Likely the best way to solve this is to make this task
-    # aware of the instrument's tradable hours?
 
     price_chart = linked_charts.chart
     price_chart.default_view()
@@ -1098,12 +1148,17 @@ def _main(
     sym: str,
     brokername: str,
     tractor_kwargs,
+    fsps: Tuple[str, ...] = ('rsi',),
 ) -> None:
     """Sync entry point to start a chart app.
     """
+    # expose the render hop latency histograms to ``piker latency``
+    tractor_kwargs.setdefault('rpc_module_paths', []).append(
+        'piker.data._latency')
+
     # Qt entry point
     run_qtractor(
-        func=_async_main,
+        func=partial(_async_main, fsps=fsps),
         args=(sym, brokername),
         main_widget=ChartSpace,
         tractor_kwargs=tractor_kwargs,
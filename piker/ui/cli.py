@@ -124,9 +124,11 @@ def optschain(config, symbol, date, tl, rate, test):
 @click.option('--date', '-d', help='Contracts expiry date')
 @click.option('--test', '-t', help='Test quote stream file')
 @click.option('--rate', '-r', default=1, help='Logging level')
+@click.option('--latency', is_flag=True,
+              help='Chart broker to client quote latency')
 @click.argument('symbol', required=True)
 @click.pass_obj
-def chart(config, symbol, date, rate, test):
+def chart(config, symbol, date, rate, test, latency):
     """Start an option chain UI
     """
     from ._chart import _main
@@ -138,6 +140,7 @@ def chart(config, symbol, date, rate, test):
     _main(
         sym=symbol,
         brokername=brokername,
+        fsps=('rsi', 'latency') if latency else ('rsi',),
         tractor_kwargs={
             'debug_mode': True,
             'loglevel': tractorloglevel,
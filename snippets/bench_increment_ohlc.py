@@ -0,0 +1,58 @@
+"""
+Benchmark per-symbol cost of incrementing subscribed shm bar buffers:
+the original per-buffer python loop vs. the batched ``numba`` kernel.
+
+Run with: ``python snippets/bench_increment_ohlc.py [num_symbols]``
+"""
+import sys
+import time
+import uuid
+
+import numpy as np
+import tractor
+
+from piker.data import open_shm_array, subscribe_ohlc_for_increment
+from piker.data._buffer import increment_bars
+from piker.brokers.kraken import _ohlc_dtype
+
+
+def py_increment(shms, delay_s) -> None:
+    for shm in shms:
+        last = shm.last().copy()
+        (index, t, close) = last[0][['index', 'time', 'close']]
+        last[
+            ['index', 'time', 'volume', 'open', 'high', 'low', 'close']
+        ][0] = (index + 1, t + delay_s, 0, close, close, close, close)
+        shm.push(last)
+
+
+async def main(num_syms: int, steps: int = 100) -> None:
+    delay_s = 5
+    shms = []
+    for _ in range(num_syms):
+        shm = open_shm_array(
+            key=f'bench.{uuid.uuid4()}',
+            size=3 * steps,
+            dtype=_ohlc_dtype,
+        )
+        shm.push(np.ones(1, dtype=_ohlc_dtype))
+        subscribe_ohlc_for_increment(shm, delay_s)
+        shms.append(shm)
+
+    # compile and pack kernel inputs outside the timed section
+    increment_bars(delay_s)
+
+    for name, step in (
+        ('python', lambda: py_increment(shms, delay_s)),
+        ('numba', lambda: increment_bars(delay_s)),
+    ):
+        start = time.perf_counter()
+        for _ in range(steps):
+            step()
+        per_sym = (time.perf_counter() - start) / steps / num_syms
+        print(f'{name}: {per_sym * 1e6:.2f} us per symbol increment')
+
+
+if __name__ == '__main__':
+    num_syms = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    tractor.run(main, num_syms, name='bench_increment')
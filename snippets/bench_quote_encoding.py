@@ -0,0 +1,52 @@
+"""
+Benchmark msgpack cost and size of a (kraken style) dict quote msg vs.
+its compact ``QuoteEncoder`` form, for quotes with 0, 1 and 4 ticks.
+
+Run with: ``python snippets/bench_quote_encoding.py``
+"""
+import time
+
+import msgpack
+
+from piker.data._normalize import QuoteEncoder, QuoteDecoder
+
+
+quote = {
+    'chan_id': 42,
+    'chan_name': 'ohlc-1',
+    'pair': 'XBTUSD',
+    'symbol': 'XBTUSD',
+    'time': 1607000000.1,
+    'etime': 1607000060.,
+    'open': 19000.1,
+    'high': 19010.5,
+    'low': 18990.2,
+    'close': 19005.3,
+    'vwap': 19001.7,
+    'volume': 12.5,
+    'count': 120,
+    'broker_ts': 1607000000.1,
+    'brokerd_ts': 1607000000.2,
+    'ticks': [{'type': 'trade', 'price': 19005.3, 'size': 0.1}],
+}
+
+
+def bench(name, encode, decode, n=10000):
+    start = time.perf_counter()
+    for _ in range(n):
+        data = msgpack.packb(encode({'XBTUSD': quote}), use_bin_type=True)
+        decode(msgpack.unpackb(data, raw=False))
+
+    per_msg = (time.perf_counter() - start) / n
+    print(f'{name}: {len(data)} bytes, {per_msg * 1e6:.2f} us per msg')
+
+
+if __name__ == '__main__':
+    tick = quote['ticks'][0]
+    for n_ticks in (0, 1, 4):
+        quote['ticks'] = [tick] * n_ticks
+        print(f'{n_ticks} ticks:')
+        bench('dict', lambda msg: msg, lambda msg: msg)
+
+        encoder, decoder = QuoteEncoder(), QuoteDecoder()
+        bench('compact', encoder.encode, decoder.decode)
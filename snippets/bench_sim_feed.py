@@ -0,0 +1,38 @@
+"""
+Soak the feed pipeline with the simulated broker backend and report
+delivered ticks per second and per hop latency.
+
+Run with: ``python snippets/bench_sim_feed.py [num symbols] [seconds]``
+(tune the tick rate in the ``[sim]`` section of ``brokers.toml``).
+"""
+import sys
+import time
+
+import trio
+import tractor
+
+from piker.data import open_feed
+from piker.data._latency import record_hops, latency_report
+
+
+async def main(n: int, duration: float) -> None:
+    symbols = [f'SIM{i}' for i in range(n)]
+    ticks = 0
+    async with open_feed('sim', symbols, policy='lossless') as feed:
+        start = time.time()
+        with trio.move_on_after(duration):
+            async for quotes in feed.stream:
+                for quote in quotes.values():
+                    ticks += len(quote.get('ticks', ()))
+                    record_hops(quote)
+
+    elapsed = time.time() - start
+    print(f'{ticks / elapsed:,.0f} ticks/s over {n} symbols')
+    for hop, summary in latency_report().items():
+        print(hop, {k: round(v, 3) for k, v in summary.items()})
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    duration = float(sys.argv[2]) if len(sys.argv) > 2 else 10
+    tractor.run(main, n, duration, name='bench_sim_feed')
@@ -0,0 +1,50 @@
+"""
+Market calendar testing
+"""
+import pandas as pd
+
+from piker.data._calendar import us_equities, cme_globex, forex
+
+
+def epoch(ts: str, tz: str) -> float:
+    return pd.Timestamp(ts, tz=tz).timestamp()
+
+
+def test_session_boundaries():
+    ny, chi = 'America/New_York', 'America/Chicago'
+
+    # sessions are open at their start and closed at their end
+    assert not us_equities.is_open(epoch('2020-06-01 03:59:59', ny))
+    assert us_equities.is_open(epoch('2020-06-01 04:00', ny))
+    assert us_equities.is_open(epoch('2020-06-01 19:59:59', ny))
+    assert not us_equities.is_open(epoch('2020-06-01 20:00', ny))
+    assert not us_equities.is_open(epoch('2020-06-06 12:00', ny))
+
+    # sessions opening the evening before, wrapping the week boundary
+    assert not cme_globex.is_open(epoch('2020-06-07 17:59', chi))
+    assert cme_globex.is_open(epoch('2020-06-07 18:00', chi))
+    assert cme_globex.is_open(epoch('2020-06-05 16:59', chi))
+    assert not cme_globex.is_open(epoch('2020-06-05 17:00', chi))
+    assert not cme_globex.is_open(epoch('2020-06-06 12:00', chi))
+
+    assert forex.is_open(epoch('2020-06-03 03:00', ny))
+    assert not forex.is_open(epoch('2020-06-05 17:00', ny))
+    assert not forex.is_open(epoch('2020-06-06 12:00', ny))
+    assert forex.is_open(epoch('2020-06-07 17:00', ny))
+
+
+def test_next_open():
+    ny, chi = 'America/New_York', 'America/Chicago'
+
+    t = epoch('2020-06-01 12:00', ny)
+    assert us_equities.next_open(t) == t
+    assert us_equities.next_open(epoch('2020-06-01 20:00', ny)) == epoch(
+        '2020-06-02 04:00', ny)
+    assert cme_globex.next_open(epoch('2020-06-05 17:30', chi)) == epoch(
+        '2020-06-07 18:00', chi)
+
+    # across a daylight savings transition
+    assert us_equities.next_open(epoch('2020-03-07 12:00', ny)) == epoch(
+        '2020-03-09 04:00', ny)
+    assert us_equities.next_open(epoch('2020-10-31 12:00', ny)) == epoch(
+        '2020-11-02 04:00', ny)
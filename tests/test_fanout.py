@@ -0,0 +1,210 @@
+"""
+Broker quote stream fan out testing
+"""
+import numpy as np
+import trio
+from tractor.testing import tractor_test
+
+from piker.data import fan_out_quotes
+from piker.data._fanout import (
+    _LocalContext, _Subscriber, _open_subscriber, _upstreams,
+)
+from piker.data._normalize import QuoteEncoder, QuoteDecoder, iterticks
+from piker.data._source import tick_dtype, tick_types
+
+
+_starts = []
+_stops = []
+_go = None
+
+
+# fake broker backend
+async def stream_quotes(symbols, shm_tokens, loglevel=None):
+    _starts.append(symbols)
+    try:
+        yield (
+            {sym: shm_tokens[sym] for sym in symbols},
+            {sym: True for sym in symbols},
+        )
+        await _go.wait()
+        for i in range(3):
+            # feed topics may be suffixed versions of the symbols
+            yield {f'{sym.lower()}.fake': {'i': i} for sym in symbols}
+
+        await trio.sleep_forever()
+    finally:
+        _stops.append(symbols)
+
+
+@tractor_test
+async def test_single_upstream_per_symbol(loglevel):
+    global _go
+    _go = trio.Event()
+    _starts.clear()
+    received = {0: [], 1: []}
+
+    async def subscribe(i: int) -> None:
+        with trio.CancelScope() as cs:
+
+            def on_msg(msg):
+                received[i].append(msg)
+                if len(received[i]) == 4:
+                    cs.cancel()
+
+            await fan_out_quotes(
+                ctx=_LocalContext(on_msg),
+                mod_path=__name__,
+                symbols=['xbtusd'],
+                shm_tokens={'xbtusd': {'shm_name': 'xbtusd'}},
+            )
+
+    async with trio.open_nursery() as n:
+        n.start_soon(subscribe, 0)
+        n.start_soon(subscribe, 1)
+        await trio.sleep(0.1)
+        _go.set()
+
+    assert _starts == [['xbtusd']]
+    for msgs in received.values():
+        assert msgs[0] == (
+            {'xbtusd': {'shm_name': 'xbtusd'}}, {'xbtusd': True})
+
+        decoder = QuoteDecoder()
+        quotes = [decoder.decode(msg)['xbtusd.fake'] for msg in msgs[1:]]
+        assert [quote['i'] for quote in quotes] == [0, 1, 2]
+
+
+@tractor_test
+async def test_multi_symbol_upstream(loglevel):
+    global _go
+    _go = trio.Event()
+    _starts.clear()
+    _stops.clear()
+    received = {0: [], 1: []}
+    subs = {0: ['ETHUSD', 'XMRUSD'], 1: ['XMRUSD']}
+
+    async def subscribe(i: int) -> None:
+        with trio.CancelScope() as cs:
+
+            def on_msg(msg):
+                received[i].append(msg)
+                if len(received[i]) == 4:
+                    cs.cancel()
+
+            await fan_out_quotes(
+                ctx=_LocalContext(on_msg),
+                mod_path=__name__,
+                symbols=subs[i],
+                shm_tokens={sym: {'shm_name': sym} for sym in subs[i]},
+            )
+
+    async with trio.open_nursery() as n:
+        n.start_soon(subscribe, 0)
+        await trio.sleep(0.1)
+        n.start_soon(subscribe, 1)
+        await trio.sleep(0.1)
+        _go.set()
+
+    # a single broker stream served both symbols (and subscribers)
+    assert _starts == [['ETHUSD', 'XMRUSD']]
+    assert received[1][0] == (
+        {'XMRUSD': {'shm_name': 'XMRUSD'}}, {'XMRUSD': True})
+
+    decoder = QuoteDecoder()
+    assert [set(decoder.decode(msg)) for msg in received[0][1:]] == [
+        {'ethusd.fake', 'xmrusd.fake'}] * 3
+    assert [set(decoder.decode(msg)) for msg in received[1][1:]] == [
+        {'xmrusd.fake'}] * 3
+
+    # and was stopped once both unsubscribed
+    await trio.sleep(0.1)
+    assert _stops == [['ETHUSD', 'XMRUSD']]
+    assert not _upstreams
+
+
+def test_slow_subscriber_drops_oldest():
+    sub = _Subscriber(2)
+    for i in range(5):
+        sub.put(i)
+
+    assert sub.dropped == 3
+    assert [sub._recv.receive_nowait() for _ in range(2)] == [3, 4]
+
+
+@tractor_test
+async def test_conflating_subscriber_keeps_latest(loglevel):
+    sub = _open_subscriber('conflate', 0, 0)
+    sub.put({'xbtusd': {'last': 1, 'ticks': [{'type': 'trade'}]}})
+    sub.put({'xbtusd': {'last': 2, 'ticks': [{'type': 'bid'}]}})
+    sub.put({'xbtusd': {'last': 3, 'ticks': [{'type': 'trade', 'i': 3}]}})
+    sub.put({'xmrusd': {'last': 4}})
+    sub.close()
+
+    msgs = [msg async for msg in sub]
+    assert msgs == [{
+        'xbtusd': {
+            'last': 3,
+            'ticks': [{'type': 'bid'}, {'type': 'trade', 'i': 3}],
+        },
+        'xmrusd': {'last': 4},
+    }]
+    assert sub.dropped == 2
+
+
+def test_quote_encoding_roundtrip():
+    encoder, decoder = QuoteEncoder(), QuoteDecoder()
+    quote = {
+        'symbol': 'xbtusd',
+        'contract': {'exchange': 'kraken'},
+        'last': 10.5,
+        'volume': 3,
+        'brokerd_ts': 100.,
+        'ticks': [{'type': 'trade', 'price': 10.5, 'size': 1}],
+    }
+    msg = encoder.encode({'xbtusd': quote})
+    assert msg['xbtusd'][-1] == (
+        ('last', 'volume', 'brokerd_ts'),
+        {'symbol': 'xbtusd', 'contract': {'exchange': 'kraken'}},
+    )
+    decoded = decoder.decode(msg)['xbtusd']
+    ticks = decoded.pop('ticks')
+    assert decoded == {k: v for k, v in quote.items() if k != 'ticks'}
+
+    # ticks are delivered packed
+    assert ticks.dtype == tick_dtype
+    assert ticks[['time', 'price', 'size']].tolist() == [(100., 10.5, 1.)]
+    assert tick_types[ticks['type'][0]] == 'trade'
+    assert [tick['price'] for tick in iterticks({'ticks': ticks})] == [10.5]
+
+    # the layout (and static fields) are only sent once but still
+    # decoded
+    msg = encoder.encode({'xbtusd': {**quote, 'last': 11, 'ticks': []}})
+    assert msg['xbtusd'][-1] is None
+    decoded = decoder.decode(msg)['xbtusd']
+    assert decoded['last'] == 11
+    assert decoded['contract'] == {'exchange': 'kraken'}
+    assert not len(decoded['ticks'])
+
+    # and resent when a field changes type or a static one changes
+    for update in ({'last': None}, {'contract': {'exchange': 'ib'}}):
+        msg = encoder.encode({'xbtusd': {**quote, **update}})
+        assert msg['xbtusd'][-1] is not None
+        decoded = decoder.decode(msg)['xbtusd']
+        assert {k: decoded[k] for k in update} == update
+
+
+@tractor_test
+async def test_conflating_subscriber_keeps_latest_packed_ticks(loglevel):
+    sub = _open_subscriber('conflate', 0, 0)
+    for i, types in enumerate((['trade', 'bid'], ['trade'])):
+        ticks = np.zeros(len(types), dtype=tick_dtype)
+        ticks['type'] = [tick_types.index(t) for t in types]
+        ticks['price'] = i
+        sub.put({'xbtusd': {'last': i, 'ticks': ticks}})
+    sub.close()
+
+    msgs = [msg async for msg in sub]
+    assert len(msgs) == 1
+    ticks = msgs[0]['xbtusd']['ticks']
+    assert [tick_types[t] for t in ticks['type']] == ['bid', 'trade']
+    assert list(ticks['price']) == [0, 1]
@@ -0,0 +1,197 @@
+"""
+Kraken backend testing
+"""
+import json
+import uuid
+from contextlib import asynccontextmanager
+
+import numpy as np
+import pytest
+import trio
+from tractor.testing import tractor_test
+
+from piker.brokers import kraken
+from piker.brokers.kraken import decode_trades, trades_to_bars
+from piker.data import open_shm_array, open_tick_buffer
+
+
+def test_trades_to_bars_fills_flat_periods():
+    ticks = decode_trades([
+        ['10.0', '1.0', 60.5, 'b', 'm', ''],
+        ['12.0', '3.0', 61.0, 's', 'l', ''],
+        ['11.0', '2.0', 185.0, 'b', 'm', ''],
+    ])
+    bars = trades_to_bars(ticks, period_s=60)
+
+    assert list(bars['index']) == [0, 1, 2]
+    assert list(bars['time']) == [60, 120, 180]
+    assert list(bars['open']) == [10, 12, 11]
+    assert list(bars['high']) == [12, 12, 11]
+    assert list(bars['low']) == [10, 12, 11]
+    assert list(bars['close']) == [12, 12, 11]
+    assert list(bars['volume']) == [4, 0, 2]
+    assert list(bars['count']) == [2, 0, 1]
+
+    # flat bars carry the last vwap forward
+    assert np.allclose(bars['vwap'], [11.5, 11.5, 11])
+
+
+class FakeWebSocket:
+    def __init__(self, msgs):
+        self.sent = []
+        self._msgs = list(msgs)
+
+    async def send_message(self, msg):
+        self.sent.append(json.loads(msg))
+
+    async def get_message(self):
+        if self._msgs:
+            return json.dumps(self._msgs.pop(0))
+        await trio.sleep_forever()
+
+
+class FakeClient:
+    async def symbol_info(self, sym):
+        return {'wsname': f'{sym[:3]}/{sym[3:]}'}
+
+
+@tractor_test
+async def test_single_connection_streams_all_symbols(loglevel, monkeypatch):
+    symbols = ['XBTUSD', 'XMRUSD']
+    shms = {
+        sym: open_shm_array(
+            key=f'test_kraken.{sym}.{uuid.uuid4()}',
+            size=16,
+            dtype=kraken.ohlc_dtype,
+        )
+        for sym in symbols
+    }
+    ws = FakeWebSocket([
+        [1, [['10.0', '1.0', 60.5, 'b', 'm', '']], 'trade', 'XBT/USD'],
+        [2, [['20.0', '2.0', 60.5, 's', 'l', '']], 'trade', 'XMR/USD'],
+    ])
+    connections = []
+
+    @asynccontextmanager
+    async def get_client():
+        yield FakeClient()
+
+    @asynccontextmanager
+    async def open_websocket_url(url):
+        connections.append(url)
+        yield ws
+
+    async def load_history(client, sym, shm):
+        bar = np.zeros(1, dtype=shm.array.dtype)
+        bar['time'] = 60
+        shm.push(bar)
+        return open_tick_buffer(shm)
+
+    async def backfill_history(*args):
+        pass
+
+    monkeypatch.setattr(kraken, 'get_client', get_client)
+    monkeypatch.setattr(kraken, 'load_history', load_history)
+    monkeypatch.setattr(kraken, 'backfill_history', backfill_history)
+    monkeypatch.setattr(
+        kraken.trio_websocket, 'open_websocket_url', open_websocket_url)
+
+    stream = kraken.stream_quotes(
+        shm_tokens={sym: shm.token for sym, shm in shms.items()},
+        symbols=symbols,
+    )
+    tokens, writers = await stream.__anext__()
+    assert writers == {'XBTUSD': True, 'XMRUSD': True}
+
+    quotes = [await stream.__anext__() for _ in symbols]
+    await stream.aclose()
+
+    # both symbols are subscribed to and streamed over one connection
+    assert len(connections) == 1
+    assert [msg['pair'] for msg in ws.sent] == [['XBT/USD', 'XMR/USD']] * 2
+    assert [list(quote) for quote in quotes] == [['XBTUSD'], ['XMRUSD']]
+
+    # and each symbol's trades are written to its own bar buffer
+    assert shms['XBTUSD'].last()[-1]['close'] == 10
+    assert shms['XMRUSD'].last()[-1]['close'] == 20
+
+
+@tractor_test
+async def test_trades_paginates_paced(loglevel, monkeypatch):
+    monkeypatch.setattr(kraken, '_public_rate_s', 0.05)
+    monkeypatch.setattr(kraken, '_trades_page_size', 2)
+    trades = [[str(t), '1.0', t, 'b', 'm', ''] for t in np.arange(7) + 100.5]
+    calls = []
+
+    async def _public(method, data):
+        calls.append((trio.current_time(), int(data['since'])))
+        if len(calls) == 1:
+            return {'error': ['EAPI:Too many requests'], 'result': {}}
+
+        since = int(data['since'])
+        rows = [row for row in trades if int(row[2] * 1e9) > since][:2]
+        return {
+            'error': [],
+            'result': {
+                'XXBTZUSD': rows,
+                'last': str(int(rows[-1][2] * 1e9)),
+            },
+        }
+
+    client = kraken.Client()
+    monkeypatch.setattr(client, '_public', _public)
+    ticks = await client.trades('XBTUSD', 100, 105)
+
+    assert list(ticks['time']) == [100.5, 101.5, 102.5, 103.5, 104.5]
+
+    # pages are requested from the last trade of the prior page after
+    # backing off from the rate limit, each spaced by the pacing rate
+    assert [since for _, since in calls] == [
+        int(100e9), int(100e9), int(101.5e9), int(103.5e9)]
+    assert all(
+        b - a >= 0.05 for (a, _), (b, _) in zip(calls, calls[1:]))
+
+
+class FakeTradesClient:
+    def __init__(self):
+        self.windows = []
+
+    async def trades(self, symbol, start, end):
+        self.windows.append((start, end))
+        # one trade per minute
+        times = np.arange(start, end, 60) + 1.
+        return decode_trades(
+            [[str(t), '1.0', t, 'b', 'm', ''] for t in times])
+
+
+@pytest.mark.parametrize('room', [30, 120])
+@tractor_test
+async def test_backfill_history_prepends_windows(loglevel, monkeypatch, room):
+    monkeypatch.setattr(kraken, '_history_window_s', 10 * 60)
+    shm = open_shm_array(
+        key=f'test_kraken_backfill.{uuid.uuid4()}',
+        size=16,
+        prepend_size=room,
+        dtype=kraken.ohlc_dtype,
+    )
+    end = 1600000020 - 1600000020 % 60
+    bars = np.zeros(3, dtype=kraken.ohlc_dtype)
+    bars['index'] = np.arange(3)
+    bars['time'] = end + 60 * np.arange(3)
+    shm.push(bars)
+
+    client = FakeTradesClient()
+    await kraken.backfill_history(client, 'XBTUSD', shm, days=1/24)
+
+    # windows are fetched back to ``days`` ago
+    windows = sorted(client.windows)
+    assert windows[-1] == (end - 600, end)
+    assert windows[0][0] >= end - 3600
+
+    # history is prepended contiguously up to the reserved room
+    array = shm.array
+    n = min(room, 60)
+    assert shm.first_index == room - n
+    assert len(array) == n + 3
+    assert list(array['time']) == list(end + 60 * np.arange(-n, 3))
+    assert list(array['index']) == list(range(-n, 3))
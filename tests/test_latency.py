@@ -0,0 +1,55 @@
+"""
+Quote latency tracing testing
+"""
+import uuid
+
+import pytest
+from tractor.testing import tractor_test
+
+from piker.fsp import latency
+from piker.data import _latency, open_shm_array
+from piker.data._source import ohlc_zeros
+from piker.data._latency import Histogram, record_hops, latency_report
+
+
+def test_histogram_percentiles():
+    hist = Histogram(sub_buckets=64)
+    for ms in range(1, 101):
+        hist.record(ms / 1e3)
+
+    assert hist.count == 100
+    assert hist.percentile(50) == pytest.approx(50e-3, rel=1/64)
+    assert hist.percentile(99) == pytest.approx(99e-3, rel=1/64)
+    assert hist.percentile(100) == hist.max == 0.1
+
+    # clock skew doesn't break anything
+    hist.record(-1)
+    assert hist.counts[0] == 1
+
+
+def test_record_hops_skips_missing(monkeypatch):
+    monkeypatch.setattr(_latency, '_histograms', {})
+    record_hops(
+        {'broker_ts': 1., 'brokerd_ts': 1.01, 'send_ts': 1.02},
+        recv=1.05,
+    )
+    report = latency_report()
+    assert list(report) == ['broker->brokerd', 'brokerd->send', 'send->recv']
+    assert report['send->recv']['p50'] == pytest.approx(30, rel=1/64)
+
+
+@tractor_test
+async def test_latency_fsp_on_shm(loglevel):
+    shm = open_shm_array(key=f'test_latency.{uuid.uuid4()}', size=10)
+    shm.push(ohlc_zeros(3))
+
+    async def source():
+        yield {'broker_ts': 1., 'recv_ts': 1.25}
+        yield {'recv_ts': 2.}
+
+    values = []
+    async for value in latency(source(), shm):
+        values.append(value)
+
+    assert list(values[0]) == [0, 0, 0]
+    assert values[1:] == [250]
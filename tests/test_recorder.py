@@ -0,0 +1,95 @@
+"""
+Binary tick recorder testing
+"""
+import os
+import tempfile
+
+import numpy as np
+from tractor.testing import tractor_test
+
+from piker.data import open_tick_recorder
+from piker.data._normalize import QuoteEncoder, QuoteDecoder
+from piker.data._recorder import iter_blocks, iter_packets
+
+
+def quotes(t, price):
+    return {
+        'xbtusd': {
+            'brokerd_ts': t,
+            'ticks': [
+                {'type': 'trade', 'price': price, 'size': 0.5},
+                {'type': 'bid', 'price': price - 0.1},
+            ],
+        },
+        'xmrusd': {'brokerd_ts': t, 'ticks': [{'type': 'ask'}]},
+    }
+
+
+@tractor_test
+async def test_record_rotate_and_seek(loglevel):
+    path = os.path.join(tempfile.mkdtemp(), 'test')
+
+    async with open_tick_recorder(path, rotate_bytes=1) as recorder:
+        for i in range(3):
+            recorder.record(quotes(100 + i, 19000.1 + i))
+            await recorder.flush()
+
+    # every block after the first rotated to a new, self contained file
+    assert len(recorder.files) == 3
+
+    packets = list(iter_packets(recorder.files))
+    assert len(packets) == 3
+    assert packets[1]['xbtusd'] == {
+        'brokerd_ts': 101,
+        'ticks': [
+            {'type': 'trade', 'price': 19001.1, 'size': 0.5},
+            {'type': 'bid', 'price': 19001.0, 'size': 0},
+        ],
+    }
+    assert np.isnan(packets[1]['xmrusd']['ticks'][0]['price'])
+
+    # seeking skips whole blocks by their header
+    assert [
+        p['xbtusd']['brokerd_ts'] for p in iter_packets(
+            recorder.files, start=101.5)
+    ] == [102]
+
+    topics, ticks = next(iter_blocks(recorder.files[0]))
+    assert set(topics.values()) == {'xbtusd', 'xmrusd'}
+    assert len(ticks) == 3
+
+
+@tractor_test
+async def test_record_l1_field_changes(loglevel):
+    path = os.path.join(tempfile.mkdtemp(), 'test')
+
+    async with open_tick_recorder(path) as recorder:
+        recorder.record({'spy': {'brokerd_ts': 1, 'bid': 10., 'ask': 11.}})
+        # unchanged fields aren't recorded again
+        recorder.record({'spy': {'brokerd_ts': 2, 'bid': 10., 'ask': 12.}})
+        recorder.record({'spy': {'brokerd_ts': 3, 'bid': 10.}})
+
+    assert list(iter_packets(recorder.files)) == [
+        {'spy': {'brokerd_ts': 1, 'bid': 10., 'ask': 11., 'ticks': []}},
+        {'spy': {'brokerd_ts': 2, 'ask': 12., 'ticks': []}},
+    ]
+
+
+@tractor_test
+async def test_record_packed_feed_ticks(loglevel):
+    encoder, decoder = QuoteEncoder(), QuoteDecoder()
+    paths = [os.path.join(tempfile.mkdtemp(), 'test') for _ in range(2)]
+
+    # feed quotes (with packed ticks) record the same as raw ones
+    async with open_tick_recorder(paths[0]) as raw, \
+            open_tick_recorder(paths[1]) as fed:
+        for i in range(3):
+            msg = quotes(100 + i, 19000.1 + i)
+            raw.record(msg)
+            fed.record(decoder.decode(encoder.encode(msg)))
+
+    raw_packets = list(iter_packets(raw.files))
+    fed_packets = list(iter_packets(fed.files))
+    assert [p['xbtusd'] for p in fed_packets] == [
+        p['xbtusd'] for p in raw_packets]
+    assert len(fed_packets) == 3
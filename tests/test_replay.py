@@ -0,0 +1,88 @@
+"""
+Recorded feed replay backend testing
+"""
+import json
+import tempfile
+import uuid
+
+import trio
+from tractor.testing import tractor_test
+
+from piker.brokers import replay
+from piker.data import open_shm_array, open_shm_token, attach_shm_array
+from piker.data._source import base_ohlc_dtype
+
+
+@tractor_test
+async def test_trades_step_bars_by_recording_clock(loglevel):
+    shm = open_shm_array(key=f'test_replay.{uuid.uuid4()}', size=10)
+
+    replay.write_bar_trades(shm, 61, [10], [1])
+    replay.write_bar_trades(shm, 62, [12], [2])
+    replay.write_bar_trades(shm, 119, [9], [1])
+    replay.write_bar_trades(shm, 300, *replay.trades({'ticks': [
+        {'type': 'bid', 'price': 10.5},
+        {'type': 'trade', 'price': 11, 'size': 1},
+    ]}))
+
+    bars = shm.array
+    assert list(bars['index']) == [0, 1]
+    assert list(bars['time']) == [60, 300]
+    assert tuple(bars[0][['open', 'high', 'low', 'close', 'volume']]) == (
+        10, 12, 9, 9, 4)
+
+
+@tractor_test
+async def test_replay_keeps_original_spacing(loglevel):
+    with tempfile.NamedTemporaryFile('w', delete=False) as f:
+        for t in (100, 100.1, 100.3):
+            f.write(json.dumps({'xbtusd': {'brokerd_ts': t}}))
+            f.write('\n--\n')
+
+    start = trio.current_time()
+    times = []
+    async for t, packet in replay.replay(
+        replay.open_recording(f.name),
+        speed=10,
+    ):
+        times.append((t, trio.current_time() - start))
+
+    assert [t for t, _ in times] == [100, 100.1, 100.3]
+    assert abs(times[-1][1] - 0.03) < 0.01
+
+
+@tractor_test
+async def test_stream_quotes_writes_replayed_trades(loglevel, monkeypatch):
+    with tempfile.NamedTemporaryFile('w', delete=False) as f:
+        for t, price in ((61, 10), (62, 12), (125, 11)):
+            f.write(json.dumps({'xbtusd.kraken': {
+                'broker_ts': t,
+                'ticks': [{'type': 'trade', 'price': price, 'size': 1}],
+            }}))
+            f.write('\n--\n')
+
+    monkeypatch.setattr(
+        replay, 'get_config',
+        lambda: {'path': f.name, 'speed': 0, 'start': None})
+    sym = 'XBTUSD'
+    entry = await open_shm_token(
+        f'replay.{sym}.{uuid.uuid4()}',
+        dtype_descr=base_ohlc_dtype.descr,
+        size=10,
+    )
+    stream = replay.stream_quotes(
+        shm_tokens={sym: entry['token']}, symbols=[sym])
+    try:
+        tokens, writers = await stream.__anext__()
+        assert writers == {sym: True}
+        quotes = [await stream.__anext__() for _ in range(3)]
+    finally:
+        await stream.aclose()
+
+    assert [q['xbtusd.kraken']['recorded_broker_ts'] for q in quotes] == [
+        61, 62, 125]
+    bars = attach_shm_array(token=entry['token']).array
+    assert list(bars['time']) == [60, 120]
+    assert tuple(bars[0][['open', 'high', 'low', 'close', 'volume']]) == (
+        10, 12, 10, 12, 2)
+    assert tuple(bars[1][['open', 'close', 'volume']]) == (11, 11, 1)
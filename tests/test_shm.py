@@ -0,0 +1,617 @@
+"""
+Shared memory array testing
+"""
+import tempfile
+import time
+import uuid
+
+import msgpack
+import numpy as np
+import pytest
+import trio
+from tractor.testing import tractor_test
+
+from piker.brokers import config
+from piker.data import (
+    open_shm_array,
+    attach_shm_array,
+    open_tick_buffer,
+    push_ticks,
+    open_derived_buffers,
+    fill_gap,
+    prepend_history,
+    write_trades,
+    open_shm_token,
+    lookup_shm_token,
+    activate_writer,
+    subscribe_ohlc_for_increment,
+    update_derived,
+)
+from piker.data._buffer import (
+    increment_bars,
+    increment_ohlc_buffer,
+    resample,
+    roll_derived,
+    _increment_bars,
+    _pack_for_increment,
+    _shms,
+    _packed,
+    _calendars,
+)
+from piker.data import _sharedmem
+from piker.data._source import ohlc_zeros, tick_types
+from piker.data._calendar import MarketCalendar
+
+
+def rows(start: int, stop: int) -> np.ndarray:
+    array = ohlc_zeros(stop - start)
+    array['index'] = np.arange(start, stop)
+    return array
+
+
+@tractor_test
+async def test_ring_wraps_and_reads_in_order(loglevel):
+    shm = open_shm_array(
+        key=f'test_ring.{uuid.uuid4()}',
+        size=10,
+        ring=True,
+    )
+    assert shm.push(rows(0, 8)) == 8
+    assert shm.first_index == 0
+
+    # wrap 3 entries around to the front of the segment
+    assert shm.push(rows(8, 13)) == 13
+    assert shm.first_index == 3
+    assert shm.last_index == 13
+    assert list(shm.array['index']) == list(range(3, 13))
+
+    # latest entries are contiguous and thus a zero-copy view
+    last = shm.last(3)
+    assert list(last['index']) == [10, 11, 12]
+    assert np.shares_memory(last, shm._array)
+
+    # readers see the same wrapped state
+    reader = attach_shm_array(token=shm.token)
+    assert reader._len == shm._len
+    assert list(reader.array['index']) == list(range(3, 13))
+
+
+@tractor_test
+async def test_ring_push_larger_then_buffer(loglevel):
+    shm = open_shm_array(
+        key=f'test_ring.{uuid.uuid4()}',
+        size=10,
+        ring=True,
+    )
+    shm.push(rows(0, 25))
+    assert shm.first_index == 15
+    assert list(shm.array['index']) == list(range(15, 25))
+
+
+@tractor_test
+async def test_seqlock_consistent_reads(loglevel):
+    shm = open_shm_array(key=f'test_seqlock.{uuid.uuid4()}', size=10)
+    shm.push(rows(0, 3))
+    seq = shm.seq
+    assert seq % 2 == 0
+
+    with shm.seqlock():
+        # a write in progress is detected by readers
+        assert shm.seq % 2
+        shm.last()['close'] = 10
+
+        with pytest.raises(RuntimeError):
+            shm.read_last_consistent(max_tries=10)
+
+    assert shm.seq == seq + 2
+
+    last = shm.read_last_consistent()
+    assert last['close'][-1] == 10
+
+    # a copy not a view
+    assert not np.shares_memory(last, shm._array)
+
+
+@tractor_test
+async def test_prepend_keeps_index_contiguous(loglevel):
+    shm = open_shm_array(
+        key=f'test_prepend.{uuid.uuid4()}',
+        size=10,
+        prepend_size=5,
+    )
+    shm.push(rows(3, 6))
+    assert shm.first_index == 5
+
+    # index field is rewritten to count down from the first entry
+    assert shm.prepend(rows(100, 103)) == 2
+    assert list(shm.array['index']) == [0, 1, 2, 3, 4, 5]
+
+    with pytest.raises(ValueError):
+        shm.prepend(rows(0, 3))
+
+
+@tractor_test
+async def test_persisted_array_restored_on_reopen(loglevel):
+    config._override_config_dir(tempfile.mkdtemp())
+    key = f'test_persist.{uuid.uuid4()}'
+
+    shm = open_shm_array(key=key, size=10, persist=True)
+    shm.push(rows(0, 4))
+    shm.destroy()  # flushes and only unlinks the seqlock
+
+    shm = open_shm_array(key=key, size=10, persist=True)
+    assert list(shm.array['index']) == [0, 1, 2, 3]
+    assert shm.seq == 0
+
+    # readers map the same files
+    reader = attach_shm_array(token=shm.token)
+    assert list(reader.array['index']) == [0, 1, 2, 3]
+    shm.destroy()
+
+    # files written with a different dtype (of the same size) are
+    # discarded instead of being reinterpreted
+    dtype = np.dtype([
+        (name, 'f8') for name in ohlc_zeros(0).dtype.names])
+    assert dtype.itemsize == ohlc_zeros(0).dtype.itemsize
+    shm = open_shm_array(key=key, size=10, persist=True, dtype=dtype)
+    assert len(shm.array) == 0
+
+
+@tractor_test
+async def test_persisted_array_trimmed_when_full(loglevel):
+    config._override_config_dir(tempfile.mkdtemp())
+    shm = open_shm_array(
+        key=f'test_persist_full.{uuid.uuid4()}',
+        size=8,
+        persist=True,
+    )
+    bars = rows(0, 6)
+    bars['time'] = np.arange(6) * 60
+    shm.push(bars)
+    subscribe_ohlc_for_increment(shm, 60)
+    try:
+        # the oldest entries are dropped instead of growing the file
+        increment_bars(60, 540, steps=4)
+        assert len(shm.array) == 8
+        assert list(shm.array['index']) == list(range(2, 10))
+        assert list(shm.array['time']) == list(np.arange(2, 10) * 60)
+
+    finally:
+        _shms[60].remove(shm)
+        _packed.pop(60, None)
+
+    shm.push(rows(10, 13))
+    assert list(shm.array['index']) == list(range(6, 13))
+
+    # pushes larger then the file keep only the latest entries
+    shm.push(rows(13, 23))
+    assert list(shm.array['index']) == list(range(15, 23))
+    shm.destroy()
+
+
+@tractor_test
+async def test_wait_for_update_wakes_reader(loglevel):
+    shm = open_shm_array(key=f'test_wait.{uuid.uuid4()}', size=10)
+    seq = shm.seq
+
+    async def write():
+        await trio.sleep(0.1)
+        shm.push(rows(0, 1))
+
+    async with trio.open_nursery() as n:
+        n.start_soon(write)
+        with trio.fail_after(1):
+            seq = await shm.wait_for_update(seq)
+
+    assert seq == shm.seq
+    assert shm.last()['index'][-1] == 0
+
+
+@pytest.mark.skipif(
+    _sharedmem._SYS_futex is None,
+    reason='no futex support',
+)
+@tractor_test
+async def test_wait_for_update_blocks_until_woken(loglevel):
+    shm = open_shm_array(key=f'test_wake.{uuid.uuid4()}', size=10)
+    seq = shm.seq
+
+    async def write():
+        await trio.sleep(0.1)
+        write.t = trio.current_time()
+        shm.push(rows(0, 1))
+
+    async with trio.open_nursery() as n:
+        n.start_soon(write)
+
+        # idle readers aren't polling but woken by the writer
+        seq = await shm.wait_for_update(seq, idle_s=5)
+        assert trio.current_time() - write.t < 0.05
+
+    assert seq == shm.seq
+
+
+@tractor_test
+async def test_columnar_layout(loglevel):
+    shm = open_shm_array(
+        key=f'test_columnar.{uuid.uuid4()}',
+        size=10,
+        ring=True,
+        columnar=True,
+    )
+    shm.push(rows(0, 8))
+
+    # single field reads are contiguous zero-copy views
+    close = shm.column('close')
+    assert close.flags['C_CONTIGUOUS']
+    assert np.shares_memory(close, shm._columns['close'])
+
+    # in-place writes go through column views
+    with shm.seqlock():
+        shm.column('close')[-1] = 10
+
+    shm.push(rows(8, 13))
+    reader = attach_shm_array(token=shm.token)
+    assert reader._len == shm._len
+    assert list(reader.array['index']) == list(range(3, 13))
+    assert reader.array['close'][4] == 10
+    assert list(reader.column('index')) == list(range(3, 13))
+
+
+@tractor_test
+async def test_push_ticks(loglevel):
+    base = open_shm_array(key=f'test_ticks.{uuid.uuid4()}', size=10)
+    shm = open_tick_buffer(base, size=4)
+
+    push_ticks(
+        shm,
+        [
+            {'type': 'trade', 'price': 1, 'size': 2},
+            {'type': 'bid', 'price': 0.5},
+            {'type': 'wat', 'price': 2},
+        ],
+        t=10,
+        exchange='kraken',
+    )
+    push_ticks(shm, [{'type': 'ask', 'price': 3, 'size': 1}] * 2, t=11)
+
+    # ring keeps only the latest ticks
+    ticks = shm.array
+    assert list(ticks['time']) == [10, 10, 11, 11]
+    assert [tick_types[t] for t in ticks['type']] == [
+        'bid', 'n/a', 'ask', 'ask']
+    assert ticks['exchange'][0] == b'kraken'
+    assert ticks['size'][0] == 0
+
+
+@tractor_test
+async def test_grow_remaps_readers(loglevel):
+    shm = open_shm_array(key=f'test_grow.{uuid.uuid4()}', size=4)
+    reader = attach_shm_array(token=shm.token)
+    shm.push(rows(0, 3))
+
+    # overflowing pushes grow the buffer
+    shm.push(rows(3, 6))
+    assert shm.generation == 1
+    assert shm._len == 8
+    assert list(shm.array['index']) == list(range(6))
+
+    # attached readers transparently remap on their next read
+    assert list(reader.array['index']) == list(range(6))
+    assert reader._len == 8
+    assert reader.token == shm.token
+
+    # as do new readers
+    assert len(attach_shm_array(token=shm.token).array) == 6
+
+
+@tractor_test
+async def test_fill_gap_overwrites_flat_bars(loglevel):
+    shm = open_shm_array(key=f'test_gap.{uuid.uuid4()}', size=16)
+    bars = rows(0, 10)
+    bars['time'] = np.arange(10) * 60
+    bars['close'] = 1
+    shm.push(bars)
+    derived = open_derived_buffers(shm, 60, tfs=('5m',))['5m']
+
+    # bars 6-9 are "flat" increments from an outage, re-fetch 6-10
+    fetched = rows(0, 5)
+    fetched['time'] = np.arange(6, 11) * 60
+    fetched['close'] = 2
+    fetched['volume'] = 1
+    assert fill_gap(shm, fetched) == 5
+
+    array = shm.array
+    assert list(array['index']) == list(range(11))
+    assert list(array['close']) == [1] * 6 + [2] * 5
+    assert list(array['volume']) == [0] * 6 + [1] * 5
+
+    # higher time frames are re-derived over the filled range
+    assert list(derived.array['time']) == [0, 300, 600]
+    assert list(derived.array['close']) == [1, 2, 2]
+    assert list(derived.array['volume']) == [0, 4, 1]
+
+
+@tractor_test
+async def test_write_trades_batch(loglevel):
+    dtype = np.dtype(ohlc_zeros(0).dtype.descr + [
+        ('count', int), ('vwap', float)])
+    shm = open_shm_array(
+        key=f'test_trades.{uuid.uuid4()}',
+        size=4,
+        dtype=dtype,
+    )
+    bar = np.zeros(1, dtype=dtype)
+    bar[['open', 'high', 'low', 'close']] = (10, 10, 10, 10)
+    shm.push(bar)
+    seq = shm.seq
+
+    # first trades of a (flat) bar reset its prices
+    write_trades(shm, np.array([12., 11.]), np.array([1., 3.]))
+    last = shm.last()[-1]
+    assert tuple(last[['open', 'high', 'low', 'close', 'volume']]) == (
+        12, 12, 11, 11, 4)
+    assert last['count'] == 2
+    assert last['vwap'] == pytest.approx(11.25)
+
+    write_trades(shm, np.array([13.]), np.array([4.]))
+    last = shm.last()[-1]
+    assert tuple(last[['open', 'high', 'low', 'close', 'volume']]) == (
+        12, 13, 11, 13, 8)
+    assert last['count'] == 3
+    assert last['vwap'] == pytest.approx((11.25 * 4 + 13 * 4) / 8)
+
+    # one (seqlocked) write per batch
+    assert shm.seq == seq + 4
+
+
+@tractor_test
+async def test_prepend_history_extends_derived(loglevel):
+    shm = open_shm_array(
+        key=f'test_prepend.{uuid.uuid4()}',
+        size=16,
+        ring=True,
+    )
+    bars = rows(0, 4)
+    bars['time'] = np.arange(7, 11) * 60
+    bars['high'] = bars['close'] = 1
+    bars['volume'] = 1
+    shm.push(bars)
+    derived = open_derived_buffers(shm, 60, tfs=('5m',))['5m']
+    assert list(derived.array['time']) == [300, 600]
+
+    older = rows(0, 7)
+    older['time'] = np.arange(0, 7) * 60
+    older['high'] = older['close'] = 2
+    older['volume'] = 1
+
+    # overlapping bars are dropped
+    assert prepend_history(shm, np.concatenate((older, bars[:1]))) == 7
+    assert list(shm.array['index']) == list(range(-7, 4))
+    assert list(shm.array['time']) == list(np.arange(11) * 60)
+
+    # the straddled derived bar is re-aggregated and older ones prepended
+    assert list(derived.array['time']) == [0, 300, 600]
+    assert list(derived.array['high']) == [2, 2, 1]
+    assert list(derived.array['volume']) == [5, 5, 1]
+
+
+@tractor_test
+async def test_increment_aligned_catch_up(loglevel):
+    shm = open_shm_array(key=f'test_increment.{uuid.uuid4()}', size=16)
+    bars = rows(0, 3)
+    bars['time'] = np.arange(3) * 60
+    bars['close'] = 5
+    bars['volume'] = 1
+    shm.push(bars)
+    subscribe_ohlc_for_increment(shm, 60)
+    try:
+        # the new bar's time is snapped to the period boundary
+        increment_bars(60, 187.5)
+        assert shm.array['time'][-1] == 180
+
+        # no bar is written again for a boundary already passed, nor
+        # are derived bars rolled (and thus double counted)
+        derived = open_derived_buffers(shm, 60, tfs=('5m',))['5m']
+        with shm.seqlock():
+            shm.last()['volume'][-1] = 2
+        update_derived(shm)
+        increment_bars(60, 200)
+        assert len(shm.array) == 4
+        update_derived(shm)
+        assert derived.array['volume'].sum() == shm.array['volume'].sum()
+
+        # after a stall all missed bars are written in one (seqlocked)
+        # pass, but never before the last bar
+        seq = shm.seq
+        increment_bars(60, 481, steps=10)
+        assert shm.seq == seq + 2
+        array = shm.array
+        assert list(array['index']) == list(range(9))
+        assert list(array['time']) == list(np.arange(9) * 60)
+        assert list(array['close']) == [5] * 9
+        assert list(array['volume']) == [1] * 3 + [2] + [0] * 5
+
+    finally:
+        _shms[60].remove(shm)
+        _packed.pop(60, None)
+
+
+def test_resample():
+    bars = rows(0, 5)
+    bars['time'] = np.arange(5) * 60 + 120
+    bars['open'] = bars['close'] = np.arange(5)
+    bars['high'] = np.arange(5) + 1
+    bars['low'] = np.arange(5) - 1
+    bars['volume'] = 1
+
+    out = resample(bars, 300)
+    assert list(out['index']) == [0, 1]
+    assert list(out['time']) == [0, 300]
+    assert list(out['open']) == [0, 3]
+    assert list(out['high']) == [3, 5]
+    assert list(out['low']) == [-1, 2]
+    assert list(out['close']) == [2, 4]
+    assert list(out['volume']) == [3, 2]
+
+    empty = resample(rows(0, 0), 300)
+    assert len(empty) == 0
+    assert empty.dtype == bars.dtype
+
+
+@tractor_test
+async def test_derived_buffers_follow_base(loglevel):
+    shm = open_shm_array(key=f'test_derived.{uuid.uuid4()}', size=16)
+
+    # an empty base gets empty derived buffers
+    derived = open_derived_buffers(shm, 60, tfs=('5m',))['5m']
+    assert len(derived.array) == 0
+
+    bar = rows(0, 1)
+    bar['time'] = 240
+    bar[['open', 'high', 'low', 'close']] = (1, 1, 1, 1)
+    shm.push(bar)
+    roll_derived(shm)
+    assert list(derived.array['time']) == [0]
+
+    # updates of the base's last bar are folded into the derived bar
+    with shm.seqlock():
+        shm.last()[['high', 'close', 'volume']][-1] = (3, 2, 5)
+    update_derived(shm)
+    assert tuple(derived.last()[-1][
+        ['open', 'high', 'low', 'close', 'volume']]) == (1, 3, 1, 2, 5)
+
+    # and a base bar in the next period starts a new derived bar
+    bar['index'] = 1
+    bar['time'] = 300
+    shm.push(bar)
+    roll_derived(shm)
+    assert list(derived.array['time']) == [0, 300]
+    assert tuple(derived.last()[-1][['open', 'close', 'volume']]) == (
+        2, 2, 0)
+
+
+@tractor_test
+async def test_increment_kernel_matches_python(loglevel):
+    dtype = np.dtype(ohlc_zeros(0).dtype.descr + [('vwap', float)])
+    bars = np.zeros(6, dtype=dtype)
+    bars['index'] = np.arange(6)
+    bars['time'] = np.arange(6) * 60
+    bars['close'] = bars['vwap'] = np.arange(6) + 0.5
+    bars['volume'] = 1
+
+    results = []
+    for kernel in (_increment_bars, _increment_bars.py_func):
+        # a full, a wrapping (ring) and an inactive buffer
+        shms = [
+            open_shm_array(
+                key=f'test_kernel.{uuid.uuid4()}',
+                size=size,
+                dtype=dtype,
+                ring=ring,
+            )
+            for size, ring in ((6, False), (8, True), (8, False))
+        ]
+        for shm in shms:
+            shm.push(bars)
+
+        (_, fields, rings, _, time_type), = _pack_for_increment(shms)
+        full = kernel(
+            *fields,
+            rings,
+            np.array([True, True, False]),
+            time_type(60),
+            time_type(600),
+            5,
+        )
+        results.append((
+            list(full),
+            [shm.array.tolist() for shm in shms],
+            [shm.seq for shm in shms],
+        ))
+
+    assert results[0] == results[1]
+    full, arrays, seqs = results[0]
+    assert full == [True, False, False]
+    assert [bar[0] for bar in arrays[1]] == list(range(3, 11))
+    assert seqs == [2, 4, 2]
+
+
+@tractor_test
+async def test_token_registry_reuse(loglevel):
+    key = f'test_registry.{uuid.uuid4()}'
+    assert await lookup_shm_token(key) is None
+
+    # as received over IPC: with every tuple packed as a list
+    dtype = np.dtype(ohlc_zeros(0).dtype.descr + [('bids', 'f8', (2,))])
+    descr = msgpack.unpackb(msgpack.packb(dtype.descr))
+    assert isinstance(descr[0], list)
+    entries = []
+
+    async def open_token():
+        entries.append(msgpack.unpackb(msgpack.packb(
+            await open_shm_token(key, dtype_descr=descr))))
+
+    # concurrent requests resolve the same (single) array
+    async with trio.open_nursery() as n:
+        n.start_soon(open_token)
+        n.start_soon(open_token)
+
+    first, second = entries
+    assert first == second
+    assert first['writer'] is None
+
+    writer = attach_shm_array(token=first['token'], readonly=False)
+    assert writer.array.dtype == dtype
+    bars = np.zeros(2, dtype=dtype)
+    bars['index'] = [0, 1]
+    writer.push(bars)
+    reader = attach_shm_array(token=second['token'])
+    assert list(reader.array['index']) == [0, 1]
+
+    # a single writer is registered at a time
+    with activate_writer(key) as writer_exists:
+        assert not writer_exists
+        with activate_writer(key) as writer_exists:
+            assert writer_exists
+        assert (await lookup_shm_token(key))['writer'] is not None
+
+    assert (await lookup_shm_token(key))['writer'] is None
+
+
+@tractor_test
+async def test_increment_wakes_on_subscribe(loglevel):
+    closed = open_shm_array(key=f'test_closed.{uuid.uuid4()}', size=16)
+    closed.push(rows(0, 1))
+    # a single minute session per week such that the market is closed
+    # (and the incrementer sleeps for days)
+    cal = MarketCalendar('closed', 'UTC', ((0, 1),))
+    if cal.is_open(time.time()):
+        pytest.skip("Closed market calendar is open")
+
+    subscribe_ohlc_for_increment(closed, 1, calendar=cal)
+    opened = open_shm_array(key=f'test_opened.{uuid.uuid4()}', size=16)
+    opened.push(rows(0, 1))
+    incrementer = getattr(
+        increment_ohlc_buffer, '__wrapped__', increment_ohlc_buffer)
+    steps = incrementer(None, lambda: ())
+    try:
+        async def subscribe():
+            await trio.sleep(1.5)
+            subscribe_ohlc_for_increment(opened, 1)
+
+        async with trio.open_nursery() as n:
+            n.start_soon(subscribe)
+            with trio.fail_after(4):
+                msg = await steps.__anext__()
+
+        assert msg['index'] == opened._i.value
+        assert len(closed.array) == 1
+
+    finally:
+        await steps.aclose()
+        for shm in (closed, opened):
+            _shms[1].remove(shm)
+            shm.destroy()
+        _packed.pop(1, None)
+        _calendars.pop(closed.key, None)
@@ -0,0 +1,119 @@
+"""
+Simulated broker backend testing
+"""
+import uuid
+
+import trio
+from tractor.testing import tractor_test
+
+from piker.brokers import sim, get_brokermod
+from piker.data import (
+    fan_out_quotes,
+    open_shm_token,
+    lookup_shm_token,
+    attach_shm_array,
+    tick_shm_key,
+)
+from piker.data._buffer import _shms, _packed, _derived
+from piker.data._fanout import _LocalContext
+from piker.data._source import base_ohlc_dtype, tick_dtype, tick_types
+
+
+def test_loadable():
+    assert get_brokermod('sim') is sim
+
+
+@tractor_test
+async def test_bars_are_deterministic(loglevel):
+    async with sim.get_client() as client:
+        bars = await client.bars('SIM0', count=100, end=1000)
+        again = await client.bars('SIM0', count=100, end=1000)
+        other = await client.bars('SIM1', count=100, end=1000)
+
+    assert (bars == again).all()
+    assert not (bars['close'] == other['close']).all()
+    assert bars['time'][-1] == 1000
+    assert (bars['high'] >= bars['close']).all()
+    assert (bars['low'] <= bars['open']).all()
+
+
+@tractor_test
+async def test_resubscribe_restarts_upstream(loglevel):
+    sym = f'SIM.{uuid.uuid4()}'
+    entry = await open_shm_token(
+        f'sim.{sym}',
+        dtype_descr=base_ohlc_dtype.descr,
+        size=4096,
+    )
+
+    async def subscribe():
+        msgs = []
+        with trio.CancelScope() as cs:
+
+            def on_msg(msg):
+                msgs.append(msg)
+                if len(msgs) == 2:
+                    cs.cancel()
+
+            await fan_out_quotes(
+                ctx=_LocalContext(on_msg),
+                mod_path=sim.__name__,
+                symbols=[sym],
+                shm_tokens={sym: entry['token']},
+            )
+        return msgs
+
+    try:
+        # the upstream (and its writer) is stopped after the first
+        # subscriber leaves and restarted for the second
+        for _ in range(2):
+            with trio.fail_after(5):
+                tokens, writers = (await subscribe())[0]
+            assert writers == {sym: True}
+
+        shm = attach_shm_array(token=entry['token'])
+        assert [s.key for s in _shms[1]].count(shm.key) == 1
+
+        # derived buffers are reused and kept in sync
+        derived = _derived[shm.key]['1m'].shm
+        assert derived.last()[-1]['time'] == (
+            shm.last()[-1]['time'] - shm.last()[-1]['time'] % 60)
+
+    finally:
+        _shms[1][:] = [s for s in _shms[1] if s.key != f'sim.{sym}']
+        _packed.pop(1, None)
+
+
+@tractor_test
+async def test_stream_writes_packed_tick_batches(loglevel, monkeypatch):
+    monkeypatch.setattr(
+        sim, 'get_config', lambda: {**sim._defaults, 'batch_s': 0.001})
+    sym = f'SIM.{uuid.uuid4()}'
+    entry = await open_shm_token(
+        f'sim.{sym}',
+        dtype_descr=base_ohlc_dtype.descr,
+        size=4096,
+    )
+    stream = sim.stream_quotes(shm_tokens={sym: entry['token']}, symbols=[sym])
+    try:
+        tokens, writers = await stream.__anext__()
+        shm = attach_shm_array(token=entry['token'])
+        ticks_shm = attach_shm_array(
+            token=(await lookup_shm_token(tick_shm_key(shm.key)))['token'])
+        volume = shm.last()[-1]['volume']
+
+        quote = (await stream.__anext__())[sym]
+        ticks = quote['ticks']
+        assert ticks.dtype == tick_dtype
+        assert (ticks['type'] == tick_types.index('trade')).all()
+
+        # the batch is pushed to the tick buffer as is and folded in to
+        # the last bar in one write
+        assert (ticks_shm.last(len(ticks)) == ticks).all()
+        last = shm.last()[-1]
+        assert last['close'] == quote['last'] == ticks['price'][-1]
+        assert last['volume'] == volume + ticks['size'].sum()
+    finally:
+        await stream.aclose()
+        _shms[1][:] = [s for s in _shms[1] if s.key != f'sim.{sym}']
+        _packed.pop(1, None)
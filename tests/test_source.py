@@ -0,0 +1,40 @@
+"""
+Data source conversion testing
+"""
+import datetime
+
+import numpy as np
+import pandas as pd
+
+from piker.data._source import from_df, base_ohlc_dtype
+
+
+def test_from_df():
+    t0 = datetime.datetime(2020, 6, 1, 9, 30)
+    df = pd.DataFrame({
+        'date': [t0 + datetime.timedelta(seconds=i) for i in range(3)],
+        'open': [1., 2., 3.],
+        'high': [1.5, np.nan, 3.5],
+        'low': [0.5, 1.5, 2.5],
+        'close': [1., 2., 3.],
+        'volume': [10, 20, 30],
+        'barCount': [1, 2, 3],
+    })
+    # coarse (eg. second or microsecond) resolution stamps
+    df['date'] = df['date'].astype('datetime64[s]')
+
+    bars = from_df(df)
+    assert bars.dtype == base_ohlc_dtype
+
+    # naive stamps are UTC
+    start = t0.replace(tzinfo=datetime.timezone.utc).timestamp()
+    assert bars['time'].tolist() == [start, start + 1, start + 2]
+    assert bars['index'].tolist() == [0, 1, 2]
+    assert bars['volume'].tolist() == [10, 20, 30]
+
+    # NaNs are interpolated
+    assert bars['high'][1] == 2.5
+
+    # stamps may also be the frame's (aware) index
+    aware = df.set_index('date').tz_localize('US/Eastern')
+    assert (from_df(aware)['time'] == bars['time'] + 4 * 3600).all()